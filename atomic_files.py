@@ -0,0 +1,38 @@
+"""
+Write files so that a crash never leaves half a file behind
+
+The column cache, the manifest, the figure sidecars, the fake hdf5 files, ...
+are all read again later, sometimes by other jobs at the same time. So they
+are written under a temporary name in the same folder first, and only renamed
+to the real name once they are complete. The rename (os.replace) happens all
+at once, so anyone reading the file sees either the old one or the whole new one.
+
+Example:
+	with replace_when_done('manifest.json') as tmp:
+		with open(tmp, 'w') as f:
+			json.dump(manifest, f)
+"""
+
+import contextlib
+import os
+
+
+@contextlib.contextmanager
+def replace_when_done(path, hidden=False):
+	"""
+	Context manager that gives a temporary path to write to instead of path
+	Receives:
+		path = the file to write (or overwrite)
+		hidden = start the temporary name with a dot, so e.g. a *.hdf5 glob doesn't see it
+	When the with block finishes, the temporary file becomes path.
+	If the with block raises an error, the temporary file is removed and path is left alone.
+	"""
+	folder, name = os.path.split(path)
+	tmp = os.path.join(folder, '{}{}.{}.tmp'.format('.' if hidden else '', name, os.getpid()))
+	try:
+		yield tmp
+	except BaseException:
+		if os.path.exists(tmp):
+			os.remove(tmp)
+		raise
+	os.replace(tmp, path)
@@ -0,0 +1,308 @@
+"""
+Time the analysis code on fake data of different sizes
+
+For every number of events (e.g. 1e5, 1e6, 1e7) this makes fake files with
+synthetic_data.py (once, they are kept in --data-dir for next time), and then
+times each step of making the plots:
+	load                   load_columns of the poster columns
+	load_compact           the same with dtype_policy='compact'
+	load_selection         the same with the poster selection (charge and interaction type cuts)
+	histogram1d            Histogram1D.fill of the true zenith
+	histogram2d            Histogram2D.fill of true vs reco zenith
+	find_contours_2D       median and 68% contours of reco vs true zenith
+	plot_1d_binned_slices  resolution vs energy of two reconstructions (without saving)
+	bootstrap_weighted     1000 weighted bootstrap resamples of the 68% band of the zenith error in energy slices
+	render                 drawing the 2D histogram with its contours and saving it as a png
+Every step is run --repeat times, and the fastest run counts (the others are
+mostly disturbed by other things on the machine). The files are read at least
+once before the load steps are timed, so they are in the page cache and the
+load times are about hdf5 and numpy, not the disk.
+
+The results go to a JSON file. Give it an older results file with --baseline
+and it prints how much faster or slower every step got, and exits with 1 if
+anything got slower by more than --tolerance.
+
+Run like:
+	python benchmark.py --events 1e5 1e6 1e7 -o results.json
+	(change something)
+	python benchmark.py --events 1e5 1e6 1e7 -o new_results.json --baseline results.json
+1e8 events works too, but the files take about 50 GB of disk (500 bytes per event)
+and the benchmarks need about 10 GB of memory.
+"""
+
+import argparse
+import gc
+import json
+import math
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import synthetic_data
+
+RESULTS_VERSION = 1
+
+COLUMNS = [
+	('NuPrimary', 'zenith'),
+	('NuPrimary', 'energy'),
+	('LineFit', 'zenith'),
+	('EHEOpheliaParticleSRT_ImpLF', 'zenith'),
+	]
+
+# same cuts as the poster (see reu.POSTER_SELECTION)
+SELECTION = "Homogenized_QTot.value > 1e4 and I3MCWeightDict.InteractionType >= 1"
+
+ZENITH_BINS = np.linspace(0, 180, 91)
+ENERGY_BINS = np.linspace(5, 9, 10)
+
+
+def bench_load(context):
+	from load_hdf5 import load_columns
+	load_columns(context['files'], COLUMNS, jobs=context['jobs'])
+
+
+def bench_load_compact(context):
+	from load_hdf5 import load_columns
+	load_columns(context['files'], COLUMNS, jobs=context['jobs'], dtype_policy='compact')
+
+
+def bench_load_selection(context):
+	from load_hdf5 import load_columns
+	load_columns(context['files'], COLUMNS, jobs=context['jobs'], selection=SELECTION)
+
+
+def bench_histogram1d(context):
+	from histograms import Histogram1D
+	Histogram1D(np.linspace(0, 180, 181)).fill(context['true_zenith'])
+
+
+def bench_histogram2d(context):
+	from histograms import Histogram2D
+	Histogram2D(ZENITH_BINS, ZENITH_BINS).fill(context['true_zenith'], context['linefit_zenith'])
+
+
+def bench_find_contours_2D(context):
+	from plot_contour import find_contours_2D
+	find_contours_2D(x_values=context['true_zenith'], y_values=context['linefit_zenith'], xbins=ZENITH_BINS)
+
+
+def bench_plot_1d_binned_slices(context):
+	import matplotlib.pyplot as plt
+	from plot_contour import plot_1d_binned_slices
+	plot_1d_binned_slices(truth=context['true_zenith'],
+		reco1=context['linefit_zenith'],
+		reco2=context['ophelia_zenith'],
+		xarray1=context['true_energy'],
+		plot_resolution=True,
+		xmin=5., xmax=9.,
+		x_name='True_Energy', x_units='log10(GeV)', y_units='Degrees',
+		reco1_name='LineFit', reco2_name='Ophelia',
+		save=False)
+	plt.close('all')
+
+
+def bench_bootstrap_weighted(context):
+	from bootstrap import bootstrap_binned_quantiles
+	bootstrap_binned_quantiles(context['true_energy'], context['linefit_zenith'] - context['true_zenith'],
+		ENERGY_BINS, [16, 50, 84], n_resamples=1000, weights=context['weights'], seed=0)
+
+
+def bench_render(context):
+	import matplotlib.pyplot as plt
+	import matplotlib.colors as colors
+	fig = plt.figure(figsize=(6,5))
+	ax = fig.add_subplot(111)
+	counts, xedges, yedges, im = context['hist'].draw(ax, cmin=1, norm=colors.LogNorm())
+	x, y_med, y_lo, y_hi = context['contours']
+	ax.plot(x, y_med, 'r-', label='Median')
+	ax.plot(x, y_lo, 'r-.', label='68% contour')
+	ax.plot(x, y_hi, 'r-.')
+	plt.colorbar(im, ax=ax)
+	ax.legend()
+	plt.tight_layout()
+	fig.savefig(os.path.join(context['workdir'], 'render.png'), dpi=300)
+	plt.close(fig)
+
+
+# name -> function(context), in the order they are run
+BENCHMARKS = {
+	'load': bench_load,
+	'load_compact': bench_load_compact,
+	'load_selection': bench_load_selection,
+	'histogram1d': bench_histogram1d,
+	'histogram2d': bench_histogram2d,
+	'find_contours_2D': bench_find_contours_2D,
+	'plot_1d_binned_slices': bench_plot_1d_binned_slices,
+	'bootstrap_weighted': bench_bootstrap_weighted,
+	'render': bench_render,
+}
+
+
+def time_it(function, context, repeat):
+	"""
+	Run function(context) repeat times
+	Returns:
+		list of the seconds each run took
+	"""
+	times = []
+	for _ in range(repeat):
+		gc.collect()
+		start = time.perf_counter()
+		function(context)
+		times.append(time.perf_counter() - start)
+	return times
+
+
+def make_context(files, jobs, workdir):
+	"""
+	Everything the benchmarks need, made once per number of events (this part is not timed)
+	"""
+	from load_hdf5 import load_columns
+	from histograms import Histogram2D
+	from plot_contour import find_contours_2D
+	# (this also reads every file once, so the load benchmarks start with the files in the page cache)
+	data = load_columns(files, COLUMNS, jobs=jobs)
+	context = {
+		'files': files,
+		'jobs': jobs,
+		'workdir': workdir,
+		'true_zenith': np.rad2deg(data['NuPrimary', 'zenith']),
+		'true_energy': np.log10(data['NuPrimary', 'energy']),
+		'linefit_zenith': np.rad2deg(data['LineFit', 'zenith']),
+		'ophelia_zenith': np.rad2deg(data['EHEOpheliaParticleSRT_ImpLF', 'zenith']),
+		}
+	del data
+	context['weights'] = load_columns(files, [('I3MCWeightDict', 'OneWeight')], jobs=jobs)['I3MCWeightDict', 'OneWeight']
+	context['hist'] = Histogram2D(ZENITH_BINS, ZENITH_BINS).fill(context['true_zenith'], context['linefit_zenith'])
+	context['contours'] = find_contours_2D(x_values=context['true_zenith'], y_values=context['linefit_zenith'],
+		xbins=ZENITH_BINS)[:4]
+	return context
+
+
+def machine_info():
+	"""
+	What the benchmarks ran on, so results from different machines aren't mixed up by accident
+	"""
+	import h5py
+	import matplotlib
+	return {
+		'host': platform.node(),
+		'platform': platform.platform(),
+		'processor': platform.processor(),
+		'cpus': os.cpu_count(),
+		'python': platform.python_version(),
+		'numpy': np.__version__,
+		'h5py': h5py.__version__,
+		'matplotlib': matplotlib.__version__,
+		}
+
+
+def run_benchmarks(event_counts, data_dir, names=None, repeat=3, jobs=1, events_per_file=1000000, seed=0):
+	"""
+	Run the benchmarks for every number of events
+	Receives:
+		event_counts = list of total numbers of events, e.g. [1e5, 1e6]
+		data_dir = folder for the fake files (one sub folder per number of events, reused next time)
+		names = names of the BENCHMARKS to run (default all of them)
+		repeat = number of times to run each one
+		jobs = number of processes for loading
+		events_per_file = the fake data is split into files of at most this many events
+	Returns:
+		results dict (what gets written to the JSON file)
+	"""
+	names = list(BENCHMARKS) if names is None else names
+	results = {'version': RESULTS_VERSION, 'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+		'machine': machine_info(), 'repeat': repeat, 'jobs': jobs, 'results': []}
+	for n_events in event_counts:
+		n_events = int(n_events)
+		n_files = max(1, math.ceil(n_events / events_per_file))
+		per_file = math.ceil(n_events / n_files)
+		start = time.perf_counter()
+		files = synthetic_data.make_dataset(os.path.join(data_dir, str(n_events)), n_files, per_file, seed=seed)
+		print('{} events in {} files ({:.1f} s to get them ready)'.format(n_files * per_file, n_files,
+			time.perf_counter() - start), flush=True)
+		with tempfile.TemporaryDirectory() as workdir:
+			context = make_context(files, jobs, workdir)
+			for name in names:
+				times = time_it(BENCHMARKS[name], context, repeat)
+				results['results'].append({'benchmark': name, 'events': n_events,
+					'best': min(times), 'median': float(np.median(times)), 'times': times})
+				print('  {:24s} {:9.4f} s'.format(name, min(times)), flush=True)
+			del context
+	return results
+
+
+def compare(results, baseline, tolerance=0.2):
+	"""
+	Compare the best times with the ones in a baseline results dict
+	Returns:
+		list of (benchmark, events, baseline seconds, new seconds, new / baseline, verdict),
+		verdict is 'slower' or 'faster' if the change is bigger than tolerance (0.2 = 20%),
+		'same' if not, and 'new' if the baseline doesn't have it
+	"""
+	old = {(row['benchmark'], row['events']): row['best'] for row in baseline['results']}
+	rows = []
+	for row in results['results']:
+		key = (row['benchmark'], row['events'])
+		if key not in old:
+			rows.append(key + (None, row['best'], None, 'new'))
+			continue
+		ratio = row['best'] / old[key] if old[key] > 0 else math.inf
+		verdict = 'same'
+		if ratio > 1. + tolerance:
+			verdict = 'slower'
+		elif ratio < 1. / (1. + tolerance):
+			verdict = 'faster'
+		rows.append(key + (old[key], row['best'], ratio, verdict))
+	return rows
+
+
+def print_comparison(rows):
+	print('{:24s} {:>10s} {:>10s} {:>10s} {:>7s}'.format('benchmark', 'events', 'baseline', 'now', 'ratio'))
+	for name, events, old, new, ratio, verdict in rows:
+		old_text = '{:9.4f}s'.format(old) if old is not None else '-'
+		ratio_text = '{:6.2f}x'.format(ratio) if ratio is not None else '-'
+		print('{:24s} {:>10d} {:>10s} {:9.4f}s {:>7s}  {}'.format(name, events, old_text, new, ratio_text, verdict))
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Time loading, histogramming, contours and drawing on fake data")
+	parser.add_argument("--events", type=synthetic_data.count, nargs='+', default=[100000, 1000000],
+		help="total numbers of events to run at, e.g. 1e5 1e6 1e7 (default 1e5 1e6)")
+	parser.add_argument("--data-dir", type=str, default=os.path.join(tempfile.gettempdir(), 'reu_benchmark'),
+		help="folder for the fake files, kept for next time (default: reu_benchmark in the temp folder)")
+	parser.add_argument("--events-per-file", type=synthetic_data.count, default=1000000,
+		help="largest number of events in one fake file (default 1e6)")
+	parser.add_argument("--only", type=str, nargs='+', default=None, choices=list(BENCHMARKS),
+		help="only run these benchmarks")
+	parser.add_argument("--repeat", type=int, default=3,
+		help="number of times to run every benchmark, the fastest counts (default 3)")
+	parser.add_argument("-j", "--jobs", type=int, default=1,
+		help="number of processes used for loading (default 1)")
+	parser.add_argument("-o", "--output", type=str, default=None,
+		help="JSON file to write the results to")
+	parser.add_argument("--baseline", type=str, default=None,
+		help="results JSON file of an earlier run to compare with")
+	parser.add_argument("--tolerance", type=float, default=0.2,
+		help="changes smaller than this are not counted as slower or faster (default 0.2 = 20 percent)")
+	args = parser.parse_args()
+
+	# never open a window for the plots
+	os.environ['MPLBACKEND'] = 'Agg'
+	results = run_benchmarks(args.events, args.data_dir, names=args.only, repeat=args.repeat, jobs=args.jobs,
+		events_per_file=args.events_per_file)
+	if args.output is not None:
+		with open(args.output, 'w') as f:
+			json.dump(results, f, indent=1)
+		print('Wrote {}'.format(args.output))
+	if args.baseline is not None:
+		with open(args.baseline) as f:
+			baseline = json.load(f)
+		rows = compare(results, baseline, args.tolerance)
+		print_comparison(rows)
+		if any(row[-1] == 'slower' for row in rows):
+			sys.exit(1)
@@ -0,0 +1,204 @@
+"""
+Fast per-bin statistics (medians, percentiles, ...) for the contour plots
+
+The old way to get the median of y in every x bin was to loop over the bins,
+make a mask like indices==i, copy y[mask] and call numpy.percentile on it.
+That touches every event once per bin. Here we sort the events once, by
+(bin, y), so that every bin becomes one sorted block of the array. Then
+numpy.searchsorted tells us where each block starts and stops, and any
+percentile of any bin is just a lookup (plus a linear interpolation, the
+same as numpy.percentile does by default).
+
+Weighted percentiles work the same way, but use the running sum of the
+weights inside each block to decide where a percentile sits. They give the
+same numbers as the wquantiles package, so we don't need it anymore.
+"""
+
+import numpy
+
+from histograms import digitize
+from instrumentation import staged
+
+
+def bin_order(x_values, y_values, xbins):
+	"""
+	Find the order that groups the events by x bin, sorted by y inside each bin
+	Receives:
+		x_values = array used to pick the bin
+		y_values = array we want statistics of
+		xbins = bin edges (bin i goes from xbins[i] up to, but not including, xbins[i+1])
+	Returns:
+		order = indices of the events that are inside the bins, in grouped + sorted order
+		starts = index in order where each bin starts
+		counts = number of events in each bin
+	"""
+	x_values = numpy.asarray(x_values)
+	y_values = numpy.asarray(y_values)
+	n_bins = len(xbins) - 1
+	# same bin numbers as numpy.digitize, so 1 is the first bin and 0 / n_bins+1 are outside
+	# (but without a search through the edges when they are evenly spaced, see histograms.py)
+	indices = digitize(x_values, xbins)
+	inside = (indices >= 1) & (indices <= n_bins)
+	keep = None
+	if not inside.all():
+		keep = numpy.flatnonzero(inside)
+		indices = indices[keep]
+		y_values = y_values[keep]
+	# sort by y first, then do a *stable* sort by bin number, which keeps the
+	# y order inside each bin. Bin numbers are small integers, so numpy can use
+	# a radix sort for the second step and this is much faster than numpy.lexsort
+	order = numpy.argsort(y_values)
+	indices = indices[order]
+	if n_bins < numpy.iinfo(numpy.int16).max:
+		indices = indices.astype(numpy.int16)
+	by_bin = numpy.argsort(indices, kind='stable')
+	order = order[by_bin]
+	if keep is not None:
+		order = keep[order]
+	counts = numpy.bincount(indices, minlength=n_bins + 1)[1:n_bins + 1]
+	starts = numpy.cumsum(counts) - counts
+	return order, starts, counts
+
+
+def sort_by_bin(x_values, y_values, xbins):
+	"""
+	Sort the events by x bin, and by y inside each bin
+	Returns:
+		y_sorted = y values of the events inside the bins, grouped by bin and sorted
+		starts = index in y_sorted where each bin starts
+		counts = number of events in each bin
+	"""
+	order, starts, counts = bin_order(x_values, y_values, xbins)
+	return numpy.asarray(y_values)[order], starts, counts
+
+
+def sorted_quantiles(y_sorted, starts, counts, percentiles):
+	"""
+	Percentiles of every block of an array that is already sorted block by block
+	Receives:
+		y_sorted, starts, counts = output of sort_by_bin
+		percentiles = list of percentiles (0 - 100)
+	Returns:
+		array with shape (len(percentiles), number of bins), NaN for empty bins
+	"""
+	percentiles = numpy.asarray(percentiles, dtype=float).reshape(-1, 1)
+	empty = counts == 0
+	last = numpy.maximum(counts - 1, 0)
+	# this is numpy.percentile's default "linear" method:
+	# the answer sits at position (n-1)*p/100 in the sorted values
+	position = last * percentiles / 100.
+	below = numpy.floor(position).astype(numpy.int64)
+	above = numpy.minimum(below + 1, last)
+	fraction = position - below
+	if len(y_sorted) == 0:
+		return numpy.full(position.shape, numpy.nan)
+	low_values = y_sorted[numpy.minimum(starts + below, len(y_sorted) - 1)]
+	high_values = y_sorted[numpy.minimum(starts + above, len(y_sorted) - 1)]
+	result = low_values + fraction * (high_values - low_values)
+	result[:, empty] = numpy.nan
+	return result
+
+
+def sorted_weighted_quantiles(y_sorted, w_sorted, starts, counts, percentiles):
+	"""
+	Weighted percentiles of every block of an array that is already sorted block by block
+	Receives:
+		y_sorted, starts, counts = like the output of sort_by_bin
+		w_sorted = the event weights, in the same order as y_sorted
+		percentiles = list of percentiles (0 - 100)
+	Returns:
+		array with shape (len(percentiles), number of bins), NaN for empty bins
+		(or bins whose weights add up to zero)
+
+	This is the wquantiles recipe, done for all bins at once: inside each bin
+	the point that belongs to event k is
+		P_k = (sum of weights up to and including k - weight_k/2) / (total weight of the bin)
+	and the answer is numpy.interp(percentile/100, P, y) of that bin.
+	"""
+	percentiles = numpy.asarray(percentiles, dtype=float).reshape(-1, 1)
+	n_bins = len(counts)
+	result = numpy.full((len(percentiles), n_bins), numpy.nan)
+	if len(y_sorted) == 0:
+		return result
+	w_sorted = numpy.asarray(w_sorted)
+
+	# running sum of the weights, restarted at the beginning of each bin
+	# (always added up in float64, even if the weights are float32, but without a float64 copy of them)
+	running = numpy.cumsum(w_sorted, dtype=numpy.float64)
+	stops = starts + counts
+	before = numpy.zeros(n_bins)
+	before[starts > 0] = running[starts[starts > 0] - 1]
+	totals = numpy.zeros(n_bins)
+	totals[counts > 0] = running[stops[counts > 0] - 1] - before[counts > 0]
+	bin_number = numpy.repeat(numpy.arange(n_bins), counts)
+	p_values = running - before[bin_number] - 0.5*w_sorted
+	good = totals > 0
+	p_values /= numpy.where(good, totals, 1.)[bin_number]
+
+	# P goes from 0 to 1 inside every bin, so (bin number + P) increases along the
+	# whole array, and one searchsorted finds every percentile in every bin
+	key = bin_number + p_values
+	q = percentiles / 100.
+	target = numpy.arange(n_bins) + q
+	right = numpy.searchsorted(key, target.ravel(), side='right').reshape(target.shape)
+	right = numpy.clip(right, starts, numpy.maximum(stops - 1, starts))
+	left = numpy.maximum(right - 1, starts)
+	# empty bins at the very end start past the last event, they are NaN anyway
+	right = numpy.minimum(right, len(y_sorted) - 1)
+	left = numpy.minimum(left, len(y_sorted) - 1)
+	# numpy.interp holds the end values flat outside of [P_first, P_last]
+	p_left = p_values[left]
+	p_right = p_values[right]
+	span = p_right - p_left
+	with numpy.errstate(divide='ignore', invalid='ignore'):
+		fraction = numpy.where(span > 0, (q - p_left) / span, 0.)
+	fraction = numpy.clip(fraction, 0., 1.)
+	fraction = numpy.where(q >= p_right, 1., fraction)
+	values = y_sorted[left] + fraction * (y_sorted[right] - y_sorted[left])
+	result[:, good] = values[:, good]
+	return result
+
+
+@staged('binned_quantiles')
+def binned_quantiles(x_values, y_values, xbins, percentiles, weights=None):
+	"""
+	Percentiles of y_values in every x bin, all bins at once
+	Receives:
+		x_values = array used to pick the bin (typically truth)
+		y_values = array we want percentiles of (typically reconstruction)
+		xbins = bin edges
+		percentiles = list of percentiles (0 - 100), e.g. [16, 50, 84]
+		weights = optional array of event weights
+	Returns:
+		array with shape (len(percentiles), len(xbins)-1), NaN for empty bins.
+		Without weights this matches
+			numpy.percentile(y_values[numpy.digitize(x_values, xbins)==i], percentiles)
+		and with weights it matches wquantiles.quantile(..., percentile/100.)
+	"""
+	if weights is None:
+		y_sorted, starts, counts = sort_by_bin(x_values, y_values, xbins)
+		return sorted_quantiles(y_sorted, starts, counts, percentiles)
+	order, starts, counts = bin_order(x_values, y_values, xbins)
+	y_sorted = numpy.asarray(y_values)[order]
+	w_sorted = numpy.asarray(weights)[order]
+	return sorted_weighted_quantiles(y_sorted, w_sorted, starts, counts, percentiles)
+
+
+def binned_median_band(x_values, y_values, xbins, percentile_in_peak=68.27, weights=None):
+	"""
+	Median and central percentile band of y_values in every x bin
+	(this is the statistics part of plot_1d_binned_slices)
+	Receives:
+		x_values = array used to pick the bin (e.g. log10 of the true energy)
+		y_values = array we want statistics of (e.g. reco - truth)
+		xbins = bin edges
+		percentile_in_peak = how much of the events the band should hold (68.27 = "1 sigma")
+		weights = optional array of event weights
+	Returns:
+		medians, lower, upper = one value per bin, NaN for empty bins
+	"""
+	left_tail_percentile  = (100.-percentile_in_peak)/2
+	right_tail_percentile = 100.-left_tail_percentile
+	medians, lower, upper = binned_quantiles(x_values, y_values, xbins,
+		[50., left_tail_percentile, right_tail_percentile], weights=weights)
+	return medians, lower, upper
@@ -0,0 +1,260 @@
+"""
+Bootstrap uncertainties for the per-bin medians and percentile bands
+
+The medians and 68% bands from find_contours_2D and plot_1d_binned_slices
+come from a finite number of events, and in the sparse high-energy bins they
+can move around a lot. Bootstrapping means: pretend the events we have are
+the whole population, draw a new sample of the same size from them (with
+replacement), recompute the percentiles, repeat many times, and look at how
+much the answers spread out.
+
+Doing that literally (re-drawing millions of events 1000 times) is far too
+slow, so we use two tricks:
+
+	Without weights, a percentile of a resample is just one (or an
+	interpolation between two neighbouring) of the sorted resampled events,
+	and the k-th smallest of n draws is the event at position floor(n*U)
+	where U follows a Beta(k, n-k+1) distribution. So we draw a few Beta
+	numbers per bin and per resample instead of n events. This is exactly the
+	usual bootstrap, just much cheaper.
+
+	With weights, each resample multiplies the event weights by Poisson(1)
+	random counts (the "Poisson bootstrap", which is what resampling turns
+	into for large samples). Drawing a Poisson number for every event in
+	every resample would again cost n per resample, so the sorted events of
+	each bin are cut into blocks of neighbouring events, and only the
+	resampled total weight of every block is drawn: a Gamma random number
+	with the same mean (sum of w) and variance (sum of w^2) as the sum of
+	Poisson(1)*w over the block. Inside a block the weight is spread like the
+	original weights, so the percentile is read off the same way as in
+	binned_stats.sorted_weighted_quantiles. A bin of c events gets blocks of
+	about sqrt(c)/8 events: a percentile moves by about sqrt(c) events from
+	resample to resample, so the blocks are much smaller than that spread,
+	and 1M events are only ~30k blocks. Bins with fewer than 256 events get
+	one event per block, which is exactly the Poisson bootstrap.
+
+Both use a seeded numpy random Generator, so results can be reproduced.
+"""
+
+import concurrent.futures
+import warnings
+
+import numpy
+
+from binned_stats import sort_by_bin, bin_order
+from instrumentation import staged
+
+
+def resample_quantiles(y_sorted, starts, counts, percentiles, n_resamples, rng):
+	"""
+	Percentiles of every bin for n_resamples bootstrap resamples (no weights)
+	Receives:
+		y_sorted, starts, counts = output of binned_stats.sort_by_bin
+		percentiles = list of percentiles (0 - 100)
+		n_resamples = number of resamples
+		rng = numpy random Generator
+	Returns:
+		array with shape (n_resamples, len(percentiles), number of bins), NaN for empty bins
+	"""
+	percentiles = numpy.asarray(percentiles, dtype=float).reshape(-1, 1)
+	empty = counts == 0
+	n = numpy.maximum(counts, 1).astype(float)
+	# numpy.percentile's position in the sorted resample, (n-1)*p/100,
+	# split into a whole number k (0 = smallest) and what's left over
+	position = (n - 1) * percentiles / 100.
+	k = numpy.floor(position)
+	fraction = position - k
+	shape = (n_resamples,) + position.shape
+	# U of the (k+1)-th smallest of n uniform draws, and the one right after it
+	u_low = rng.beta(k + 1, n - k, size=shape)
+	u_high = u_low + (1 - u_low) * rng.beta(1, numpy.maximum(n - k - 1, 1), size=shape)
+	j_low = numpy.minimum(numpy.floor(n * u_low), n - 1).astype(numpy.int64)
+	j_high = numpy.minimum(numpy.floor(n * u_high), n - 1).astype(numpy.int64)
+	if len(y_sorted) == 0:
+		return numpy.full(shape, numpy.nan)
+	last = len(y_sorted) - 1
+	low_values = y_sorted[numpy.minimum(starts + j_low, last)]
+	high_values = y_sorted[numpy.minimum(starts + j_high, last)]
+	result = low_values + fraction * (high_values - low_values)
+	result[:, :, empty] = numpy.nan
+	return result
+
+
+def weighted_blocks(w_sorted, starts, counts, events_per_block=None):
+	"""
+	Cut every bin of sorted events into blocks of neighbouring events (blocks never cross bins)
+	Receives:
+		w_sorted, starts, counts = events grouped by bin and sorted (see binned_stats.bin_order)
+		events_per_block = size of the blocks, None = about sqrt(events in the bin)/8
+	Returns:
+		block_starts = index of the first event of every block
+		block_bins = bin of every block
+		bin_blocks = index of the first block of every bin, and how many blocks each bin has
+	"""
+	block_starts = []
+	bin_first = numpy.zeros(len(counts), dtype=numpy.int64)
+	bin_n = numpy.zeros(len(counts), dtype=numpy.int64)
+	n_blocks = 0
+	for i, (start, count) in enumerate(zip(starts, counts)):
+		size = events_per_block or max(1, int(numpy.sqrt(count) / 8))
+		first_events = start + numpy.arange(0, count, size)
+		block_starts.append(first_events)
+		bin_first[i] = n_blocks
+		bin_n[i] = len(first_events)
+		n_blocks += len(first_events)
+	block_starts = numpy.concatenate(block_starts).astype(numpy.int64)
+	block_bins = numpy.repeat(numpy.arange(len(counts)), bin_n)
+	return block_starts, block_bins, (bin_first, bin_n)
+
+
+def resample_weighted_quantiles(y_sorted, w_sorted, starts, counts, percentiles, n_resamples, rng,
+	batch_events=20000000, events_per_block=None):
+	"""
+	Weighted percentiles of every bin for n_resamples Poisson bootstrap resamples
+	Receives:
+		y_sorted, w_sorted, starts, counts = events grouped by bin and sorted (see binned_stats.bin_order)
+		percentiles = list of percentiles (0 - 100)
+		n_resamples = number of resamples
+		rng = numpy random Generator
+		batch_events = roughly how many (resample, block) pairs to work on at once, to limit memory
+		events_per_block = size of the blocks (None = about sqrt(events in the bin)/8, see the top of this file)
+	Returns:
+		array with shape (n_resamples, len(percentiles), number of bins), NaN for empty bins
+	"""
+	percentiles = numpy.asarray(percentiles, dtype=float).reshape(-1, 1)
+	n_events = len(y_sorted)
+	n_bins = len(counts)
+	result = numpy.full((n_resamples, len(percentiles), n_bins), numpy.nan)
+	if n_events == 0:
+		return result
+	w_sorted = numpy.asarray(w_sorted, dtype=numpy.float64)
+
+	# everything that doesn't change between resamples is worked out once:
+	# sum of w and of w^2 in every block, and where every event sits inside its block
+	block_starts, block_bins, (bin_first, bin_n) = weighted_blocks(w_sorted, starts, counts, events_per_block)
+	n_blocks = len(block_starts)
+	block_sums = numpy.add.reduceat(w_sorted, block_starts)
+	block_squares = numpy.add.reduceat(w_sorted**2, block_starts)
+	block_sizes = numpy.diff(numpy.append(block_starts, n_events))
+	event_block = numpy.repeat(numpy.arange(n_blocks), block_sizes)
+	# the wquantiles point of an event is (weight before it + half its own weight),
+	# here as a fraction of its block's weight, so (block number + that) increases along the array
+	inside = numpy.cumsum(w_sorted) - numpy.repeat(numpy.cumsum(block_sums) - block_sums, block_sizes) - 0.5*w_sorted
+	with numpy.errstate(divide='ignore', invalid='ignore'):
+		inside = numpy.where(block_sums[event_block] > 0, inside / block_sums[event_block], 0.5)
+	event_key = event_block + numpy.clip(inside, 0., 1.)
+	# single events get the exact Poisson(1) count, bigger blocks a Gamma with the same mean and variance
+	single = block_sizes == 1
+	many = ~single & (block_squares > 0)
+	with numpy.errstate(divide='ignore', invalid='ignore'):
+		gamma_shape = block_sums[many]**2 / block_squares[many]
+		gamma_scale = block_squares[many] / block_sums[many]
+	bin_stops = starts + counts
+	q = percentiles / 100.
+
+	batch = max(1, min(n_resamples, batch_events // n_blocks))
+	for first in range(0, n_resamples, batch):
+		b = min(batch, n_resamples - first)
+		totals = numpy.zeros((b, n_blocks))
+		totals[:, single] = rng.poisson(1.0, size=(b, single.sum())) * block_sums[single]
+		totals[:, many] = rng.gamma(gamma_shape, gamma_scale, size=(b, many.sum()))
+		# weight of the resample before every block, and in every bin
+		running = numpy.cumsum(totals, axis=1)
+		bin_before = numpy.where(bin_first > 0, running[:, numpy.maximum(bin_first - 1, 0)], 0.)
+		bin_totals = numpy.where(bin_n > 0, running[:, numpy.maximum(bin_first + bin_n - 1, 0)], 0.) - bin_before
+		block_before = running - totals - bin_before[:, block_bins]
+		good = bin_totals > 0
+		fraction_after = (block_before + totals) / numpy.where(good, bin_totals, 1.)[:, block_bins]
+
+		# block in which every percentile of every bin of every resample falls (same searchsorted trick
+		# as in binned_stats, with the resample number on top of the bin number)
+		key = (numpy.arange(b)[:, None] * n_bins + block_bins + fraction_after).ravel()
+		target = numpy.arange(b)[:, None, None] * n_bins + numpy.arange(n_bins) + q[None]
+		block = numpy.searchsorted(key, target.ravel(), side='right').reshape(target.shape)
+		block = block - numpy.arange(b)[:, None, None] * n_blocks
+		block = numpy.clip(block, bin_first, numpy.maximum(bin_first + bin_n - 1, bin_first))
+		block = numpy.minimum(block, n_blocks - 1)
+		resample = numpy.broadcast_to(numpy.arange(b)[:, None, None], block.shape)
+		# and then where inside that block, on the same scale as event_key
+		wanted = q * bin_totals[:, None, :] - block_before[resample, block]
+		block_total = totals[resample, block]
+		with numpy.errstate(divide='ignore', invalid='ignore'):
+			inside_wanted = numpy.where(block_total > 0, wanted / block_total, 0.)
+		right = numpy.searchsorted(event_key, (block + numpy.clip(inside_wanted, 0., 1.)).ravel(),
+			side='right').reshape(block.shape)
+		right = numpy.clip(right, starts, numpy.maximum(bin_stops - 1, starts))
+		left = numpy.maximum(right - 1, starts)
+		right = numpy.minimum(right, n_events - 1)
+		left = numpy.minimum(left, n_events - 1)
+
+		def point(event):
+			# wquantiles point (between 0 and 1) of an event in this resample
+			event_in = event_block[event]
+			value = block_before[resample, event_in] + (event_key[event] - event_in) * totals[resample, event_in]
+			return value / numpy.where(good, bin_totals, 1.)[:, None, :]
+
+		p_left = point(left)
+		p_right = point(right)
+		span = p_right - p_left
+		with numpy.errstate(divide='ignore', invalid='ignore'):
+			fraction = numpy.where(span > 0, (q - p_left) / span, 0.)
+		fraction = numpy.clip(fraction, 0., 1.)
+		fraction = numpy.where(q >= p_right, 1., fraction)
+		values = y_sorted[left] + fraction * (y_sorted[right] - y_sorted[left])
+		values[~numpy.broadcast_to(good[:, None, :], values.shape)] = numpy.nan
+		result[first:first + b] = values
+	return result
+
+
+def run_resamples(y_sorted, w_sorted, starts, counts, percentiles, n_resamples, seed):
+	"""
+	One worker's share of the resamples (also used when there is no pool)
+	"""
+	rng = numpy.random.default_rng(seed)
+	if w_sorted is None:
+		return resample_quantiles(y_sorted, starts, counts, percentiles, n_resamples, rng)
+	return resample_weighted_quantiles(y_sorted, w_sorted, starts, counts, percentiles, n_resamples, rng)
+
+
+@staged('bootstrap')
+def bootstrap_binned_quantiles(x_values, y_values, xbins, percentiles, n_resamples=1000,
+	confidence=68.27, weights=None, seed=None, jobs=1):
+	"""
+	Bootstrap confidence intervals for the percentiles of y_values in every x bin
+	Receives:
+		x_values, y_values, xbins, percentiles, weights = same as binned_stats.binned_quantiles
+		n_resamples = number of bootstrap resamples
+		confidence = size of the confidence interval in percent (68.27 = "1 sigma")
+		seed = seed for the random numbers (None = different every time)
+		jobs = number of processes to split the resamples over (default 1, no pool)
+	Returns:
+		ci_lower, ci_upper = arrays with shape (len(percentiles), len(xbins)-1),
+		the confidence interval for each percentile in each bin (NaN for empty bins)
+	"""
+	if weights is None:
+		y_sorted, starts, counts = sort_by_bin(x_values, y_values, xbins)
+		w_sorted = None
+	else:
+		order, starts, counts = bin_order(x_values, y_values, xbins)
+		y_sorted = numpy.asarray(y_values)[order]
+		w_sorted = numpy.asarray(weights)[order]
+
+	# give every worker its own independent stream of random numbers
+	jobs = max(1, min(jobs, n_resamples))
+	seeds = numpy.random.SeedSequence(seed).spawn(jobs)
+	shares = [n_resamples // jobs + (i < n_resamples % jobs) for i in range(jobs)]
+	if jobs == 1:
+		samples = run_resamples(y_sorted, w_sorted, starts, counts, percentiles, n_resamples, seeds[0])
+	else:
+		with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+			parts = pool.map(run_resamples, [y_sorted] * jobs, [w_sorted] * jobs, [starts] * jobs,
+				[counts] * jobs, [percentiles] * jobs, shares, seeds)
+			samples = numpy.concatenate(list(parts))
+
+	tail = (100. - confidence) / 2
+	with warnings.catch_warnings():
+		# empty bins give all-NaN slices, that's expected
+		warnings.simplefilter('ignore', RuntimeWarning)
+		ci_lower = numpy.nanpercentile(samples, tail, axis=0)
+		ci_upper = numpy.nanpercentile(samples, 100. - tail, axis=0)
+	return ci_lower, ci_upper
@@ -0,0 +1,131 @@
+"""
+Check frame_pruning.py without icetray
+
+Runs the modules of create_hdf5.py (has_needed, store_primary and the
+pruning modules) on stand-in frames, once with and once without pruning, and
+checks that the hdf5 writer would get exactly the same values either way.
+The stand-in tray mixes the DAQ frame into the physics frames before every
+module, like icetray does, so deleting a DAQ key from a physics frame is
+checked to be harmless too.
+
+Run like:
+	python check_frame_pruning.py
+"""
+
+from frame_pruning import WRITER_KEYS, MCTREE_NAME, prune_frame, add_pruning
+
+
+class StandInFrame(dict):
+	"""
+	A dict that can stand in for an I3Frame: keys(), Has, Delete, and its stream ('Q' or 'P')
+	"""
+
+	def __init__(self, stream, **keys):
+		dict.__init__(self, **keys)
+		self.stream = stream
+		# the keys that were mixed in from the DAQ frame, not the frame's own
+		self.mixed = set()
+
+	def Has(self, key):
+		return key in self
+
+	def Delete(self, key):
+		del self[key]
+
+
+class StandInTray(object):
+	"""
+	Runs functions on frames in order, like I3Tray does with AddModule.
+	Like icetray, every module mixes the last DAQ frame it saw into the physics
+	frames (after taking out what the module before it mixed in), so a DAQ key
+	deleted from a physics frame is back again in the next module
+	"""
+
+	def __init__(self):
+		self.modules = []
+
+	def AddModule(self, function, name=None, Streams=None, **params):
+		self.modules.append((function, Streams, params))
+
+	def Execute(self, frames):
+		"""
+		Returns:
+			the frames that made it through every module
+		"""
+		last_daq = [None] * len(self.modules)
+		done = []
+		for frame in frames:
+			for i, (function, streams, params) in enumerate(self.modules):
+				if frame.stream == 'Q':
+					last_daq[i] = dict(frame)
+				elif last_daq[i] is not None:
+					for key in frame.mixed & set(frame.keys()):
+						frame.Delete(key)
+					frame.mixed = set(key for key in last_daq[i] if key not in frame)
+					frame.update((key, last_daq[i][key]) for key in frame.mixed)
+				if streams is not None and frame.stream not in streams:
+					continue
+				if function(frame, **params) is False:
+					break
+			else:
+				done.append(frame)
+		return done
+
+
+def check_with_stand_ins():
+	"""
+	Run the modules of create_hdf5.py, with and without pruning, on stand-in frames,
+	and check that the hdf5 writer gets exactly the same values either way
+	"""
+	def make_frames():
+		mctree = [('nu_e', 1e6), ('mu', 5e5), ('nu_mu', 2e6)]
+		daq = StandInFrame('Q', I3EventHeader='header 1', SRTInIcePulses='pulses', I3MCWeightDict='weights')
+		daq[MCTREE_NAME] = mctree
+		physics = StandInFrame('P', I3EventHeader='header 1', Homogenized_QTot=12345.,
+			EHEPortiaEventSummarySRT='portia', EHEOpheliaParticleSRT_ImpLF='ophelia', LineFit='linefit',
+			SplitInIcePulses='split pulses', OnlineL2_SplineMPE='spline')
+		no_ophelia = StandInFrame('P', I3EventHeader='header 1', LineFit='linefit 2')
+		return [daq, physics, no_ophelia]
+
+	def has_needed(frame):
+		return frame.Has('EHEOpheliaParticleSRT_ImpLF')
+
+	def store_primary(frame, mctree_name):
+		# stand-in for dataclasses.get_most_energetic_neutrino
+		if frame.Has(mctree_name):
+			frame['NuPrimary'] = max((particle for particle in frame[mctree_name] if particle[0].startswith('nu')),
+				key=lambda particle: particle[1])
+
+	def run(prune):
+		tray = StandInTray()
+		if prune:
+			add_pruning(tray, 'prune_physics', WRITER_KEYS, ['P'])
+			add_pruning(tray, 'prune_daq', WRITER_KEYS + [MCTREE_NAME], ['Q'])
+		tray.AddModule(has_needed, Streams=['P'])
+		tray.AddModule(store_primary, mctree_name=MCTREE_NAME, Streams=['Q'])
+		if prune:
+			add_pruning(tray, 'prune_mctree', WRITER_KEYS, ['Q'])
+		# what I3HDFWriter would write: the writer keys of the physics frames
+		rows = []
+		tray.AddModule(lambda frame: rows.append({key: frame[key] for key in WRITER_KEYS if frame.Has(key)}),
+			Streams=['P'])
+		frames = tray.Execute(make_frames())
+		return rows, frames
+
+	frame = StandInFrame('P', LineFit=1, SRTInIcePulses=2)
+	assert prune_frame(frame, keep=['LineFit']) is True and dict(frame) == {'LineFit': 1}
+
+	rows, _ = run(prune=False)
+	pruned_rows, frames = run(prune=True)
+	assert len(rows) == 1 and set(rows[0]) == set(WRITER_KEYS), rows
+	assert rows[0]['NuPrimary'] == ('nu_mu', 2e6), "store_primary didn't find the neutrino in the MC tree"
+	assert pruned_rows == rows, (pruned_rows, rows)
+	# and the pruned frames really are smaller: only writer keys are left
+	assert all(set(frame.keys()) <= set(WRITER_KEYS) for frame in frames), frames
+	print('pruned and unpruned frames give the same writer rows: {}'.format(sorted(pruned_rows[0])))
+
+
+if __name__ == '__main__':
+	# try it out without icetray:
+	#    python check_frame_pruning.py
+	check_with_stand_ins()
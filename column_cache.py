@@ -0,0 +1,155 @@
+"""
+On-disk cache for the columns that load_hdf5 reads
+
+Reading the same NuPrimary / LineFit / Homogenized_QTot columns out of
+hundreds of hdf5 files every time we change a plot label is slow. So the first
+time a column is loaded we also save it as one flat .npy file, and the next
+time we just memory-map that file (np.load with mmap_mode), which takes
+almost no time no matter how many input files there were.
+
+Layout of the cache folder:
+	cache_dir/<hash of the input file paths>/
+		inputs.json                          the files, their sizes and mtimes, and how many rows each file gave
+		NuPrimary.azimuth.npy                one file per (table, field)
+		...
+
+If any input file changes (or is added/removed), its size or mtime changes,
+inputs.json no longer matches, and the old .npy files are thrown away.
+Files that miss a column are skipped, so different columns can come from
+different files. All .npy files in a folder always come from the same files
+(the rows per file in inputs.json): if new columns come out different, all
+of the asked for columns are read again together, and the other ones are thrown away.
+Loading with a selection (see load_hdf5.parse_selection) or with join gets its
+own folder, since the columns then hold a different set of events, and so does
+each dtype policy, since the columns then have different dtypes. With join,
+the folder also depends on which tables are joined (the tables of the columns
+and of the selection): joining NuPrimary with LineFit keeps different events
+than joining NuPrimary with Ophelia, so their columns must never be mixed.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from load_hdf5 import read_columns, parse_selection
+from atomic_files import replace_when_done
+
+
+def file_stats(files):
+	"""
+	Size and modification time of each file, used to tell if the cache is stale
+	"""
+	stats = []
+	for file in files:
+		st = os.stat(file)
+		stats.append([os.path.abspath(file), st.st_size, st.st_mtime_ns])
+	return stats
+
+
+def joined_tables(columns, selection=None):
+	"""
+	The tables load_hdf5 lines up with join=True, in the order it does (the first one decides the row order)
+	"""
+	needed = list(columns)
+	if selection is not None:
+		needed += parse_selection(selection)[0]
+	return list(dict.fromkeys(table for table, field in needed))
+
+
+def cache_folder(files, cache_dir, selection=None, join=False, dtype_policy='full', columns=()):
+	"""
+	Folder inside cache_dir for this list of input files (same files in the same order -> same folder)
+	(with join, columns are needed too, to know which tables are joined)
+	"""
+	paths = '\n'.join(os.path.abspath(file) for file in files)
+	if selection is not None:
+		paths += '\nselection: ' + selection
+	if join:
+		paths += '\njoin: ' + ', '.join(joined_tables(columns, selection))
+	if dtype_policy != 'full':
+		paths += '\ndtype policy: ' + dtype_policy
+	return os.path.join(cache_dir, hashlib.sha1(paths.encode()).hexdigest()[:16])
+
+
+def column_path(folder, column):
+	return os.path.join(folder, '{}.{}.npy'.format(*column))
+
+
+def save_array(path, array):
+	with replace_when_done(path) as tmp:
+		with open(tmp, 'wb') as f:
+			np.save(f, np.ascontiguousarray(array))
+
+
+def clear_folder(folder):
+	for name in os.listdir(folder):
+		if name.endswith('.npy'):
+			os.remove(os.path.join(folder, name))
+
+
+def load_cached(files, columns, cache_dir, jobs=1, selection=None, join=False, dtype_policy='full'):
+	"""
+	Same as load_hdf5.load_columns, but goes through the cache in cache_dir
+	Receives:
+		files = list of paths to hdf5 files
+		columns = list of (table, field) pairs
+		cache_dir = folder to keep the cache in (it is made if it doesn't exist)
+		jobs = number of processes used for anything that has to be read from hdf5
+		selection = optional selection string, passed on to load_hdf5
+		join = line up the tables by event header, passed on to load_hdf5
+		dtype_policy = 'full' or 'compact', passed on to load_hdf5
+	Returns:
+		dict that maps each (table, field) pair to a 1D array.
+		Columns that came from the cache are read-only memory-mapped arrays.
+	"""
+	files = list(files)
+	columns = list(columns)
+	folder = cache_folder(files, cache_dir, selection, join, dtype_policy, columns)
+	os.makedirs(folder, exist_ok=True)
+
+	# if the input files changed since the cache was written, start over
+	stats = file_stats(files)
+	stats_path = os.path.join(folder, 'inputs.json')
+	inputs = None
+	if os.path.exists(stats_path):
+		with open(stats_path) as f:
+			inputs = json.load(f)
+	if not isinstance(inputs, dict) or inputs.get('files') != stats:
+		clear_folder(folder)
+		inputs = {'files': stats, 'rows': None}
+
+	data = {}
+	missing = []
+	for column in columns:
+		path = column_path(folder, column)
+		if os.path.exists(path):
+			data[column] = np.load(path, mmap_mode='r')
+		else:
+			missing.append(column)
+
+	if missing:
+		rows = []
+		new = read_columns(files, missing, jobs=jobs, selection=selection, join=join, dtype_policy=dtype_policy,
+			rows_per_file=rows)
+		if data and rows != inputs['rows']:
+			# the new columns skipped a different set of files than the cached ones
+			# (even if the total number of rows happens to be the same),
+			# so read everything together to keep the rows lined up
+			rows = []
+			new = read_columns(files, columns, jobs=jobs, selection=selection, join=join,
+				dtype_policy=dtype_policy, rows_per_file=rows)
+			data = {}
+		if rows != inputs['rows']:
+			# the columns cached before (and not asked for now) have other rows, so they have to go
+			clear_folder(folder)
+			inputs['rows'] = rows
+			with replace_when_done(stats_path) as tmp:
+				with open(tmp, 'w') as f:
+					json.dump(inputs, f)
+		for column, array in new.items():
+			save_array(column_path(folder, column), array)
+			data[column] = array
+
+	return data
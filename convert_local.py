@@ -0,0 +1,151 @@
+"""
+Convert many i3 files to hdf5 on one machine, using all of its cores
+
+This does the same job as run_cluster.pbs, but without SLURM: it starts
+create_hdf5.py for every input file, a few at a time (one per worker), and
+retries the ones that fail. Each conversion is its own create_hdf5.py
+process, so the workers here are just threads that wait for them.
+
+Run like (inside the icetray environment, so create_hdf5.py can run):
+	python convert_local.py "/data/21220/*.i3.zst" -o /data/21220/hdf5 -j 8
+
+Every input gets a log file (logs/<name>.log by default) with the output of
+all of its attempts. Outputs are first written to a temporary name and only
+renamed to <name>.hdf5 once create_hdf5.py finished without errors. With
+--manifest, inputs that are already converted (see manifest.py) are skipped.
+At the end it prints how many events and MB per second it got through.
+"""
+
+import argparse
+import concurrent.futures
+import glob
+import os
+import subprocess
+import sys
+import time
+
+import h5py
+
+import manifest
+
+
+def count_events(hdf5_file):
+	"""
+	Number of events the hdf5 writer saved (rows of the I3EventHeader table)
+	"""
+	with h5py.File(hdf5_file, 'r') as file_in:
+		if 'I3EventHeader' not in file_in:
+			return 0
+		return file_in['I3EventHeader'].shape[0]
+
+
+def convert_one(input_file, output_dir, log_dir, create_hdf5, retries=1, extra_args=()):
+	"""
+	Run create_hdf5.py on one input, trying again up to retries more times if it fails
+	Returns:
+		dict with the input, output, ok (True/False), attempts, seconds, events and input bytes
+	"""
+	name = manifest.output_name(input_file)
+	output_file = os.path.join(output_dir, name + '.hdf5')
+	tmp_stem = os.path.join(output_dir, '.{}.{}.tmp'.format(name, os.getpid()))
+	log_file = os.path.join(log_dir, name + '.log')
+	result = {'input': input_file, 'output': output_file, 'ok': False, 'attempts': 0,
+		'seconds': 0., 'events': 0, 'bytes': os.path.getsize(input_file)}
+
+	with open(log_file, 'a') as log:
+		for attempt in range(retries + 1):
+			result['attempts'] = attempt + 1
+			command = [create_hdf5, '-i', input_file, '-o', tmp_stem] + list(extra_args)
+			log.write('=== attempt {}: {}\n'.format(attempt + 1, ' '.join(command)))
+			log.flush()
+			start = time.time()
+			returncode = subprocess.call(command, stdout=log, stderr=subprocess.STDOUT)
+			result['seconds'] += time.time() - start
+			if returncode == 0 and os.path.exists(tmp_stem + '.hdf5'):
+				os.replace(tmp_stem + '.hdf5', output_file)
+				result['ok'] = True
+				result['events'] = count_events(output_file)
+				log.write('=== done in {:.1f} s, {} events\n'.format(result['seconds'], result['events']))
+				break
+			log.write('=== failed with return code {}\n'.format(returncode))
+			if os.path.exists(tmp_stem + '.hdf5'):
+				os.remove(tmp_stem + '.hdf5')
+	return result
+
+
+def convert_all(input_files, output_dir, jobs=1, retries=1, log_dir=None, create_hdf5=None,
+	manifest_path=None, extra_args=()):
+	"""
+	Convert all input_files into output_dir, jobs at a time
+	Returns:
+		list of the result dicts of convert_one, and the wall time in seconds
+	"""
+	if log_dir is None:
+		log_dir = os.path.join(output_dir, 'logs')
+	if create_hdf5 is None:
+		create_hdf5 = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'create_hdf5.py')
+	os.makedirs(output_dir, exist_ok=True)
+	os.makedirs(log_dir, exist_ok=True)
+
+	if manifest_path is not None:
+		todo = manifest.stale_inputs(manifest.load_manifest(manifest_path), input_files, output_dir)
+		print('{} of {} inputs are already converted'.format(len(input_files) - len(todo), len(input_files)))
+		input_files = todo
+
+	results = []
+	start = time.time()
+	# the biggest files first, so one big file doesn't end up running alone at the very end
+	input_files = sorted(input_files, key=os.path.getsize, reverse=True)
+	with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+		futures = [pool.submit(convert_one, input_file, output_dir, log_dir, create_hdf5, retries, extra_args)
+			for input_file in input_files]
+		for future in concurrent.futures.as_completed(futures):
+			result = future.result()
+			results.append(result)
+			print('{} {} ({:.1f} s, {} attempt(s))'.format('done  ' if result['ok'] else 'FAILED',
+				result['input'], result['seconds'], result['attempts']))
+			if result['ok'] and manifest_path is not None:
+				manifest.record_outputs(manifest_path, [result['input']], output_dir)
+	return results, time.time() - start
+
+
+def print_summary(results, wall_time):
+	good = [result for result in results if result['ok']]
+	failed = [result for result in results if not result['ok']]
+	events = sum(result['events'] for result in good)
+	megabytes = sum(result['bytes'] for result in good) / 1e6
+	print('Converted {} files ({} failed) in {:.1f} s'.format(len(good), len(failed), wall_time))
+	if wall_time > 0:
+		print('  {} events, {:.1f} events/s'.format(events, events / wall_time))
+		print('  {:.1f} MB of input, {:.2f} MB/s'.format(megabytes, megabytes / wall_time))
+	for result in failed:
+		print('  failed: {}'.format(result['input']))
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser()
+	parser.add_argument("inputs", nargs='+',
+		help="input i3 files, or quoted glob patterns like \"/data/*.i3.zst\"")
+	parser.add_argument("-o", "--output-dir", type=str, required=True,
+		help="folder to write the hdf5 files to")
+	parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+		help="number of conversions to run at the same time (default: number of cores)")
+	parser.add_argument("--retries", type=int, default=1,
+		help="how many more times to try a file that failed")
+	parser.add_argument("--log-dir", type=str, default=None,
+		help="folder for the per-file logs (default: <output-dir>/logs)")
+	parser.add_argument("--manifest", type=str, default=None,
+		help="manifest JSON file, to skip inputs that are already converted")
+	parser.add_argument("--prune", action="store_true",
+		help="pass --prune on to create_hdf5.py")
+	args = parser.parse_args()
+
+	input_files = []
+	for pattern in args.inputs:
+		input_files += sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+	extra_args = ['--prune'] if args.prune else []
+	results, wall_time = convert_all(input_files, args.output_dir, jobs=args.jobs, retries=args.retries,
+		log_dir=args.log_dir, manifest_path=args.manifest, extra_args=extra_args)
+	print_summary(results, wall_time)
+	if not all(result['ok'] for result in results):
+		sys.exit(1)
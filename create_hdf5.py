@@ -4,79 +4,153 @@
 from icecube import icetray, dataio, dataclasses, hdfwriter
 from I3Tray import I3Tray
 
+from frame_pruning import WRITER_KEYS, MCTREE_NAME, add_pruning
+from manifest import output_name
+
 # so this part uses the python "argument parser"
 # you can read more about it e.g. here: https://realpython.com/command-line-interfaces-python-argparse/
 # it allows us to run commands like "python -o something"
 # and then "something" (whether it be a number, word, etc) can be used in our code!
-# we have two somethings for this: an input file and output file
+# we have two somethings for this: the input files and an output file
 # so, we could run like:
 #    python create_hdf5.py -i /mnt/research/IceCube/Level2_IC86.2016_NuMu.021217.000000.i3.zst -o test
-
-import argparse, copy
+# starting python and icetray takes a while, so you can also give many input files at once
+# (or a text file with one path per line), and they all go through one tray:
+#    python create_hdf5.py -i file1.i3.zst file2.i3.zst -o combined
+#    python create_hdf5.py --filelist my_files.txt -o combined
+# or, with --per-input, get one output per input file, written into the -o folder:
+#    python create_hdf5.py --filelist my_files.txt --per-input -o /some/output/folder
+
+import argparse, copy, os, sys
 parser = argparse.ArgumentParser()
-parser.add_argument("-i", type=str,
-	dest="input_file",required=True,
-	help="full path to the input file",
+parser.add_argument("-i", type=str, nargs='+',
+	dest="input_files",default=[],
+	help="full path to the input file(s)",
+	)
+parser.add_argument("--filelist", type=str,
+	dest="filelist",default=None,
+	help="text file with the full path of one input file per line",
 	)
 parser.add_argument("-o", type=str,
 	dest="output_file",required=True,
 	help='''full path to the output file, without file extention. 
-			That is, provide "test" not "test.i3.bz2"''',
+			That is, provide "test" not "test.i3.bz2".
+			With --per-input, this is the folder to write the outputs to''',
 	)
-args = parser.parse_args()
-
-
-
-# start up icetray
-tray = I3Tray()
-
-# and tell icetray to read a file
-tray.AddModule("I3Reader", filenamelist=[args.input_file])
-
-
-# next, we are only going to look at events which have the "Portia" and "Ophelia" reconstructions
-# so, we build a little function that checks if the frame has the portia information
-# and if it doesn't, then we will get rid of the frame
-
-def has_needed(frame):
-	return frame.Has('EHEOpheliaParticleSRT_ImpLF')
-
-# drop every frame that doesn't have the Portia information we need
-tray.AddModule(has_needed, # 'something',
-	Streams=[icetray.I3Frame.Physics],
+parser.add_argument("--per-input", action="store_true",
+	dest="per_input",
+	help="write one output per input file (named like the input) instead of one combined output",
 	)
-
-
-# now we write a little bit of code that will find the most energetic neutrino
-# and saves it to the frame for us to look at later
-def store_primary(frame, mctree_name):
-	if frame.Has(mctree_name):
-		p = dataclasses.get_most_energetic_neutrino(frame[mctree_name])
-		frame['NuPrimary'] = copy.copy(p)
-
-tray.AddModule(store_primary, 
-	mctree_name='I3MCTree_preMuonProp',
-	Streams=[icetray.I3Frame.DAQ]
-	)
-
-
-# next, we can use the IceCube HDF5 writer to save things to file
-# in this case, we are going to save out a few variables, given by the "Keys" argument
-# in particular, Homogenized_QTot, EHEPortiaEventSummarySRT, etc.
-# here is where you could add a new variable, for example, LineFit!
-# because this is monte carlo, we know the right answer, and so we save it too (that is)
-tray.AddSegment(hdfwriter.I3HDFWriter, 'hdf', 
-	Output=f'{args.output_file}.hdf5', 
-	Keys=[ 'I3EventHeader', 'Homogenized_QTot', 'EHEPortiaEventSummarySRT', 
-	'EHEOpheliaParticleSRT_ImpLF', 'LineFit', 'NuPrimary' ],
-	SubEventStreams=['InIceSplit']
+parser.add_argument("--prune", action="store_true",
+	dest="prune",
+	help="delete every frame object the hdf5 writer doesn't need, right after reading it",
 	)
+args = parser.parse_args()
 
-# sometimes it is also useful to write our results out in i3 format so we can look at them
-# tray.AddModule("I3Writer", "write",
-# 	filename=f'{args.output_file}.i3.zst',
-# 	Streams=[icetray.I3Frame.DAQ, icetray.I3Frame.Physics],
-# 	DropOrphanStreams=[icetray.I3Frame.Calibration, icetray.I3Frame.DAQ]
-# 	)
+input_files = list(args.input_files)
+if args.filelist is not None:
+	with open(args.filelist) as f:
+		input_files += [line.strip() for line in f if line.strip()]
+if len(input_files) == 0:
+	parser.error("no input files, use -i and/or --filelist")
+
+
+def convert(input_files, output_file, prune=False):
+	"""
+	Run one tray that reads all of input_files and writes output_file.hdf5
+	With prune=True, the frames only carry the keys we need through the tray
+	"""
+	# start up icetray
+	tray = I3Tray()
+
+	# and tell icetray to read the files (one after another)
+	tray.AddModule("I3Reader", filenamelist=list(input_files))
+
+	# Level2 frames hold lots of things we never look at, so (if asked to) we throw them
+	# away right here. The DAQ frames still need the MC tree until store_primary has run
+	if prune:
+		add_pruning(tray, 'prune_physics', WRITER_KEYS, [icetray.I3Frame.Physics])
+		add_pruning(tray, 'prune_daq', WRITER_KEYS + [MCTREE_NAME], [icetray.I3Frame.DAQ])
+
+	# next, we are only going to look at events which have the "Portia" and "Ophelia" reconstructions
+	# so, we build a little function that checks if the frame has the portia information
+	# and if it doesn't, then we will get rid of the frame
+
+	def has_needed(frame):
+		return frame.Has('EHEOpheliaParticleSRT_ImpLF')
+
+	# drop every frame that doesn't have the Portia information we need
+	tray.AddModule(has_needed, # 'something',
+		Streams=[icetray.I3Frame.Physics],
+		)
+
+
+	# now we write a little bit of code that will find the most energetic neutrino
+	# and saves it to the frame for us to look at later
+	def store_primary(frame, mctree_name):
+		if frame.Has(mctree_name):
+			p = dataclasses.get_most_energetic_neutrino(frame[mctree_name])
+			frame['NuPrimary'] = copy.copy(p)
+
+	tray.AddModule(store_primary, 
+		mctree_name=MCTREE_NAME,
+		Streams=[icetray.I3Frame.DAQ]
+		)
+
+	# now that we have the NuPrimary, the (big) MC tree can go too
+	if prune:
+		add_pruning(tray, 'prune_mctree', WRITER_KEYS, [icetray.I3Frame.DAQ])
+
+
+	# next, we can use the IceCube HDF5 writer to save things to file
+	# in this case, we are going to save out a few variables, given by the "Keys" argument
+	# in particular, Homogenized_QTot, EHEPortiaEventSummarySRT, etc.
+	# here is where you could add a new variable, for example, LineFit! (add it to WRITER_KEYS in frame_pruning.py)
+	# because this is monte carlo, we know the right answer, and so we save it too (that is)
+	# the writer writes to a temporary (hidden) name, and the output only gets its real name
+	# once the tray got through every frame, so a tray that throws or a job that runs out of
+	# time never leaves a half-written output_file.hdf5 behind (the same as convert_local.py does)
+	tmp_file = os.path.join(os.path.dirname(output_file),
+		'.{}.{}.tmp.hdf5'.format(os.path.basename(output_file), os.getpid()))
+	tray.AddSegment(hdfwriter.I3HDFWriter, 'hdf', 
+		Output=tmp_file, 
+		Keys=WRITER_KEYS,
+		SubEventStreams=['InIceSplit']
+		)
+
+	# sometimes it is also useful to write our results out in i3 format so we can look at them
+	# tray.AddModule("I3Writer", "write",
+	# 	filename=f'{output_file}.i3.zst',
+	# 	Streams=[icetray.I3Frame.DAQ, icetray.I3Frame.Physics],
+	# 	DropOrphanStreams=[icetray.I3Frame.Calibration, icetray.I3Frame.DAQ]
+	# 	)
+
+	try:
+		tray.Execute()
+	except BaseException:
+		if os.path.exists(tmp_file):
+			os.remove(tmp_file)
+		raise
+	os.replace(tmp_file, f'{output_file}.hdf5')
+
+
+if args.per_input:
+	# one output per input, all from this one python process,
+	# so the icetray environment and imports are only set up once.
+	# (every input still gets its own tray and hdf5 writer: one writer only writes
+	# one file, and the frames don't say which input they came from, so a single
+	# tray can't split its output by input. For one tray for everything, leave out --per-input)
+	# if one input fails, the others are still converted, and the exit code says something went wrong
+	os.makedirs(args.output_file, exist_ok=True)
+	failed = []
+	for input_file in input_files:
+		try:
+			convert([input_file], os.path.join(args.output_file, output_name(input_file)), prune=args.prune)
+		except Exception as error:
+			print('Failed to convert {}: {}'.format(input_file, error), file=sys.stderr)
+			failed.append(input_file)
+	if failed:
+		sys.exit(1)
+else:
+	convert(input_files, args.output_file, prune=args.prune)
 
-tray.Execute()
@@ -0,0 +1,171 @@
+"""
+Skip figures that would come out exactly the same as last time
+
+Most of the time we re-run a script, only one or two of its figures actually
+change. So before a figure is made, everything that goes into it is put
+together and hashed into a "fingerprint":
+	- the input files, with their sizes and modification times
+	- the columns the figure uses, the selection, join and dtype policy
+	- the bins and other plotting parameters (bootstrap, names, ...)
+	- the code: the .py files of this folder that the script imported (so changing
+	  e.g. benchmark.py or create_hdf5.py doesn't count), and the numpy and matplotlib versions
+Next to every figure we write a small JSON file (test.png -> test.png.json)
+with the fingerprint and what went into it, so it is always possible to tell
+where a figure came from. If the figure and its JSON file are there and the
+fingerprint still matches, the figure is up to date, and the script skips it
+(and if every figure is up to date, it doesn't even load the data).
+
+Example:
+	figures = from_args(args)
+	if not figures.fresh('test.png', columns, {'bins': bins}):
+		... make the figure ...
+		fig.savefig('test.png')
+		figures.record('test.png')
+Give the scripts --force to make every figure again anyway.
+"""
+
+import hashlib
+import json
+import os
+import sys
+import time
+
+from column_cache import file_stats
+from atomic_files import replace_when_done
+
+# sidecar file of a figure = figure path + this
+SIDECAR = '.json'
+
+code_versions = {}
+
+
+def code_files():
+	"""
+	The .py files of this folder that are imported right now, i.e. the code that makes the figures
+	"""
+	folder = os.path.dirname(os.path.abspath(__file__))
+	files = set()
+	for module in list(sys.modules.values()):
+		path = getattr(module, '__file__', None)
+		if path and path.endswith('.py') and os.path.dirname(os.path.abspath(path)) == folder:
+			files.add(os.path.abspath(path))
+	return sorted(files)
+
+
+def code_version(files):
+	"""
+	Hash of the given .py files (and the numpy/matplotlib versions), so changing any of them makes new figures
+	"""
+	files = tuple(files)
+	if files not in code_versions:
+		import numpy
+		import matplotlib
+		digest = hashlib.sha1()
+		for path in files:
+			with open(path, 'rb') as f:
+				digest.update(os.path.basename(path).encode() + b'\0' + f.read() + b'\0')
+		digest.update('numpy {} matplotlib {}'.format(numpy.__version__, matplotlib.__version__).encode())
+		code_versions[files] = digest.hexdigest()
+	return code_versions[files]
+
+
+def jsonable(value):
+	"""
+	Turn numpy arrays and numbers into plain lists and numbers for json
+	"""
+	if hasattr(value, 'tolist'):
+		return value.tolist()
+	return str(value)
+
+
+def sidecar_path(output):
+	return output + SIDECAR
+
+
+class FigureCache(object):
+	"""
+	Fingerprints for the figures of one run of a script
+	Receives:
+		files = the input files
+		selection, join, dtype_policy = how the data is loaded (see load_hdf5.load_columns)
+		force = if True, no figure is ever up to date (they all get made again)
+	"""
+
+	def __init__(self, files, selection=None, join=False, dtype_policy='full', force=False):
+		self.inputs = {
+			'files': file_stats(files),
+			'selection': selection,
+			'join': join,
+			'dtype_policy': dtype_policy,
+			'code': code_version(code_files()),
+			'code_files': [os.path.basename(path) for path in code_files()],
+			}
+		self.force = force
+		self.pending = {}
+
+	def describe(self, columns, params=None):
+		"""
+		Everything that goes into a figure, as a plain dict
+		"""
+		description = dict(self.inputs)
+		description['columns'] = [list(column) for column in columns]
+		description['params'] = json.loads(json.dumps(params or {}, sort_keys=True, default=jsonable))
+		return description
+
+	def fingerprint(self, columns, params=None):
+		"""
+		sha1 hash of everything that goes into a figure
+		"""
+		text = json.dumps(self.describe(columns, params), sort_keys=True)
+		return hashlib.sha1(text.encode()).hexdigest()
+
+	def fresh(self, output, columns, params=None):
+		"""
+		Is the figure output up to date?
+		Receives:
+			output = path of the image
+			columns = the (table, field) columns the figure is made from
+			params = dict of the bins and anything else that changes how it looks
+		Returns:
+			True if output and its sidecar are there and the fingerprint matches (then skip the figure),
+			False if it has to be made (then call record(output) after saving it)
+		"""
+		description = self.describe(columns, params)
+		fingerprint = self.fingerprint(columns, params)
+		self.pending[output] = (fingerprint, description)
+		if self.force or not os.path.exists(output):
+			return False
+		try:
+			with open(sidecar_path(output)) as f:
+				old = json.load(f)
+		except (OSError, ValueError):
+			return False
+		if old.get('fingerprint') != fingerprint or old.get('output_size') != os.path.getsize(output):
+			return False
+		print('{} is up to date, skipping it'.format(output))
+		return True
+
+	def record(self, output):
+		"""
+		Write the sidecar of a figure that was just saved (fresh has to have been called for it)
+		"""
+		fingerprint, description = self.pending.pop(output)
+		sidecar = {
+			'output': os.path.basename(output),
+			'output_size': os.path.getsize(output),
+			'fingerprint': fingerprint,
+			'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+			'command': sys.argv,
+			'inputs': description,
+			}
+		with replace_when_done(sidecar_path(output)) as tmp:
+			with open(tmp, 'w') as f:
+				json.dump(sidecar, f, indent=1)
+
+
+def from_args(args):
+	"""
+	FigureCache for the parsed arguments of a reu.py subcommand
+	"""
+	return FigureCache(args.input_files, selection=args.selection, join=getattr(args, 'join', False),
+		dtype_policy=args.dtype_policy, force=args.force)
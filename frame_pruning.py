@@ -0,0 +1,69 @@
+"""
+Throw away the frame objects that create_hdf5.py never uses
+
+A Level2 frame carries dozens of objects (pulse series, many fits, the full
+MC trees, ...), and every one of them gets passed through every module of the
+tray, even though in the end the hdf5 writer only saves a handful of keys.
+Deleting everything else right after the I3Reader makes each frame much
+smaller, so every later module (and the frame mixing icetray does between
+modules) has less to carry around.
+
+Nothing in here imports icetray: a "frame" is anything with keys() and
+Delete(key), and a "tray" is anything with AddModule. So this can be tried
+out with little stand-in objects on a laptop, e.g.
+
+	class Frame(dict):
+		def Delete(self, key):
+			del self[key]
+
+	frame = Frame(LineFit=1, SRTInIcePulses=2)
+	prune_frame(frame, keep=['LineFit'])   # frame is now {'LineFit': 1}
+
+and "python check_frame_pruning.py" runs the modules of create_hdf5.py on
+stand-in frames, with and without pruning, and checks that the hdf5 writer
+gets the same values.
+
+Physics frames also show the keys of their DAQ frame ("frame mixing"), so
+prune_physics deletes those too (e.g. the MC tree). That is on purpose and
+harmless: icetray mixes the DAQ frame in again before every module, so the
+next modules (and the writer) see the DAQ frame as it is by then, NuPrimary
+included. The DAQ frame itself keeps the MC tree until store_primary is done.
+"""
+
+# the keys the hdf5 writer in create_hdf5.py saves
+WRITER_KEYS = ['I3EventHeader', 'Homogenized_QTot', 'EHEPortiaEventSummarySRT',
+	'EHEOpheliaParticleSRT_ImpLF', 'LineFit', 'NuPrimary']
+
+# the MC tree store_primary gets the neutrino from (only in the DAQ frames)
+MCTREE_NAME = 'I3MCTree_preMuonProp'
+
+
+def prune_frame(frame, keep):
+	"""
+	Delete every key of the frame that is not in keep
+	Receives:
+		frame = I3Frame (or anything with keys() and Delete(key))
+		keep = list of keys to keep
+	Returns:
+		True, so icetray keeps the (now smaller) frame
+	"""
+	keep = set(keep)
+	for key in list(frame.keys()):
+		if key not in keep:
+			frame.Delete(key)
+	return True
+
+
+def add_pruning(tray, name, keep, streams):
+	"""
+	Add a module to the tray that prunes the frames of the given streams down to keep
+	Receives:
+		tray = I3Tray (or anything with AddModule)
+		name = name of the module in the tray
+		keep = list of keys to keep
+		streams = list of frame streams to prune, e.g. [icetray.I3Frame.Physics]
+	"""
+	tray.AddModule(prune_frame, name,
+		keep=list(keep),
+		Streams=list(streams),
+		)
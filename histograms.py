@@ -0,0 +1,276 @@
+"""
+Histograms that can be filled a chunk at a time
+
+ax.hist2d needs all of the events at once, and throws the counts away after
+drawing. A Histogram2D has fixed bin edges, so we can fill it one file (or
+one chunk of a file) at a time, add together histograms that were filled by
+different processes, save the counts to a .npz file, and draw it again later
+without loading any events.
+
+All of our bins are evenly spaced (numpy.linspace), so the bin of an event
+doesn't need a search through the edges (which is what numpy.histogram,
+numpy.digitize and ax.hist do): it is just floor((x - first edge) / width).
+block_bins does that (a block of events at a time, so everything stays in
+the CPU cache), checks the answer against the real edges so events sitting
+right on an edge land in the same bin as with numpy, and falls back to a
+search for uneven edges. histogram1d / histogram2d then count the bins with
+numpy.bincount, and Histogram1D / Histogram2D draw the counts with
+ax.stairs / ax.pcolormesh instead of ax.hist / ax.hist2d.
+
+Example:
+	hist = Histogram2D(np.linspace(0,360,72), np.linspace(0,360,72))
+	for file, chunk in iter_chunks(files, [('NuPrimary','azimuth'), ('LineFit','azimuth')]):
+		hist.fill(np.rad2deg(chunk['NuPrimary','azimuth']), np.rad2deg(chunk['LineFit','azimuth']))
+	hist.save('azimuth_hist.npz')
+	...
+	counts, xedges, yedges, im = load_histogram2d('azimuth_hist.npz').draw(ax, cmin=1, norm=colors.LogNorm())
+"""
+
+import numpy
+
+from instrumentation import staged
+
+
+def uniform_width(edges):
+	"""
+	The bin width if the edges are evenly spaced, None if they are not
+	"""
+	edges = numpy.asarray(edges, dtype=float)
+	if len(edges) < 2:
+		return None
+	width = (edges[-1] - edges[0]) / (len(edges) - 1)
+	if not width > 0:
+		return None
+	if numpy.max(numpy.abs(numpy.diff(edges) - width)) > 1e-6 * width:
+		return None
+	return width
+
+
+# events are binned this many at a time, so the temporary arrays stay in the CPU cache
+BLOCK = 16384
+
+
+def padded_edges(edges, include_last):
+	"""
+	The edges with a NaN on both ends, used to check the multiply-and-floor answer
+	(a comparison with NaN is always False, so the values outside never move)
+	"""
+	edges = numpy.array(edges, dtype=float)
+	if include_last:
+		# numpy.histogram puts values equal to the last edge into the last bin
+		edges[-1] = numpy.nextafter(edges[-1], numpy.inf)
+	return numpy.concatenate([[numpy.nan], edges, [numpy.nan]])
+
+
+def block_bins(values, edges, include_last=False):
+	"""
+	Go through values a BLOCK at a time, and give the bin of every value
+	Receives:
+		values = array of values
+		edges = increasing bin edges
+		include_last = if True, values equal to the last edge go into the last bin (like numpy.histogram)
+	Yields:
+		slice of values, and the bins of those values, as numpy.digitize numbers:
+		0 = below the first edge, 1 ... len(edges)-1 = the bins, len(edges) = above (and NaN)
+	"""
+	values = numpy.asarray(values)
+	n_bins = len(edges) - 1
+	padded = padded_edges(edges, include_last)
+	width = uniform_width(edges)
+	start = float(edges[0])
+	scale = 1. / width if width is not None else None
+	scaled = numpy.empty(min(BLOCK, len(values)))
+	for first in range(0, len(values), BLOCK):
+		block = slice(first, first + BLOCK)
+		v = values[block]
+		if width is None:
+			# uneven edges, search for them
+			yield block, numpy.searchsorted(padded[1:-1], v, side='right')
+			continue
+		# multiply and round down (fmin turns NaN into the last bin) ...
+		f = numpy.subtract(v, start, out=scaled[:len(v)])
+		f *= scale
+		numpy.fmin(f, n_bins, out=f)
+		numpy.fmax(f, -1, out=f)
+		numpy.floor(f, out=f)
+		index = f.astype(numpy.int64)
+		index += 1
+		# ... which can be one bin off from rounding, so compare with the real edges
+		index -= v < padded[index]
+		index += v >= padded[index + 1]
+		yield block, index
+
+
+def bin_index(values, edges):
+	"""
+	Which bin every value is in, bins going from edges[i] up to, but not including, edges[i+1]
+	Receives:
+		values = array of values
+		edges = increasing bin edges
+	Returns:
+		int64 array, -1 below the first edge and len(edges)-1 at or above the last edge (and for NaN).
+		This is numpy.digitize(values, edges) - 1, just faster for evenly spaced edges.
+	"""
+	result = numpy.empty(len(values), dtype=numpy.int64)
+	for block, index in block_bins(values, edges):
+		numpy.subtract(index, 1, out=result[block])
+	return result
+
+
+def digitize(values, edges):
+	"""
+	Same as numpy.digitize(values, edges) for increasing edges
+	"""
+	result = numpy.empty(len(values), dtype=numpy.int64)
+	for block, index in block_bins(values, edges):
+		result[block] = index
+	return result
+
+
+def histogram1d(values, edges, weights=None):
+	"""
+	Same counts as numpy.histogram(values, bins=edges, weights=weights)[0]
+	"""
+	n_bins = len(edges) - 1
+	if weights is not None:
+		weights = numpy.asarray(weights)
+	counts = numpy.zeros(n_bins + 2, dtype=numpy.int64 if weights is None else float)
+	for block, index in block_bins(values, edges, include_last=True):
+		# below and above get their own bins, which are thrown away at the end
+		counts += numpy.bincount(index, weights=None if weights is None else weights[block],
+			minlength=n_bins + 2)
+	return counts[1:n_bins + 1]
+
+
+def histogram2d(x_values, y_values, xedges, yedges, weights=None):
+	"""
+	Same counts as numpy.histogram2d(x_values, y_values, bins=[xedges, yedges], weights=weights)[0]
+	"""
+	nx = len(xedges) + 1
+	ny = len(yedges) + 1
+	if weights is not None:
+		weights = numpy.asarray(weights)
+	counts = numpy.zeros(nx * ny, dtype=numpy.int64 if weights is None else float)
+	for (block, xi), (_, yi) in zip(block_bins(x_values, xedges, include_last=True),
+		block_bins(y_values, yedges, include_last=True)):
+		xi *= ny
+		xi += yi
+		counts += numpy.bincount(xi, weights=None if weights is None else weights[block], minlength=nx * ny)
+	return counts.reshape(nx, ny)[1:-1, 1:-1]
+
+
+class Histogram1D(object):
+	"""
+	1D histogram with fixed bin edges
+	Receives:
+		edges = bin edges (like the bins argument of ax.hist, the last bin includes its right edge)
+	"""
+
+	def __init__(self, edges):
+		self.edges = numpy.asarray(edges, dtype=float)
+		self.counts = numpy.zeros(len(self.edges) - 1)
+
+	@staged('hist1d')
+	def fill(self, values, weights=None):
+		"""
+		Add a chunk of events
+		"""
+		self.counts += histogram1d(values, self.edges, weights=weights)
+		return self
+
+	def merge(self, other):
+		"""
+		Add the counts of another histogram with the same edges
+		"""
+		assert numpy.array_equal(self.edges, other.edges), "can only merge histograms with the same edges"
+		self.counts += other.counts
+		return self
+
+	def save(self, path):
+		numpy.savez(path, counts=self.counts, edges=self.edges)
+
+	def draw(self, ax, **kwargs):
+		"""
+		Draw the histogram with stairs, filled like ax.hist draws it
+		Receives:
+			ax = matplotlib axes to draw on
+			**kwargs = passed on to stairs (e.g. alpha=0.5, label='Reco')
+		Returns:
+			counts, edges, and what stairs returned
+		"""
+		kwargs.setdefault('fill', True)
+		patch = ax.stairs(self.counts, self.edges, **kwargs)
+		return self.counts, self.edges, patch
+
+
+class Histogram2D(object):
+	"""
+	2D histogram with fixed bin edges
+	Receives:
+		xedges, yedges = bin edges (like the bins argument of hist2d, the last bin includes its right edge)
+	"""
+
+	def __init__(self, xedges, yedges):
+		self.xedges = numpy.asarray(xedges, dtype=float)
+		self.yedges = numpy.asarray(yedges, dtype=float)
+		self.counts = numpy.zeros((len(self.xedges) - 1, len(self.yedges) - 1))
+
+	@staged('hist2d')
+	def fill(self, x_values, y_values, weights=None):
+		"""
+		Add a chunk of events
+		"""
+		self.counts += histogram2d(x_values, y_values, self.xedges, self.yedges, weights=weights)
+		return self
+
+	def merge(self, other):
+		"""
+		Add the counts of another histogram with the same edges
+		"""
+		assert (numpy.array_equal(self.xedges, other.xedges)
+			and numpy.array_equal(self.yedges, other.yedges)), "can only merge histograms with the same edges"
+		self.counts += other.counts
+		return self
+
+	def save(self, path):
+		numpy.savez(path, counts=self.counts, xedges=self.xedges, yedges=self.yedges)
+
+	def draw(self, ax, cmin=None, cmax=None, **kwargs):
+		"""
+		Draw the histogram with pcolormesh, the same way ax.hist2d would
+		Receives:
+			ax = matplotlib axes to draw on
+			cmin, cmax = bins with counts below cmin (or above cmax) are left blank, like in hist2d
+			**kwargs = passed on to pcolormesh (e.g. norm=colors.LogNorm())
+		Returns:
+			counts, xedges, yedges, image (same as ax.hist2d)
+		"""
+		counts = self.counts.copy()
+		if cmin is not None:
+			counts[counts < cmin] = numpy.nan
+		if cmax is not None:
+			counts[counts > cmax] = numpy.nan
+		image = ax.pcolormesh(self.xedges, self.yedges, counts.T, **kwargs)
+		ax.set_xlim(self.xedges[0], self.xedges[-1])
+		ax.set_ylim(self.yedges[0], self.yedges[-1])
+		return counts, self.xedges, self.yedges, image
+
+
+def load_histogram1d(path):
+	"""
+	Read back a Histogram1D that was written with Histogram1D.save
+	"""
+	with numpy.load(path) as saved:
+		hist = Histogram1D(saved['edges'])
+		hist.counts = saved['counts']
+	return hist
+
+
+def load_histogram2d(path):
+	"""
+	Read back a Histogram2D that was written with Histogram2D.save
+	"""
+	with numpy.load(path) as saved:
+		hist = Histogram2D(saved['xedges'], saved['yedges'])
+		hist.counts = saved['counts']
+	return hist
@@ -0,0 +1,328 @@
+"""
+Find out where the time (and memory) of a plotting run goes
+
+When the poster takes minutes, it could be reading the hdf5 files, the
+selection, the percentiles of every bin, the 2D histogram or the dpi=300
+savefig. The slow parts of the code are wrapped in named stages:
+	with stage('hist2d'):
+		...
+	with stage('read', file=path):
+		...
+or, for a whole function,
+	@staged('binned_quantiles')
+	def binned_quantiles(...):
+and with profiling on, every stage records
+	wall = seconds on the clock
+	cpu = seconds of CPU this process used (all of its threads)
+	peak_rss = the most memory (resident set size) the process had during the stage
+	read_bytes = bytes the process read from files (including what came from the page cache)
+	disk_read_bytes = the part of that which really had to come from the disk
+When the program ends, a JSON report with every stage, the totals per stage
+and per input file is written, and a short summary is printed.
+
+Profiling is off unless it is switched on with
+	python reu.py poster -f *.hdf5 --profile             (report in reu_profile.json)
+	python reu.py poster -f *.hdf5 --profile my.json
+or with the environment variable, which also works for the scripts on their own:
+	REU_PROFILE=my.json python create_hdf5.py ...        (REU_PROFILE=1 means reu_profile.json)
+When it is off, stage() just hands back the same do-nothing context manager,
+so the stages cost well under a microsecond each.
+
+Worker processes (the pools in load_hdf5, plot_jobs and streaming) see the
+environment variable too, and add their stages to the same report.
+
+Memory and bytes read come from /proc (Linux). The peak memory of a stage is
+found by resetting the process's "high water mark" (/proc/self/clear_refs) at
+the start of the stage. Where that can't be done, peak_rss is the peak of the
+whole process up to the end of the stage, and where there is no /proc/self/io,
+the bytes read are left out. (Because of that reset, with profiling on, the
+peak memory that other tools like /usr/bin/time report is too low, use the
+report's instead. And a stage that starts and waits for worker processes
+also counts the bytes they read.)
+"""
+
+import atexit
+import contextlib
+import functools
+import json
+import os
+import re
+import resource
+import sys
+import time
+
+from atomic_files import replace_when_done
+
+ENV_VAR = 'REU_PROFILE'
+# where the processes write their stages (one JSON line per stage), set by enable()
+RECORDS_ENV_VAR = 'REU_PROFILE_RECORDS'
+DEFAULT_REPORT = 'reu_profile.json'
+
+# handed out by stage() when profiling is off
+NULL_STAGE = contextlib.nullcontext()
+
+enabled = False
+state = {'records': None, 'stack': [], 'can_reset_peak': None}
+
+
+def read_status():
+	"""
+	Current and peak resident memory of this process in bytes (peak since the last reset_peak)
+	"""
+	try:
+		with open('/proc/self/status') as f:
+			status = f.read()
+		rss = int(re.search(r'VmRSS:\s+(\d+)', status).group(1)) * 1024
+		peak = int(re.search(r'VmHWM:\s+(\d+)', status).group(1)) * 1024
+		return rss, peak
+	except (OSError, AttributeError):
+		# no /proc: ru_maxrss is the peak of the whole run (in kB on Linux)
+		peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+		return peak, peak
+
+
+def reset_peak():
+	"""
+	Start a new peak memory measurement (only works on Linux)
+	"""
+	if state['can_reset_peak'] is False:
+		return
+	try:
+		with open('/proc/self/clear_refs', 'w') as f:
+			f.write('5')
+		state['can_reset_peak'] = True
+	except OSError:
+		state['can_reset_peak'] = False
+
+
+def read_io():
+	"""
+	Bytes this process read so far: (from any file, from the disk), or (None, None) without /proc/self/io
+	"""
+	try:
+		with open('/proc/self/io') as f:
+			io = dict(line.split(': ') for line in f.read().splitlines())
+		return int(io['rchar']), int(io['read_bytes'])
+	except (OSError, KeyError, ValueError):
+		return None, None
+
+
+class Stage(object):
+	"""
+	One running stage, made by stage() when profiling is on
+	"""
+
+	def __init__(self, name, file=None):
+		self.name = name
+		self.file = file
+
+	def __enter__(self):
+		stack = state['stack']
+		rss, peak = read_status()
+		if stack:
+			# the reset below would lose the peak of the stage we are inside of, so hand it over first
+			stack[-1].peak = max(stack[-1].peak, peak)
+		reset_peak()
+		self.peak = rss
+		self.path = '/'.join([parent.name for parent in stack] + [self.name])
+		stack.append(self)
+		self.read, self.disk_read = read_io()
+		self.start = time.time()
+		self.wall = time.perf_counter()
+		self.cpu = time.process_time()
+		return self
+
+	def __exit__(self, *exc):
+		wall = time.perf_counter() - self.wall
+		cpu = time.process_time() - self.cpu
+		read, disk_read = read_io()
+		self.peak = max(self.peak, read_status()[1])
+		stack = state['stack']
+		stack.pop()
+		if stack:
+			stack[-1].peak = max(stack[-1].peak, self.peak)
+		record = {'stage': self.path, 'file': self.file, 'pid': os.getpid(), 'start': self.start,
+			'wall': wall, 'cpu': cpu, 'peak_rss': self.peak,
+			'read_bytes': None if read is None else read - self.read,
+			'disk_read_bytes': None if read is None else disk_read - self.disk_read}
+		# one short line, appended, so processes writing at the same time don't mix their lines up
+		with open(state['records'], 'a') as f:
+			f.write(json.dumps(record) + '\n')
+		return False
+
+
+def stage(name, file=None):
+	"""
+	Context manager that records one stage, if profiling is on
+	Receives:
+		name = name of the stage, e.g. 'read' or 'savefig'
+		file = optional input file the stage works on (the report also adds up the stages per file)
+	"""
+	if not enabled:
+		return NULL_STAGE
+	return Stage(name, file)
+
+
+def staged(name):
+	"""
+	Decorator that makes every call of a function a stage
+	"""
+	def decorate(function):
+		@functools.wraps(function)
+		def wrapper(*args, **kwargs):
+			if not enabled:
+				return function(*args, **kwargs)
+			with Stage(name):
+				return function(*args, **kwargs)
+		return wrapper
+	return decorate
+
+
+def enable(report=DEFAULT_REPORT):
+	"""
+	Switch profiling on for this process and every process it starts, and write the report at exit
+	Receives:
+		report = path of the JSON report
+	"""
+	global enabled
+	if enabled:
+		return
+	report = os.path.abspath(report)
+	records = report + '.records'
+	# start with no records
+	open(records, 'w').close()
+	os.environ[ENV_VAR] = report
+	os.environ[RECORDS_ENV_VAR] = records
+	state['records'] = records
+	state['main_pid'] = os.getpid()
+	state['report'] = report
+	state['start'] = time.time()
+	enabled = True
+	atexit.register(finish)
+
+
+def load_records(path):
+	records = []
+	if os.path.exists(path):
+		with open(path) as f:
+			for line in f:
+				# a worker that got killed in the middle of a write can leave half a line
+				try:
+					records.append(json.loads(line))
+				except ValueError:
+					pass
+	return records
+
+
+def add_up(records, key):
+	"""
+	Totals of the records for every value of key ('stage' or 'file'), in the order they first started
+	(for stages, every stage comes right before the stages inside it)
+	"""
+	totals = {}
+	for record in records:
+		if record[key] is None:
+			continue
+		total = totals.setdefault(record[key], {key: record[key], 'count': 0, 'wall': 0., 'cpu': 0.,
+			'peak_rss': 0, 'read_bytes': 0, 'disk_read_bytes': 0, 'processes': set(), 'first_start': record['start']})
+		total['first_start'] = min(total['first_start'], record['start'])
+		total['count'] += 1
+		total['wall'] += record['wall']
+		total['cpu'] += record['cpu']
+		total['peak_rss'] = max(total['peak_rss'], record['peak_rss'])
+		total['read_bytes'] += record['read_bytes'] or 0
+		total['disk_read_bytes'] += record['disk_read_bytes'] or 0
+		total['processes'].add(record['pid'])
+	first_start = {name: total.pop('first_start') for name, total in totals.items()}
+	for total in totals.values():
+		total['processes'] = len(total['processes'])
+
+	def order(name):
+		if key != 'stage':
+			return [first_start[name]]
+		# sort by when the outermost stage started, then the one inside it, ...
+		parts = name.split('/')
+		return [first_start.get('/'.join(parts[:i + 1]), first_start[name]) for i in range(len(parts))]
+	return [totals[name] for name in sorted(totals, key=order)]
+
+
+def make_report(records):
+	"""
+	The report dict: the whole run, totals per stage and per file, and every record
+	"""
+	usage = resource.getrusage(resource.RUSAGE_SELF)
+	children = resource.getrusage(resource.RUSAGE_CHILDREN)
+	# every stage resets the peak that getrusage sees, so the stages have to be looked at too
+	main_peak = max([record['peak_rss'] for record in records if record['pid'] == state['main_pid']] + [0])
+	worker_peak = max([record['peak_rss'] for record in records if record['pid'] != state['main_pid']] + [0])
+	return {
+		'command': sys.argv,
+		'wall': time.time() - state['start'],
+		'cpu': usage.ru_utime + usage.ru_stime,
+		'children_cpu': children.ru_utime + children.ru_stime,
+		'peak_rss': max(usage.ru_maxrss * 1024, main_peak),
+		'children_peak_rss': max(children.ru_maxrss * 1024, worker_peak),
+		'peak_rss_per_stage': bool(state['can_reset_peak']),
+		'stages': add_up(records, 'stage'),
+		'files': add_up(records, 'file'),
+		'records': records,
+		}
+
+
+def megabytes(n):
+	return n / 1024.**2
+
+
+def summary(report, max_files=10):
+	"""
+	Short text version of the report
+	"""
+	lines = ['Profile of {} ({:.2f} s wall, {:.2f} s CPU + {:.2f} s CPU in worker processes, peak {:.0f} MB)'.format(
+		' '.join(os.path.basename(arg) for arg in report['command'][:2]), report['wall'], report['cpu'],
+		report['children_cpu'], megabytes(max(report['peak_rss'], report['children_peak_rss'])))]
+	lines.append('  {:40s} {:>6s} {:>6s} {:>9s} {:>9s} {:>9s} {:>10s}'.format('stage', 'count', 'procs',
+		'wall s', 'cpu s', 'peak MB', 'read MB'))
+	for total in report['stages']:
+		# nested stages are indented under the one they are in
+		depth = total['stage'].count('/')
+		name = '  ' * depth + total['stage'].rsplit('/', 1)[-1]
+		lines.append('  {:40s} {:6d} {:6d} {:9.3f} {:9.3f} {:9.0f} {:10.1f}'.format(name, total['count'],
+			total['processes'], total['wall'], total['cpu'], megabytes(total['peak_rss']),
+			megabytes(total['read_bytes'])))
+	if report['files']:
+		files = sorted(report['files'], key=lambda total: -total['wall'])
+		lines.append('  slowest input files:')
+		for total in files[:max_files]:
+			lines.append('    {:9.3f} s {:10.1f} MB  {}'.format(total['wall'], megabytes(total['read_bytes']),
+				total['file']))
+		if len(files) > max_files:
+			lines.append('    ... and {} more (see the report)'.format(len(files) - max_files))
+	lines.append('  (stage times include the stages inside them, and add up over the processes they ran in;')
+	lines.append('  full report in {})'.format(state['report']))
+	return '\n'.join(lines)
+
+
+def finish():
+	"""
+	Write the report and print the summary (runs at exit, only in the process that called enable)
+	"""
+	if os.getpid() != state.get('main_pid'):
+		return
+	records = load_records(state['records'])
+	report = make_report(records)
+	with replace_when_done(state['report']) as tmp:
+		with open(tmp, 'w') as f:
+			json.dump(report, f, indent=1)
+	os.remove(state['records'])
+	print(summary(report), file=sys.stderr)
+
+
+# switch on when asked to through the environment. Worker processes find
+# RECORDS_ENV_VAR already set by the process that called enable(), and only
+# add their stages to its records
+if os.environ.get(ENV_VAR):
+	if os.environ.get(RECORDS_ENV_VAR):
+		enabled = True
+		state['records'] = os.environ[RECORDS_ENV_VAR]
+	else:
+		enable(DEFAULT_REPORT if os.environ[ENV_VAR].lower() in ['1', 'true', 'yes'] else os.environ[ENV_VAR])
@@ -0,0 +1,117 @@
+"""
+Line up the rows of different I3HDFWriter tables by event
+
+The plotting scripts assume that row i of NuPrimary, LineFit,
+EHEOpheliaParticleSRT_ImpLF, Homogenized_QTot, ... is the same event. That is
+only true if every table got a row for every event. In create_hdf5.py,
+store_primary only writes NuPrimary when the frame has an
+I3MCTree_preMuonProp, so NuPrimary can be shorter than the other tables, and
+then the rows no longer match up.
+
+Every table the hdf5 writer makes has the event header columns
+Run, Event, SubEvent and SubEventStream. Here we use those columns to find,
+for every table, which of its rows belong to the events that are in *all*
+of the tables. Rows that only exist in some of the tables are reported as
+unmatched instead of silently shifting everything after them.
+"""
+
+import numpy as np
+
+
+HEADER_FIELDS = ('Run', 'Event', 'SubEvent', 'SubEventStream')
+
+
+def read_keys(file_in, table):
+	"""
+	Read only the event header columns of a table
+	Returns:
+		structured array with the HEADER_FIELDS of every row
+	"""
+	dataset = file_in[table]
+	dtype = np.dtype([(name, dataset.dtype.fields[name][0]) for name in HEADER_FIELDS])
+	keys = np.empty(dataset.shape[0], dtype=dtype)
+	if len(keys):
+		dataset.read_direct(keys)
+	return keys
+
+
+def has_keys(file_in, table):
+	names = file_in[table].dtype.names or ()
+	return all(name in names for name in HEADER_FIELDS)
+
+
+def pack_keys(key_arrays):
+	"""
+	Squeeze the four header columns into one 64 bit number per row, when they fit
+	(comparing one number is a lot faster than comparing four columns).
+	If they don't fit, the structured arrays are returned as they are.
+	"""
+	widths = []
+	for name in HEADER_FIELDS:
+		largest = max((int(keys[name].max()) for keys in key_arrays if len(keys)), default=0)
+		widths.append(max(largest.bit_length(), 1))
+	if sum(widths) > 64:
+		return key_arrays
+	packed_arrays = []
+	for keys in key_arrays:
+		packed = np.zeros(len(keys), dtype=np.uint64)
+		for name, width in zip(HEADER_FIELDS, widths):
+			packed <<= np.uint64(width)
+			packed |= keys[name].astype(np.uint64)
+		packed_arrays.append(packed)
+	return packed_arrays
+
+
+def align_tables(file_in, tables):
+	"""
+	Find the rows of each table that belong to events present in every table
+	Receives:
+		file_in = open h5py.File
+		tables = list of table names
+	Returns:
+		rows = dict table -> array of row numbers, so that row rows[a][i] of table a
+			and row rows[b][i] of table b are the same event (in the order of the first table)
+		unmatched = dict table -> array of row numbers of that table that were not used
+			(events missing from another table, or repeated events)
+	"""
+	tables = list(dict.fromkeys(tables))
+	keys = pack_keys([read_keys(file_in, table) for table in tables])
+
+	# keep only the first row of every event in each table
+	unique_rows = []
+	for table_keys in keys:
+		_, first = np.unique(table_keys, return_index=True)
+		unique_rows.append(np.sort(first))
+
+	# intersect the events of all tables, one table at a time
+	common = keys[0][unique_rows[0]]
+	for table_keys, rows in zip(keys[1:], unique_rows[1:]):
+		common = np.intersect1d(common, table_keys[rows], assume_unique=True)
+
+	matched = {}
+	unmatched = {}
+	for table, table_keys, rows in zip(tables, keys, unique_rows):
+		_, in_common, in_table = np.intersect1d(common, table_keys[rows],
+			assume_unique=True, return_indices=True)
+		table_rows = np.empty(len(common), dtype=np.int64)
+		table_rows[in_common] = rows[in_table]
+		matched[table] = table_rows
+		used = np.zeros(len(table_keys), dtype=bool)
+		used[table_rows] = True
+		unmatched[table] = np.flatnonzero(~used)
+
+	# put everything in the row order of the first table
+	order = np.argsort(matched[tables[0]], kind='stable')
+	matched = {table: table_rows[order] for table, table_rows in matched.items()}
+	return matched, unmatched
+
+
+def report_unmatched(file, unmatched):
+	"""
+	Print how many rows of each table could not be matched, if there are any
+	Receives:
+		unmatched = dict table -> number of unmatched rows
+	"""
+	parts = ['{} in {}'.format(count, table) for table, count in unmatched.items() if count]
+	if parts:
+		print('Unmatched rows in {}: {}'.format(file, ', '.join(parts)))
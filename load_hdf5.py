@@ -0,0 +1,458 @@
+"""
+Shared loader for the hdf5 files written by create_hdf5.py
+
+All of the plotting scripts need a handful of columns (like the azimuth of
+NuPrimary) from many files. Instead of growing an array with np.concatenate
+once per file, we first add up how many rows every file has (this only needs
+the hdf5 metadata, not the data), make one array per column that is exactly
+big enough, and then have h5py read each file straight into its slice.
+
+We also only ask hdf5 for the fields we want, so reading NuPrimary.azimuth
+does not drag the whole I3Particle row (x, y, z, time, energy, ...) into memory.
+
+With jobs > 1 the files are read by a pool of worker processes (h5py only
+lets one thread talk to hdf5 at a time, so threads would not help here).
+Each worker hands back the columns of one file, and we copy them into their
+slice of the big arrays, so the result is in the same order as the file list.
+
+A selection like
+	"Homogenized_QTot.value > 1e4 and I3MCWeightDict.InteractionType >= 1"
+can be handed to the loader. Then it first reads just the columns used in
+the selection, one block of rows at a time, and afterwards only reads (and
+keeps) the rows that pass, so events we throw away never take up memory.
+
+Normally row i of every table is taken to be the same event. With join=True
+the tables are instead lined up by their event header columns (see joins.py),
+so a table that is missing a few events doesn't shift the others or get the
+whole file thrown out.
+
+With dtype_policy='compact' the columns are held in smaller dtypes than the
+files store them in (see COMPACT_DTYPES), e.g. float32 instead of float64,
+which halves the memory. hdf5 does the conversion itself while reading, a
+small buffer at a time, so there is never a float64 copy of a whole column.
+
+Example:
+	data = load_columns(files, [('NuPrimary', 'azimuth'), ('LineFit', 'azimuth')], jobs=8)
+	true_azimuth = data['NuPrimary', 'azimuth']
+"""
+
+import ast
+import concurrent.futures
+import operator
+
+import h5py
+import numpy as np
+
+import joins
+from instrumentation import stage
+
+
+def check_file(file_in, columns, same_length=True):
+	"""
+	Check that an open hdf5 file has every column we want
+	Receives:
+		file_in = open h5py.File
+		columns = list of (table, field) pairs
+		same_length = if True, the tables all have to have the same number of rows
+	Returns:
+		number of rows in the file (of the first table), or None if the file can't be used
+		(a table or field is missing, or the tables have different lengths)
+	"""
+	n_rows = None
+	for table, field in columns:
+		if table not in file_in:
+			return None
+		dataset = file_in[table]
+		if dataset.dtype.names is None or field not in dataset.dtype.names:
+			return None
+		# shape comes from the metadata, so this doesn't read any events
+		if n_rows is None:
+			n_rows = dataset.shape[0]
+		elif same_length and dataset.shape[0] != n_rows:
+			return None
+	return n_rows
+
+
+# dtypes for dtype_policy='compact'. Our plots bin at 1-2 degrees, so float32
+# is plenty for the angles, energies and charges (float64 columns that are not
+# listed here become float32), and the interaction type (1, 2 or 3) fits in an int8
+COMPACT_DTYPES = {
+	('I3MCWeightDict', 'InteractionType'): np.int8,
+}
+
+
+def compact_dtype(column, stored):
+	"""
+	dtype to hold a column in with dtype_policy='compact'
+	"""
+	if column in COMPACT_DTYPES:
+		return np.dtype(COMPACT_DTYPES[column])
+	if stored.kind == 'f' and stored.itemsize > 4:
+		return np.dtype(np.float32)
+	return stored
+
+
+# dtype policy name -> function (column, dtype in the file) -> dtype to read the column as
+DTYPE_POLICIES = {
+	'full': lambda column, stored: stored,
+	'compact': compact_dtype,
+}
+
+
+def field_dtype(file_in, table, field, dtype_policy='full'):
+	"""
+	Make a one-field compound dtype for reading a single field of a table.
+	An array with this dtype is laid out in memory exactly like a plain array
+	of that field, so arr[field] is a normal contiguous array afterwards.
+	If the dtype_policy picks a different dtype than the file has, hdf5
+	converts the values while reading them.
+	"""
+	stored = file_in[table].dtype.fields[field][0]
+	return np.dtype([(field, DTYPE_POLICIES[dtype_policy]((table, field), stored))])
+
+
+CHUNK_ROWS = 1000000
+
+COMPARE_OPERATORS = {
+	ast.Gt: operator.gt, ast.GtE: operator.ge, ast.Lt: operator.lt,
+	ast.LtE: operator.le, ast.Eq: operator.eq, ast.NotEq: operator.ne,
+	}
+ARITHMETIC_OPERATORS = {
+	ast.Add: operator.add, ast.Sub: operator.sub,
+	ast.Mult: operator.mul, ast.Div: operator.truediv,
+	}
+
+
+def parse_selection(selection):
+	"""
+	Turn a selection string into the columns it needs and a function that applies it
+	Receives:
+		selection = string like "Homogenized_QTot.value > 1e4 and I3MCWeightDict.InteractionType >= 1"
+			columns are written table.field, and you can use numbers, comparisons,
+			+ - * /, and, or, not and parentheses
+	Returns:
+		columns = list of (table, field) pairs the selection uses
+		evaluate = function that takes a dict of (table, field) -> array and returns a boolean mask
+	"""
+	tree = ast.parse(selection, mode='eval')
+	columns = []
+
+	def build(node):
+		if isinstance(node, ast.BoolOp):
+			parts = [build(value) for value in node.values]
+			combine = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+			return lambda data: combine.reduce([part(data) for part in parts])
+		if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+			part = build(node.operand)
+			return lambda data: np.logical_not(part(data))
+		if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+			part = build(node.operand)
+			return lambda data: -part(data)
+		if isinstance(node, ast.BinOp) and type(node.op) in ARITHMETIC_OPERATORS:
+			left, right, op = build(node.left), build(node.right), ARITHMETIC_OPERATORS[type(node.op)]
+			return lambda data: op(left(data), right(data))
+		if isinstance(node, ast.Compare):
+			# a < b < c means (a < b) and (b < c)
+			values = [build(node.left)] + [build(value) for value in node.comparators]
+			ops = [COMPARE_OPERATORS[type(op)] for op in node.ops]
+			def compare(data):
+				mask = True
+				for op, left, right in zip(ops, values[:-1], values[1:]):
+					mask = np.logical_and(mask, op(left(data), right(data)))
+				return mask
+			return compare
+		if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name):
+			column = (node.value.id, node.attr)
+			if column not in columns:
+				columns.append(column)
+			return lambda data: data[column]
+		if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+			return lambda data: node.value
+		raise ValueError('Can not use {!r} in a selection'.format(ast.dump(node)))
+
+	evaluate = build(tree.body)
+	return columns, evaluate
+
+
+def read_block(file_in, table, dtype, start, stop):
+	"""
+	Read rows start:stop of one field of a table (the field is picked by dtype)
+	"""
+	buffer = np.empty(stop - start, dtype=dtype)
+	if stop > start:
+		file_in[table].read_direct(buffer, source_sel=np.s_[start:stop])
+	return buffer[dtype.names[0]]
+
+
+def select_rows(file_in, n, selection, rows=None, chunk_rows=CHUNK_ROWS):
+	"""
+	Apply a selection to one open file, one block of rows at a time
+	Receives:
+		rows = optional dict table -> row numbers from joins.align_tables
+			(then the selection columns are read whole and lined up first)
+	Returns:
+		boolean mask with one entry per row of the file (or per matched event)
+	(the selection columns are always read at the precision the file has, so
+	a cut like QTot > 1e4 doesn't depend on the dtype policy)
+	"""
+	columns, evaluate = parse_selection(selection)
+	dtypes = [field_dtype(file_in, table, field) for table, field in columns]
+	if rows is not None:
+		chunk = {}
+		for (table, field), dtype in zip(columns, dtypes):
+			chunk[table, field] = read_block(file_in, table, dtype, 0, file_in[table].shape[0])[rows[table]]
+		return np.broadcast_to(evaluate(chunk), (n,)).copy()
+	mask = np.empty(n, dtype=bool)
+	for start in range(0, n, chunk_rows):
+		stop = min(n, start + chunk_rows)
+		chunk = {}
+		for (table, field), dtype in zip(columns, dtypes):
+			chunk[table, field] = read_block(file_in, table, dtype, start, stop)
+		mask[start:stop] = evaluate(chunk)
+	return mask
+
+
+def read_selected(file_in, table, dtype, mask, out, chunk_rows=CHUNK_ROWS):
+	"""
+	Read only the rows of one field where mask is True, into the array out
+	For every block of rows we only read from the first to the last selected
+	row, and blocks with nothing selected are not read at all.
+	"""
+	field = dtype.names[0]
+	filled = 0
+	for start in range(0, len(mask), chunk_rows):
+		block = mask[start:start + chunk_rows]
+		selected = np.flatnonzero(block)
+		if len(selected) == 0:
+			continue
+		first, last = start + selected[0], start + selected[-1] + 1
+		values = read_block(file_in, table, dtype, first, last)
+		values = values[mask[first:last]]
+		out[filled:filled + len(values)] = values
+		filled += len(values)
+	return out
+
+
+def read_planned(file_in, table, dtype, plan, out):
+	"""
+	Fill out (a 1D array) with one field of a table, following the plan made by scan_file
+	"""
+	if plan['rows'] is not None:
+		# joined: read the whole field, then pick (and line up) the matched rows
+		values = read_block(file_in, table, dtype, 0, file_in[table].shape[0])[plan['rows'][table]]
+		if plan['mask'] is not None:
+			values = values[plan['mask']]
+		out[:] = values
+	elif plan['mask'] is not None:
+		read_selected(file_in, table, dtype, plan['mask'], out)
+	elif len(out):
+		# hdf5 can read straight into out, it just needs the one-field view of it
+		file_in[table].read_direct(out.view(dtype), source_sel=np.s_[0:len(out)])
+	return out
+
+
+def scan_file(file, columns, selection=None, join=False, dtype_policy='full'):
+	"""
+	Open one file, look at its metadata and make a plan for reading it
+	(this applies the selection and lines up the tables, if asked to)
+	Returns:
+		None if the file can't be used, or a dict with
+			n = number of rows we will keep
+			dtypes = list of one-field dtypes, one per column (following dtype_policy)
+			mask = boolean mask of the kept rows, or None
+			rows = dict table -> matched row numbers (only with join), or None
+			unmatched = dict table -> number of rows that had no match (only with join)
+	"""
+	needed = list(columns)
+	if selection is not None:
+		needed += [column for column in parse_selection(selection)[0] if column not in needed]
+	with stage('scan', file=file), h5py.File(file, "r") as file_in:
+		n = check_file(file_in, needed, same_length=not join)
+		if n is None:
+			return None
+		plan = {'n': n, 'mask': None, 'rows': None, 'unmatched': {},
+			'dtypes': [field_dtype(file_in, table, field, dtype_policy) for table, field in columns]}
+		if join:
+			tables = [table for table, field in needed]
+			if not all(joins.has_keys(file_in, table) for table in tables):
+				return None
+			with stage('join', file=file):
+				plan['rows'], unmatched = joins.align_tables(file_in, tables)
+			plan['unmatched'] = {table: len(rows) for table, rows in unmatched.items()}
+			plan['n'] = len(plan['rows'][tables[0]])
+		if selection is not None:
+			with stage('select', file=file):
+				plan['mask'] = select_rows(file_in, plan['n'], selection, plan['rows'])
+			plan['n'] = int(plan['mask'].sum())
+		return plan
+
+
+def read_file(file, columns, plan):
+	"""
+	Read the columns of one file into new arrays (this is what the pool workers run)
+	Returns:
+		list of arrays, one per column, each with the one-field dtype from the plan
+	"""
+	with stage('read', file=file), h5py.File(file, "r") as file_in:
+		buffers = []
+		for (table, field), dtype in zip(columns, plan['dtypes']):
+			buffer = np.empty(plan['n'], dtype=dtype)
+			read_planned(file_in, table, dtype, plan, buffer[field])
+			buffers.append(buffer)
+	return buffers
+
+
+def load_columns(files, columns, jobs=1, cache_dir=None, selection=None, join=False, dtype_policy='full'):
+	"""
+	Load (table, field) columns from many hdf5 files into one array each
+	Receives:
+		files = list of paths to hdf5 files (like the -f argument of the scripts)
+		columns = list of (table, field) pairs, e.g. [('NuPrimary', 'azimuth')]
+		jobs = number of worker processes used to read the files (default 1, no pool)
+		cache_dir = optional folder for column_cache; if given, columns that were
+			loaded before from the same (unchanged) files come back memory-mapped
+		selection = optional string like "Homogenized_QTot.value > 1e4", only events
+			that pass it are loaded (see parse_selection)
+		join = if True, line up the tables by event header instead of by row number
+			(see joins.py), and print how many rows of each table had no match
+		dtype_policy = 'full' keeps the dtypes of the files, 'compact' reads float64
+			columns as float32 and InteractionType as int8 (see COMPACT_DTYPES)
+	Returns:
+		dict that maps each (table, field) pair to a 1D numpy array with the
+		values from every usable file, in the same order as files.
+		Files that are missing a column are skipped (and we print their name).
+	"""
+	with stage('load_columns'):
+		if cache_dir is not None:
+			import column_cache
+			return column_cache.load_cached(files, columns, cache_dir, jobs=jobs, selection=selection, join=join,
+				dtype_policy=dtype_policy)
+		return read_columns(files, columns, jobs=jobs, selection=selection, join=join, dtype_policy=dtype_policy)
+
+
+def read_columns(files, columns, jobs=1, selection=None, join=False, dtype_policy='full', rows_per_file=None):
+	"""
+	Does the actual work for load_columns, without looking at any cache
+	Receives:
+		rows_per_file = optional list, filled with the number of rows every file gave (None for skipped files),
+			so column_cache can tell if two loads give the same rows
+	"""
+	columns = list(columns)
+	files = list(files)
+	if selection is not None:
+		# check the selection before opening any files
+		parse_selection(selection)
+	if dtype_policy not in DTYPE_POLICIES:
+		raise ValueError('Unknown dtype policy {!r}, use one of {}'.format(dtype_policy, list(DTYPE_POLICIES)))
+	pool = None
+	if jobs > 1 and len(files) > 1:
+		pool = concurrent.futures.ProcessPoolExecutor(max_workers=min(jobs, len(files)))
+
+	try:
+		# first pass: look at the metadata to figure out how big things are
+		# (with a selection, this also reads the selection columns and finds the rows to keep,
+		# and with join, it reads the event headers and matches up the tables)
+		if pool is None:
+			plans = [scan_file(file, columns, selection, join, dtype_policy) for file in files]
+		else:
+			n_files = len(files)
+			plans = list(pool.map(scan_file, files, [columns] * n_files,
+				[selection] * n_files, [join] * n_files, [dtype_policy] * n_files))
+		n_rows = []
+		dtypes = None
+		for file, plan in zip(files, plans):
+			if plan is None:
+				print('Skipping {}'.format(file))
+				n_rows.append(None)
+				continue
+			joins.report_unmatched(file, plan['unmatched'])
+			if dtypes is None:
+				dtypes = plan['dtypes']
+			n_rows.append(plan['n'])
+		if rows_per_file is not None:
+			rows_per_file[:] = n_rows
+
+		# if nothing could be read, hand back empty arrays so the scripts don't crash here
+		if dtypes is None:
+			return {column: np.asarray([]) for column in columns}
+
+		# now we make one array per column that is exactly the right size
+		total = sum(n for n in n_rows if n is not None)
+		buffers = [np.empty(total, dtype=dtype) for dtype in dtypes]
+		starts = np.cumsum([0] + [n or 0 for n in n_rows])
+
+		# second pass: fill each file's slice of the arrays
+		if pool is None:
+			# with no pool, hdf5 can read each file directly into its slice
+			for file, n, start, plan in zip(files, n_rows, starts, plans):
+				if not n:
+					continue
+				with stage('read', file=file), h5py.File(file, "r") as file_in:
+					for (table, field), buffer in zip(columns, buffers):
+						read_planned(file_in, table, buffer.dtype, plan, buffer[field][start:start + n])
+		else:
+			# the workers read whole files, and we copy each one in as soon as it's done
+			futures = {}
+			for file, n, start, plan in zip(files, n_rows, starts, plans):
+				if n:
+					futures[pool.submit(read_file, file, columns, plan)] = (file, start, n)
+			for future in concurrent.futures.as_completed(futures):
+				file, start, n = futures[future]
+				parts = future.result()
+				with stage('copy', file=file):
+					for buffer, part in zip(buffers, parts):
+						buffer[start:start + n] = part
+	finally:
+		if pool is not None:
+			pool.shutdown()
+
+	return {column: buffer[column[1]] for column, buffer in zip(columns, buffers)}
+
+
+def iter_chunks(files, columns, chunk_rows=CHUNK_ROWS, selection=None, dtype_policy='full'):
+	"""
+	Go through the files one block of rows at a time, so only one block is in memory
+	Receives:
+		files = list of paths to hdf5 files
+		columns = list of (table, field) pairs
+		chunk_rows = largest number of rows in one block
+		selection = optional selection string (see parse_selection), only passing rows are yielded
+		dtype_policy = 'full' or 'compact' (see load_columns), the dtypes of the yielded arrays
+	Yields:
+		(file, dict that maps each (table, field) pair to the block's array)
+		Files that are missing a column are skipped (and we print their name).
+	"""
+	columns = list(columns)
+	needed = list(columns)
+	evaluate = None
+	if selection is not None:
+		selection_columns, evaluate = parse_selection(selection)
+		needed += [column for column in selection_columns if column not in needed]
+	for file in files:
+		with h5py.File(file, "r") as file_in:
+			n = check_file(file_in, needed)
+			if n is None:
+				print('Skipping {}'.format(file))
+				continue
+			# the selection columns are read as they are in the file, everything else following the policy
+			dtypes = {(table, field): field_dtype(file_in, table, field, dtype_policy) for table, field in columns}
+			if evaluate is not None:
+				stored = {(table, field): field_dtype(file_in, table, field) for table, field in selection_columns}
+			for start in range(0, n, chunk_rows):
+				stop = min(n, start + chunk_rows)
+				with stage('read', file=file):
+					chunk = {}
+					if evaluate is not None:
+						for column in selection_columns:
+							chunk[column] = read_block(file_in, column[0], stored[column], start, stop)
+						mask = np.broadcast_to(evaluate(chunk), (stop - start,))
+						if not mask.any():
+							continue
+					for column in columns:
+						if column not in chunk:
+							chunk[column] = read_block(file_in, column[0], dtypes[column], start, stop)
+					if evaluate is not None:
+						# (the selection columns that are also wanted still need casting, but only the passing rows)
+						chunk = {column: chunk[column][mask].astype(dtypes[column][column[1]], copy=False)
+							for column in columns}
+				yield file, chunk
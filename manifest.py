@@ -0,0 +1,192 @@
+"""
+Keep track of which i3 files have already been turned into hdf5 files
+
+Converting a whole dataset takes ~1000 create_hdf5.py runs, and when a few new
+i3 files show up we don't want to redo the other 990. The manifest is a JSON
+file (normally next to the outputs) with one entry per converted input:
+
+	{"version": 1,
+	 "files": {"/full/path/Level2_...000000.i3.zst": {
+		"size": ..., "mtime_ns": ...,       (or "sha1": ..., with --checksum)
+		"keys": [the WRITER_KEYS that were saved],
+		"output": "/full/path/Level2_...000000.hdf5", "output_size": ...}, ...}}
+
+An input is up to date if it has an entry, the input didn't change, the
+writer keys are still the same, and the output is still there with the same
+size. Everything else is "stale" and needs to be converted (again).
+
+Use it from the command line like:
+	# which files need converting? (one path per line, ready for create_hdf5.py --filelist)
+	python manifest.py stale -m out/manifest.json -o out/ /data/*.i3.zst > todo.txt
+	# after converting (and copying the outputs to out/), remember them
+	python manifest.py record -m out/manifest.json -o out/ $(cat todo.txt)
+Several jobs can record into the same manifest at once, they take turns with a lock file.
+"""
+
+import argparse
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+
+from frame_pruning import WRITER_KEYS
+from atomic_files import replace_when_done
+
+MANIFEST_VERSION = 1
+
+
+def output_name(input_file):
+	"""
+	Level2_IC86.2016_NuMu.021220.000000.i3.zst -> Level2_IC86.2016_NuMu.021220.000000
+	(the same name create_hdf5.py --per-input gives the output)
+	"""
+	name = os.path.basename(input_file)
+	for extension in ['.zst', '.bz2', '.gz']:
+		if name.endswith(extension):
+			name = name[:-len(extension)]
+	if name.endswith('.i3'):
+		name = name[:-len('.i3')]
+	return name
+
+
+def output_path(input_file, output_dir):
+	return os.path.abspath(os.path.join(output_dir, output_name(input_file) + '.hdf5'))
+
+
+def file_sha1(path, block_size=1 << 20):
+	sha1 = hashlib.sha1()
+	with open(path, 'rb') as f:
+		for block in iter(lambda: f.read(block_size), b''):
+			sha1.update(block)
+	return sha1.hexdigest()
+
+
+def input_stats(input_file, checksum=False):
+	"""
+	What we remember about an input file to tell later if it changed
+	"""
+	st = os.stat(input_file)
+	stats = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+	if checksum:
+		stats['sha1'] = file_sha1(input_file)
+	return stats
+
+
+def load_manifest(path):
+	if not os.path.exists(path):
+		return {'version': MANIFEST_VERSION, 'files': {}}
+	with open(path) as f:
+		manifest = json.load(f)
+	if manifest.get('version') != MANIFEST_VERSION:
+		# written by a different version of this code, so don't trust any of it
+		return {'version': MANIFEST_VERSION, 'files': {}}
+	return manifest
+
+
+def save_manifest(path, manifest):
+	with replace_when_done(path) as tmp:
+		with open(tmp, 'w') as f:
+			json.dump(manifest, f, indent=1, sort_keys=True)
+
+
+@contextlib.contextmanager
+def locked(path):
+	"""
+	Only one process at a time gets to read-change-write the manifest at path
+	"""
+	with open(path + '.lock', 'w') as lock:
+		fcntl.flock(lock, fcntl.LOCK_EX)
+		try:
+			yield
+		finally:
+			fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def is_up_to_date(manifest, input_file, output_file, keys=WRITER_KEYS, checksum=False):
+	"""
+	True if input_file was already converted to output_file with these keys, and nothing changed since
+	"""
+	entry = manifest['files'].get(os.path.abspath(input_file))
+	if entry is None:
+		return False
+	if entry['keys'] != list(keys) or entry['output'] != os.path.abspath(output_file):
+		return False
+	if not os.path.exists(output_file) or os.path.getsize(output_file) != entry['output_size']:
+		return False
+	st = os.stat(input_file)
+	if st.st_size != entry['size']:
+		return False
+	if st.st_mtime_ns == entry['mtime_ns']:
+		return True
+	# the file was touched; with checksums we can still tell if the content is the same
+	return checksum and 'sha1' in entry and file_sha1(input_file) == entry['sha1']
+
+
+def stale_inputs(manifest, input_files, output_dir, keys=WRITER_KEYS, checksum=False):
+	"""
+	The input files that still need to be converted into output_dir
+	"""
+	return [input_file for input_file in input_files
+		if not is_up_to_date(manifest, input_file, output_path(input_file, output_dir), keys, checksum)]
+
+
+def record(manifest, input_file, output_file, keys=WRITER_KEYS, checksum=False):
+	"""
+	Remember that input_file was converted to output_file (which has to exist by now)
+	"""
+	entry = input_stats(input_file, checksum)
+	entry['keys'] = list(keys)
+	entry['output'] = os.path.abspath(output_file)
+	entry['output_size'] = os.path.getsize(output_file)
+	manifest['files'][os.path.abspath(input_file)] = entry
+
+
+def record_outputs(manifest_path, input_files, output_dir, keys=WRITER_KEYS, checksum=False, finished_dir=None):
+	"""
+	Add the input files whose outputs are in output_dir to the manifest file
+	Receives:
+		finished_dir = optional folder the outputs were written to before they were copied to output_dir,
+			then only the inputs whose output is in there too are recorded (so an old output
+			in output_dir doesn't count for an input whose conversion just failed)
+	Returns:
+		list of the input files that had no output (those are not recorded)
+	"""
+	missing = []
+	with locked(manifest_path):
+		manifest = load_manifest(manifest_path)
+		for input_file in input_files:
+			output_file = output_path(input_file, output_dir)
+			finished = finished_dir is None or os.path.exists(output_path(input_file, finished_dir))
+			if finished and os.path.exists(output_file):
+				record(manifest, input_file, output_file, keys, checksum)
+			else:
+				missing.append(input_file)
+		save_manifest(manifest_path, manifest)
+	return missing
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser()
+	parser.add_argument("command", choices=['stale', 'record'],
+		help="stale = print the inputs that need converting, record = remember converted inputs")
+	parser.add_argument("inputs", nargs='+',
+		help="the i3 input files")
+	parser.add_argument("-m", "--manifest", type=str, required=True,
+		help="path of the manifest JSON file")
+	parser.add_argument("-o", "--output-dir", type=str, required=True,
+		help="folder the hdf5 outputs go to")
+	parser.add_argument("--checksum", action="store_true",
+		help="also compare the sha1 of the inputs (slower, but survives touched files)")
+	parser.add_argument("--finished-dir", type=str, default=None,
+		help="record: only record inputs whose output is also in this folder (where this job wrote them)")
+	args = parser.parse_args()
+
+	if args.command == 'stale':
+		for input_file in stale_inputs(load_manifest(args.manifest), args.inputs, args.output_dir,
+			checksum=args.checksum):
+			print(input_file)
+	else:
+		for input_file in record_outputs(args.manifest, args.inputs, args.output_dir, checksum=args.checksum,
+			finished_dir=args.finished_dir):
+			print('No output for {}, not recorded'.format(input_file))
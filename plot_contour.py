@@ -1,11 +1,12 @@
-import h5py
-import argparse
 import numpy as np
 import numpy
-import matplotlib.pyplot as plt
-import matplotlib.colors as colors
-import itertools
-import copy
+from load_hdf5 import load_columns
+from binned_stats import binned_quantiles, binned_median_band
+from quantile_sketch import QuantileSketch
+from histograms import Histogram2D
+from bootstrap import bootstrap_binned_quantiles
+from instrumentation import stage, staged
+from figure_cache import from_args
 
 def plot_1d_binned_slices(truth, reco1, reco2=None,
 					   xarray1=None,xarray2=None,truth2=None,\
@@ -15,12 +16,15 @@ def plot_1d_binned_slices(truth, reco1, reco2=None,
 					   y_units=None,
 					   reco1_name = "Reco 1", reco2_name = "Reco 2",\
 					   reco1_weight = None, reco2_weight = None,
+					   bootstrap=0, seed=None,
 					   save=True,savefolder='.'):
 	"""Plots different energy slices vs each other (systematic set arrays)
 	Receives:
 		truth = 1D array with truth values
 		reco1 = 1D array that has reconstructed results
-		reco2 = optional, 1D array that has an alternate reconstructed results
+			(or a QuantileSketch of the y variable, filled chunk by chunk, see quantile_sketch.py;
+			then truth, xarray1, reco1_weight, bins, xmin and xmax are not used, the bins come from the sketch)
+		reco2 = optional, 1D array that has an alternate reconstructed results (or a QuantileSketch, like reco1)
 		xarray1 = optional, 1D array that the reco1 variable (or resolution) will be plotted against, if none is given, will automatically use truth1
 		xarray2 = optional, 1D array that the reco2 variable (or resolution2) will be plotted against, if none is given, will automatically use xarray1
 		truth2 = 1D array with truth values used to calculate resolution2
@@ -36,95 +40,82 @@ def plot_1d_binned_slices(truth, reco1, reco2=None,
 		reco2_name = name for reconstruction 2
 		reco1_weight = 1D array for reco1 weights, if left None, will not use
 		reco2_weight = 1D array for reco2 weights, if left None, will not use
+		bootstrap = number of bootstrap resamples used to draw an uncertainty on the medians (0 = don't)
+		seed = seed for the bootstrap random numbers
 	Returns:
 		Scatter plot with truth bins on x axis (median of bin width)
 		y axis has median of resolution or absolute reconstructed value with error bars containing given percentile
 	"""
 
+	# matplotlib is only imported once we actually draw something, so that
+	# find_contours_2D etc. can be used without it
+	import matplotlib.pyplot as plt
+
 	percentile_in_peak = 68.27 #CAN CHANGE
-	left_tail_percentile  = (100.-percentile_in_peak)/2
-	right_tail_percentile = 100.-left_tail_percentile
 	ranges  = numpy.linspace(xmin,xmax, num=bins)
+	# streaming backend: the sketch already holds the y variable, binned on its own xbins
+	streaming = isinstance(reco1, QuantileSketch)
+	if streaming:
+		ranges = reco1.xbins
+		xmin, xmax = ranges[0], ranges[-1]
 	centers = (ranges[1:] + ranges[:-1])/2.
 	
 	# if no xarray given, automatically use truth
 	if xarray1 is None:
 		xarray1 = truth
 	# Calculate resolution if plot_resolution flag == True
-	if plot_resolution:
+	if streaming:
+		yvariable = reco1
+	elif plot_resolution:
 		if use_fraction:
 			yvariable = ((reco1-truth)/truth) # in fraction
 		else:
 			yvariable = (reco1-truth)
 	else: #use reco directly, not resolution
-		y_variable = reco1
+		yvariable = reco1
 		assert use_fraction==False, "Flag for fractional resolution only, not doing resolution here"
 
-	medians  = numpy.zeros(len(centers))
-	err_from = numpy.zeros(len(centers))
-	err_to   = numpy.zeros(len(centers))
-
 	#Compare to second reconstruction if given    
 	if reco2 is not None:
 		#check if some variables exist, if not, set to match reco1's
 		if truth2 is None:
-			truth2 = truth1
+			truth2 = truth
 		if xarray2 is None:
 			xarray2 = xarray1
 
-		if plot_resolution:
+		if streaming:
+			yvariable2 = reco2
+		elif plot_resolution:
 			if use_fraction:
 				yvariable2 = ((reco2-truth2)/truth2)
 			else:
 				yvariable2 = (reco2-truth2)
 		else:
 			yvariable2 = reco2
-		medians2  = numpy.zeros(len(centers))
-		err_from2 = numpy.zeros(len(centers))
-		err_to2   = numpy.zeros(len(centers))
-
-	# Find median and percentile bounds for data
-	for i in range(len(ranges)-1):
 
-		# Make a cut based on the truth (binned on truth)
-		var_to   = ranges[i+1]
-		var_from = ranges[i]
-		cut = (xarray1 >= var_from) & (xarray1 < var_to)
-		assert sum(cut)>0, "No events in xbin from %s to %s for reco1, may need to change xmin, xmax, or number of bins or check truth/xarray inputs"%(var_from, var_to)
+	# Find median and percentile bounds for data, binned on xarray
+	# this is one sort per reconstruction instead of a loop over the bins,
+	# and bins with no events come back as nan (they just leave a gap in the plot)
+	# see binned_stats.py
+	if streaming:
+		medians, err_from, err_to = yvariable.median_band(percentile_in_peak)
 		if reco2 is not None:
-			cut2 = (xarray2 >= var_from) & (xarray2 < var_to)
-			assert sum(cut2)>0, "No events in xbin from %s to %s for reco2, may need to change xmin, xmax, or number of bins or check truth2/xarray2 inputs"%(var_from, var_to)
-		
-		#find number of reco1 (or resolution) in this bin
-		if reco1_weight is None:
-			lower_lim = numpy.percentile(yvariable[cut], left_tail_percentile)
-			upper_lim = numpy.percentile(yvariable[cut], right_tail_percentile)
-			median = numpy.percentile(yvariable[cut], 50.)
-		else:
-			import wquantiles as wq
-			lower_lim = wq.quantile(yvariable[cut], reco1_weight[cut], left_tail_percentile)
-			upper_lim = wq.quantile(yvariable[cut], reco1_weight[cut], right_tail_percentile)
-			median = wq.median(yvariable[cut], reco1_weight[cut])
-
-		medians[i] = median
-		err_from[i] = lower_lim
-		err_to[i] = upper_lim
- 
-		#find number of reco2 (or resolution2) in this bin
+			medians2, err_from2, err_to2 = yvariable2.median_band(percentile_in_peak)
+	else:
+		medians, err_from, err_to = binned_median_band(xarray1, yvariable, ranges,
+			percentile_in_peak=percentile_in_peak, weights=reco1_weight)
 		if reco2 is not None:
-			if reco2_weight is None:
-				lower_lim2 = numpy.percentile(yvariable2[cut2], left_tail_percentile)
-				upper_lim2 = numpy.percentile(yvariable2[cut2], right_tail_percentile)
-				median2 = numpy.percentile(yvariable2[cut2], 50.)
-			else:
-				import wquantiles as wq
-				lower_lim2 = wq.quantile(yvariable2[cut2], reco2_weight[cut2], left_tail_percentile)
-				upper_lim2 = wq.quantile(yvariable2[cut2], reco2_weight[cut2], right_tail_percentile)
-				median2 = wq.median(yvariable2[cut2], reco2_weight[cut2])
+			medians2, err_from2, err_to2 = binned_median_band(xarray2, yvariable2, ranges,
+				percentile_in_peak=percentile_in_peak, weights=reco2_weight)
 
-			medians2[i] = median2
-			err_from2[i] = lower_lim2
-			err_to2[i] = upper_lim2
+	# Bootstrap confidence interval on the medians, see bootstrap.py
+	if bootstrap:
+		assert not streaming, "bootstrap needs the events, it can't be used with a QuantileSketch"
+		median_ci = bootstrap_binned_quantiles(xarray1, yvariable, ranges, [50.],
+			n_resamples=bootstrap, weights=reco1_weight, seed=seed)
+		if reco2 is not None:
+			median_ci2 = bootstrap_binned_quantiles(xarray2, yvariable2, ranges, [50.],
+				n_resamples=bootstrap, weights=reco2_weight, seed=seed)
 
 	# Make plot
 	plt.figure(figsize=(10,7))
@@ -132,7 +123,7 @@ def plot_1d_binned_slices(truth, reco1, reco2=None,
 	# Median as datapoint
 	# Percentile as y error bars
 	# Bin size as x error bars
-	if style is "errorbars":
+	if style == "errorbars":
 		plt.errorbar(centers, medians, yerr=[medians-err_from, err_to-medians], xerr=[ centers-ranges[:-1], ranges[1:]-centers ], capsize=5.0, fmt='o',label="%s"%reco1_name)
 		#Compare to second reconstruction, if given
 		if reco2 is not None:
@@ -157,9 +148,17 @@ def plot_1d_binned_slices(truth, reco1, reco2=None,
 		ax.fill_between(centers,medians, err_to, color=color, alpha=alpha,label=reco1_name + " %i"%percentile_in_peak +'%' )
 		if reco2 is not None:
 			ax.plot(centers,medians2, color=rcolor, linestyle='-', label="%s median"%reco2_name, linewidth=lwid)
-			ax.fill_between(centers,medians2,err_from1, color=rcolor, alpha=alpha)
+			ax.fill_between(centers,medians2,err_from2, color=rcolor, alpha=alpha)
 			ax.fill_between(centers,medians2,err_to2, color=rcolor,alpha=alpha,label=reco2_name + " %i"%percentile_in_peak +'%' )
 	
+	# Black error bars on the medians show their bootstrap uncertainty
+	if bootstrap:
+		ci_lower, ci_upper = median_ci[0][0], median_ci[1][0]
+		plt.errorbar(centers, medians, yerr=[medians-ci_lower, ci_upper-medians], fmt='none', ecolor='k', capsize=3.0)
+		if reco2 is not None:
+			ci_lower, ci_upper = median_ci2[0][0], median_ci2[1][0]
+			plt.errorbar(centers, medians2, yerr=[medians2-ci_lower, ci_upper-medians2], fmt='none', ecolor='k', capsize=3.0)
+
 	# Extra features to have a horizontal 0 line and trim the x axis
 	plt.plot([xmin,xmax], [0,0], color='k')
 	plt.xlim(xmin,xmax)
@@ -179,23 +178,32 @@ def plot_1d_binned_slices(truth, reco1, reco2=None,
 	# Make a pretty title
 	title = "%s Dependence for %s"%(x_name,reco1_name)
 	if reco2 is not None:
-		title += " and %s"(reco2_name)
+		title += " and %s"%(reco2_name)
 	if plot_resolution:
 		title += " Resolution"
 	plt.title("%s"%(title))
 
 	# Make a pretty filename
+	savename = slices_savename(x_name, use_fraction, plot_resolution, reco2_name if reco2 is not None else None)
+	if save == True:
+		with stage('savefig'):
+			plt.savefig("%s/%s.png"%(savefolder,savename))
+
+def slices_savename(x_name, use_fraction=False, plot_resolution=False, reco2_name=None):
+	"""
+	Name (without .png) that plot_1d_binned_slices saves its plot under
+	"""
 	savename = "%s"%(x_name.replace(" ",""))
 	if use_fraction:
 		savename += "Frac"
 	if plot_resolution:
 		savename += "Resolution"
-	if reco2 is not None:
+	if reco2_name is not None:
 		savename += "_Compare%s"%(reco2_name.replace(" ",""))
-	if save == True:
-		plt.savefig("%s/%s.png"%(savefolder,savename))
+	return savename
 
-def find_contours_2D(x_values,y_values,xbins,weights=None,c1=16,c2=84):   
+@staged('find_contours_2D')
+def find_contours_2D(x_values,y_values,xbins,weights=None,c1=16,c2=84,sketch=None,bootstrap=0,seed=None,jobs=1):   
 	"""
 	Find upper and lower contours and median
 	x_values = array, input for hist2d for x axis (typically truth)
@@ -203,39 +211,27 @@ def find_contours_2D(x_values,y_values,xbins,weights=None,c1=16,c2=84):
 	xbins = values for the starting edge of the x bins (output from hist2d)
 	c1 = percentage for lower contour bound (16% - 84% means a 68% band, so c1 = 16)
 	c2 = percentage for upper contour bound (16% - 84% means a 68% band, so c2=84)
+	sketch = optional QuantileSketch that was filled chunk by chunk (see quantile_sketch.py),
+		if given, the contours come from it, and x_values, y_values, xbins and weights are not used
+	bootstrap = optional number of bootstrap resamples (see bootstrap.py), if given there is a 5th output
+	seed = seed for the bootstrap random numbers
+	jobs = number of processes to spread the bootstrap resamples over
 	Returns:
 		x = values for xbins, repeated for plotting (i.e. [0,0,1,1,2,2,...]
 		y_median = values for y value medians per bin, repeated for plotting (i.e. [40,40,20,20,50,50,...]
 		y_lower = values for y value lower limits per bin, repeated for plotting (i.e. [30,30,10,10,20,20,...]
 		y_upper = values for y value upper limits per bin, repeated for plotting (i.e. [50,50,40,40,60,60,...]
+		intervals = only if bootstrap is given: (ci_lower, ci_upper), each with rows for
+			[lower, median, upper], the 68% confidence interval of that value in every bin
 	"""
-	if weights is not None:
-		import wquantiles as wq
-	y_values = numpy.array(y_values)
-	indices = numpy.digitize(x_values,xbins)
-	r1_save = []
-	r2_save = []
-	median_save = []
-	for i in range(1,len(xbins)):
-		mask = indices==i
-		if len(y_values[mask])>0:
-			if weights is None:
-				r1, m, r2 = numpy.percentile(y_values[mask],[c1,50,c2])
-			else:
-				r1 = wq.quantile(y_values[mask],weights[mask],c1/100.)
-				r2 = wq.quantile(y_values[mask],weights[mask],c2/100.)
-				m = wq.median(y_values[mask],weights[mask])
-		else:
-			#print(i,'empty bin')
-			r1 = numpy.nan
-			m = numpy.nan
-			r2 = numpy.nan
-		median_save.append(m)
-		r1_save.append(r1)
-		r2_save.append(r2)
-	median = numpy.array(median_save)
-	lower = numpy.array(r1_save)
-	upper = numpy.array(r2_save)
+	if sketch is not None:
+		# streaming backend, see sketch.error_bounds for how accurate it is
+		xbins = sketch.xbins
+		lower, median, upper = sketch.quantiles([c1, 50, c2])
+	else:
+		# sort once by (bin, y) and read off every percentile of every bin together,
+		# with or without weights (empty bins come back as nan), see binned_stats.py
+		lower, median, upper = binned_quantiles(x_values, y_values, xbins, [c1, 50, c2], weights=weights)
 
 	# this is a funny way of outputting the result
 	# which was in the original code we borrowed from the oscnext folks
@@ -247,100 +243,140 @@ def find_contours_2D(x_values,y_values,xbins,weights=None,c1=16,c2=84):
 	# return x, y_median, y_lower, y_upper
 
 	# the first return with the [1:] and [:-1] is about locating the bin centers
-	return (xbins[1:] + xbins[:-1])/2, median, lower, upper
+	centers = (xbins[1:] + xbins[:-1])/2
+	if bootstrap:
+		assert sketch is None, "bootstrap needs the events, it can't be used with a sketch"
+		intervals = bootstrap_binned_quantiles(x_values, y_values, xbins, [c1, 50, c2],
+			n_resamples=bootstrap, weights=weights, seed=seed, jobs=jobs)
+		return centers, median, lower, upper, intervals
+	return centers, median, lower, upper
 
 
+def run(args):
+	"""
+	Load the data and make the plots, args are the parsed arguments from reu.py
+	"""
+	import matplotlib.pyplot as plt
+	import matplotlib.colors as colors
 
-parser = argparse.ArgumentParser()
-parser.add_argument("-f", type=str, nargs='+',
-	dest="input_files", required=True,
-	help="paths to input files (absolute or relative)")
-args = parser.parse_args()
-files = args.input_files
+	files = args.input_files
 
-reco_azimuth = np.asarray([])
-true_azimuth = np.asarray([])
-true_energy = np.asarray([])
+	columns = [
+		('LineFit', 'azimuth'),
+		('NuPrimary', 'azimuth'),
+		('NuPrimary', 'energy'),
+		]
+	bins = [np.linspace(0,360,72), np.linspace(0,360,72)]
 
-for file in files:
+	# find out which plots changed since the last time (files, selection, bins, code, ...),
+	# the ones that didn't are already there and are skipped
+	figures = from_args(args)
+	contour_params = {'plot': 'contour', 'bins': bins, 'bootstrap': args.bootstrap, 'seed': args.seed}
+	slices_file = slices_savename('True_Neutrino_Energy', plot_resolution=True) + '.png'
+	make_contour = not figures.fresh('test.png', columns[:2], contour_params)
+	make_error = not figures.fresh('test2.png', columns[:2], contour_params)
+	make_slices = not figures.fresh(slices_file, columns, {'plot': 'contour', 'bootstrap': args.bootstrap,
+		'seed': args.seed})
+	if not (make_contour or make_error or make_slices):
+		return
 
-	file_in = h5py.File(file, "r")
-	# print(file_in['NuPrimary'].dtype.names)
+	# print(h5py.File(files[0], "r")['NuPrimary'].dtype.names)
+	data = load_columns(files, columns, jobs=args.jobs, cache_dir=args.cache_dir, selection=args.selection,
+		join=args.join, dtype_policy=args.dtype_policy)
+	reco_azimuth = data['LineFit', 'azimuth']
+	true_azimuth = data['NuPrimary', 'azimuth']
+	true_energy = data['NuPrimary', 'energy']
 
-	try:
-		reco_azimuth = np.concatenate((reco_azimuth, 
-			file_in['LineFit']['azimuth']))
-		true_azimuth = np.concatenate((true_azimuth,
-			file_in['NuPrimary']['azimuth']))
-		true_energy = np.concatenate((true_energy,
-			file_in['NuPrimary']['energy']))
-		print("Finished all {}".format(file))
-	except:
-		print('Skipping {}'.format(file))
 
-	file_in.close()
+	with stage('degrees'):
+		reco_azimuth = np.rad2deg(reco_azimuth)
+		true_azimuth = np.rad2deg(true_azimuth)
 
+	if make_contour or make_error:
+		# get the contours, using a function from Jessie and the oscNext team
+		contours = find_contours_2D(
+			x_values=true_azimuth,
+			y_values=reco_azimuth,
+			xbins=bins[0],
+			bootstrap=args.bootstrap,
+			seed=args.seed,
+			jobs=args.jobs
+			)
+		x, y_med, y_lo, y_hi = contours[:4]
+		y_med = np.asarray(y_med)
+		y_lo = np.asarray(y_lo)
+		y_hi = np.asarray(y_hi)
 
-reco_azimuth = np.rad2deg(reco_azimuth)
-true_azimuth = np.rad2deg(true_azimuth)
-bins = [np.linspace(0,360,72), np.linspace(0,360,72)]
+	if make_contour:
+		# 2D histogram
+		fig = plt.figure(figsize=(6,5))
+		ax = fig.add_subplot(111)
+		# (the histogram keeps its counts, so it could also be filled file by file,
+		# merged with others or saved, see histograms.py)
+		hist = Histogram2D(bins[0], bins[1])
+		hist.fill(true_azimuth,
+			reco_azimuth)
+		counts, xedges, yedges, im = hist.draw(ax,
+			cmin=1,
+			norm=colors.LogNorm()
+			)
+		# plot the contours
+		ax.plot(x, y_med, 'r-', label='Median')
+		ax.plot(x, y_lo, 'r-.', label='68% contour')
+		ax.plot(x, y_hi, 'r-.')
+		if args.bootstrap:
+			# shaded band = bootstrap uncertainty on the median
+			ci_lower, ci_upper = contours[4]
+			ax.fill_between(x, ci_lower[1], ci_upper[1], color='r', alpha=0.3, label='Median uncertainty')
 
-# 2D histogram
-fig = plt.figure(figsize=(6,5))
-ax = fig.add_subplot(111)
-counts, xedges, yedges, im = ax.hist2d(
-	true_azimuth,
-	reco_azimuth,
-	bins=bins,
-	cmin=1,
-	norm=colors.LogNorm()
-	)
+		cbar = plt.colorbar(im, ax=ax)
+		cbar.set_label('Number of Events')#, fontsize=sizer)
+		ax.set_ylabel('Reco Azimuth')
+		ax.set_xlabel('True Azimuth')
+		ax.legend()
+		plt.tight_layout()
+		with stage('savefig'):
+			fig.savefig('test.png', dpi=300)
+		figures.record('test.png')
+		del fig, ax
 
-# get the contours, using a function from Jessie and the oscNext team
-x, y_med, y_lo, y_hi = find_contours_2D(
-	x_values=true_azimuth,
-	y_values=reco_azimuth,
-	xbins=xedges
-	)
-y_med = np.asarray(y_med)
-y_lo = np.asarray(y_lo)
-y_hi = np.asarray(y_hi)
-# plot them
-ax.plot(x, y_med, 'r-', label='Median')
-ax.plot(x, y_lo, 'r-.', label='68% contour')
-ax.plot(x, y_hi, 'r-.')
+	if make_error:
+		# we can also plot the size of the error bar in 1D to make visualization easier
+		fig = plt.figure(figsize=(6,5))
+		ax = fig.add_subplot(111)
+		ax.errorbar(x, y_med - x, yerr=[y_hi-y_med, y_med-y_lo], capsize=0.0, fmt='o')
+		ax.plot(x, y_med - x, 'o')
+		ax.set_xlabel('True Azimuth')
+		ax.set_ylabel('Error (True - Reco)')
+		plt.tight_layout()
+		with stage('savefig'):
+			fig.savefig('test2.png')
+		figures.record('test2.png')
+		del fig, ax
 
-cbar = plt.colorbar(im, ax=ax)
-cbar.set_label('Number of Events')#, fontsize=sizer)
-ax.set_ylabel('Reco Azimuth')
-ax.set_xlabel('True Azimuth')
-ax.legend()
-plt.tight_layout()
-fig.savefig('test.png', dpi=300)
-del fig, ax
+	if make_slices:
+		true_energy = np.log10(true_energy)
+		# finally, we can also plot our resolution as a function of energy
+		# for that, we're going to borrow a function from Jessie
+		with stage('plot_1d_binned_slices'):
+			plot_1d_binned_slices(truth=true_azimuth,
+				reco1=reco_azimuth,
+				xarray1=true_energy,
+				plot_resolution=True,
+				xmin=np.min(true_energy),
+				xmax=np.max(true_energy),
+				x_name='True_Neutrino_Energy',
+				x_units='log10(GeV)',
+				y_units='Degrees',
+				bootstrap=args.bootstrap,
+				seed=args.seed,
+				reco1_name='LineFit'
+				)
+		figures.record(slices_file)
 
-# we can also plot the size of the error bar in 1D to make visualization easier
-fig = plt.figure(figsize=(6,5))
-ax = fig.add_subplot(111)
-ax.errorbar(x, y_med - x, yerr=[y_hi-y_med, y_med-y_lo], capsize=0.0, fmt='o')
-ax.plot(x, y_med - x, 'o')
-ax.set_xlabel('True Azimuth')
-ax.set_ylabel('Error (True - Reco)')
-plt.tight_layout()
-fig.savefig('test2.png')
-del fig, ax
 
-true_energy = np.log10(true_energy)
-# finally, we can also plot our resolution as a function of energy
-# for that, we're going to borrow a function from Jessie
-plot_1d_binned_slices(truth=true_azimuth,
-	reco1=reco_azimuth,
-	xarray1=true_energy,
-	plot_resolution=True,
-	xmin=np.min(true_energy),
-	xmax=np.max(true_energy),
-	x_name='True_Neutrino_Energy',
-	x_units='log10(GeV)',
-	y_units='Degrees',
-	reco1_name='LineFit'
-	)
+if __name__ == '__main__':
+	# the arguments are the same as for python reu.py contour
+	import sys
+	import reu
+	reu.main(['contour'] + sys.argv[1:])
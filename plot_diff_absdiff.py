@@ -1,109 +1,118 @@
-import h5py
-import argparse
 import numpy as np
 import matplotlib.pyplot as plt
-import matplotlib.colors as colors
-
-# again, we are going to use argparser to read in files!
-# this time we are going to use nargs='+' to say "allow more than one argument"
-
-parser = argparse.ArgumentParser()
-parser.add_argument("-f", type=str, nargs='+',
-	dest="input_files", required=True,
-	help="paths to input files (absolute or relative)")
-args = parser.parse_args()
-files = args.input_files
-
-# we make an empty array for each
-ophelia_azimuth = np.asarray([])
-linefit_azimuth = np.asarray([])
-true_azimuth = np.asarray([])
-ophelia_zenith = np.asarray([])
-linefit_zenith = np.asarray([])
-true_zenith = np.asarray([])
-
-
-# now, we loop over every file
-for file in files:
-
-	# we open the hdf5 file for reading
-	file_in = h5py.File(file, "r")
-
-	# and now we "concatenate" our existing list and the new list!
-
-	# note, if you want to see what variable names are available, 
-	# you can try something like the following
-	# print(file_in['EHEOpheliaParticleSRT_ImpLF'].dtype.names)
-
-	# try/except statements are way of preventing the program from crashing 
-	# if something is horribly wrong
-	try:
-		ophelia_azimuth = np.concatenate((ophelia_azimuth, 
-			file_in['EHEOpheliaParticleSRT_ImpLF']['azimuth']))
-		linefit_azimuth = np.concatenate((linefit_azimuth,
-			file_in['LineFit']['azimuth']))
-		true_azimuth = np.concatenate((true_azimuth,
-			file_in['NuPrimary']['azimuth']))
-		ophelia_zenith = np.concatenate((ophelia_zenith, 
-			file_in['EHEOpheliaParticleSRT_ImpLF']['zenith']))
-		linefit_zenith = np.concatenate((linefit_zenith,
-			file_in['LineFit']['zenith']))
-		true_zenith = np.concatenate((true_zenith,
-			file_in['NuPrimary']['zenith']))
-	except:
-		print('Skipping {}'.format(file))
-
-	# close the file
-	file_in.close()
-
-
-# we are going to convert the radians to degrees
-ophelia_azimuth = np.rad2deg(ophelia_azimuth)
-linefit_azimuth = np.rad2deg(linefit_azimuth)
-true_azimuth = np.rad2deg(true_azimuth)
-ophelia_zenith = np.rad2deg(ophelia_zenith)
-linefit_zenith = np.rad2deg(linefit_zenith)
-true_zenith = np.rad2deg(true_zenith)
-
-# subtract true-recon
-ophelia_diff_azimuth = np.subtract(true_azimuth,ophelia_azimuth)
-linefit_diff_azimuth = np.subtract(true_azimuth,linefit_azimuth)
-ophelia_diff_zenith = np.subtract(true_zenith,ophelia_zenith)
-linefit_diff_zenith = np.subtract(true_zenith,linefit_zenith)
-
-# absolute value true-recon
-ophelia_abs_azi = np.abs(ophelia_diff_azimuth)
-linefit_abs_azi = np.abs(linefit_diff_azimuth)
-ophelia_abs_zen = np.abs(ophelia_diff_zenith)
-linefit_abs_zen = np.abs(linefit_diff_zenith)
-
-# now that we've loaded the data, we can make a plot!
-fig = plt.figure(figsize=(5,5))
-ax = fig.add_subplot(111)
-bins = np.linspace(0,180,181) # let's do uniform binning
-ax.hist(ophelia_abs_azi,bins=bins, alpha=0.5, label='Ophelia Azimuth')
-ax.hist(linefit_abs_azi,bins=bins, alpha=0.5, label='LineFit Azimuth')
-ax.hist(ophelia_abs_zen,bins=bins, alpha=0.5, label='Ophelia Zenith')
-ax.hist(linefit_abs_zen,bins=bins, alpha=0.5, label='LineFit Zenith')
-ax.set_yscale('log')
-ax.set_ylabel('Number of Events')
-ax.set_xlabel('Absolute(True-Recon) [deg]')
-ax.legend()
-plt.tight_layout()
-fig.savefig('fig_abs_truerecon.png', dpi=300)
-del fig, ax
-
-figg = plt.figure(figsize=(5,5))
-bx = figg.add_subplot(111)
-bbins = np.linspace(-360,360,73) # let's do uniform binning
-bx.hist(ophelia_diff_azimuth,bins=bins, alpha=0.5, label='Ophelia-True')
-bx.hist(linefit_diff_azimuth,bins=bins, alpha=0.5, label='LineFit-True')
-bx.hist(ophelia_diff_zenith,bins=bins, alpha=0.5, label='Ophelia-True')
-bx.hist(linefit_diff_zenith,bins=bins, alpha=0.5, label='LineFit-True')
-bx.set_yscale('log')
-bx.set_ylabel('Number of Events')
-bx.set_xlabel('[deg]')
-bx.legend()
-plt.tight_layout()
-figg.savefig('fig_diff_truerecon.png', dpi=300)
-del figg, bx
+from load_hdf5 import load_columns
+from histograms import Histogram1D
+from resolution import angular_resolution
+from instrumentation import stage
+from figure_cache import from_args
+
+
+def run(args):
+	"""
+	Load the data and make the plots, args are the parsed arguments from reu.py
+	"""
+	files = args.input_files
+
+	columns = [
+		('EHEOpheliaParticleSRT_ImpLF', 'azimuth'),
+		('LineFit', 'azimuth'),
+		('NuPrimary', 'azimuth'),
+		('EHEOpheliaParticleSRT_ImpLF', 'zenith'),
+		('LineFit', 'zenith'),
+		('NuPrimary', 'zenith'),
+		]
+	bins = np.linspace(0,180,181) # let's do uniform binning
+	bbins = np.linspace(-180,180,73) # the differences are between -180 and 180 now
+
+	# find out which plots changed since the last time (files, selection, bins, code, ...),
+	# the ones that didn't are already there and are skipped
+	figures = from_args(args)
+	make_abs = not figures.fresh('fig_abs_truerecon.png', columns, {'plot': 'diff-absdiff', 'bins': bins})
+	make_diff = not figures.fresh('fig_diff_truerecon.png', columns, {'plot': 'diff-absdiff', 'bins': bbins})
+	make_opening = not figures.fresh('fig_opening_angle.png', columns, {'plot': 'diff-absdiff', 'bins': bins})
+	if not (make_abs or make_diff or make_opening):
+		return
+
+	# we load every column we need from all of the files at once
+	# (files that are missing something are skipped, and load_columns prints their names)
+	data = load_columns(files, columns, jobs=args.jobs, cache_dir=args.cache_dir, selection=args.selection,
+		join=args.join, dtype_policy=args.dtype_policy)
+	ophelia_azimuth = data['EHEOpheliaParticleSRT_ImpLF', 'azimuth']
+	linefit_azimuth = data['LineFit', 'azimuth']
+	true_azimuth = data['NuPrimary', 'azimuth']
+	ophelia_zenith = data['EHEOpheliaParticleSRT_ImpLF', 'zenith']
+	linefit_zenith = data['LineFit', 'zenith']
+	true_zenith = data['NuPrimary', 'zenith']
+
+
+	# reco - true azimuth (wrapped, so 359 vs 1 degree is 2 degrees off, not 358),
+	# reco - true zenith, and the angle between the reco and true directions, all in degrees.
+	# resolution.py does this a chunk at a time, so there are no big temporary arrays,
+	# and float32 is plenty for 1 degree bins
+	ophelia_diff_azimuth, ophelia_diff_zenith, ophelia_opening = angular_resolution(
+		true_zenith, true_azimuth, ophelia_zenith, ophelia_azimuth, dtype=np.float32)
+	linefit_diff_azimuth, linefit_diff_zenith, linefit_opening = angular_resolution(
+		true_zenith, true_azimuth, linefit_zenith, linefit_azimuth, dtype=np.float32)
+	del data, ophelia_azimuth, linefit_azimuth, true_azimuth, ophelia_zenith, linefit_zenith, true_zenith
+
+	# fill all of the histograms first: the signed differences, and then (in place,
+	# so no extra copies) the absolute differences
+	differences = [ophelia_diff_azimuth, linefit_diff_azimuth, ophelia_diff_zenith, linefit_diff_zenith]
+	diff_hists = [Histogram1D(bbins).fill(difference) for difference in differences]
+	abs_hists = [Histogram1D(bins).fill(np.abs(difference, out=difference)) for difference in differences]
+	opening_hists = [Histogram1D(bins).fill(opening) for opening in [ophelia_opening, linefit_opening]]
+
+	# now we can make the plots!
+	if make_abs:
+		fig = plt.figure(figsize=(5,5))
+		ax = fig.add_subplot(111)
+		for hist, label in zip(abs_hists, ['Ophelia Azimuth', 'LineFit Azimuth', 'Ophelia Zenith', 'LineFit Zenith']):
+			hist.draw(ax, alpha=0.5, label=label)
+		ax.set_yscale('log')
+		ax.set_ylabel('Number of Events')
+		ax.set_xlabel('Absolute(Recon-True) [deg]')
+		ax.legend()
+		plt.tight_layout()
+		with stage('savefig'):
+			fig.savefig('fig_abs_truerecon.png', dpi=300)
+		del fig, ax
+		figures.record('fig_abs_truerecon.png')
+
+	if make_diff:
+		figg = plt.figure(figsize=(5,5))
+		bx = figg.add_subplot(111)
+		for hist, label in zip(diff_hists, ['Ophelia-True Azimuth', 'LineFit-True Azimuth',
+			'Ophelia-True Zenith', 'LineFit-True Zenith']):
+			hist.draw(bx, alpha=0.5, label=label)
+		bx.set_yscale('log')
+		bx.set_ylabel('Number of Events')
+		bx.set_xlabel('[deg]')
+		bx.legend()
+		plt.tight_layout()
+		with stage('savefig'):
+			figg.savefig('fig_diff_truerecon.png', dpi=300)
+		del figg, bx
+		figures.record('fig_diff_truerecon.png')
+
+	# the opening angle is how far off the direction is, all in one number
+	if make_opening:
+		fig = plt.figure(figsize=(5,5))
+		ax = fig.add_subplot(111)
+		for hist, label in zip(opening_hists, ['Ophelia', 'LineFit']):
+			hist.draw(ax, alpha=0.5, label=label)
+		ax.set_yscale('log')
+		ax.set_ylabel('Number of Events')
+		ax.set_xlabel('Opening angle between Recon and True [deg]')
+		ax.legend()
+		plt.tight_layout()
+		with stage('savefig'):
+			fig.savefig('fig_opening_angle.png', dpi=300)
+		del fig, ax
+		figures.record('fig_opening_angle.png')
+
+
+if __name__ == '__main__':
+	# the arguments are the same as for python reu.py diff-absdiff
+	import sys
+	import reu
+	reu.main(['diff-absdiff'] + sys.argv[1:])
@@ -0,0 +1,291 @@
+"""
+Make a whole set of figures from one load of the data
+
+Every plot script loads its own columns, so making all of the azimuth/zenith
+x Ophelia/LineFit x energy plots means reading the same files over and over.
+Here the figures are described in a list (a "job spec"), the columns that any
+of them need are loaded once, and the figures are drawn in a pool of
+processes. The pool is started with fork, so every worker sees the loaded
+arrays without them being copied or pickled.
+
+A job spec is a JSON file with a list of figures, for example
+	[
+	 {"kind": "hist", "output": "abs_azimuth.png",
+	  "values": [{"column": ["NuPrimary", "azimuth"], "minus": ["LineFit", "azimuth"], "abs": true}],
+	  "labels": ["LineFit Azimuth"], "transform": "deg", "bins": [0, 180, 181],
+	  "xlabel": "Absolute(True-Recon) [deg]", "log": true},
+	 {"kind": "contour", "output": "zenith_linefit.png",
+	  "x": ["NuPrimary", "zenith"], "y": ["LineFit", "zenith"], "transform": "deg",
+	  "bins": [0, 180, 91], "xlabel": "True Zenith", "ylabel": "Reco Zenith"},
+	 {"kind": "slices", "output": "zenith_resolution.png",
+	  "truth": ["NuPrimary", "zenith"], "reco1": ["LineFit", "zenith"], "reco2": ["EHEOpheliaParticleSRT_ImpLF", "zenith"],
+	  "reco1_name": "LineFit", "reco2_name": "Ophelia", "transform": "deg",
+	  "x": ["NuPrimary", "energy"], "x_transform": "log10", "x_name": "True_Energy", "x_units": "log10(GeV)"}
+	]
+A "value" is either a [table, field] column, or {"column": ..., "minus": ..., "abs": ..., "wrap": ...}
+for differences ("wrap" puts angle differences in degrees into [-180, 180), see resolution.py). "transform" ("deg" or "log10") is applied to the columns first.
+Without --spec, DEFAULT_FIGURES is used.
+
+Run like:
+	python reu.py batch -f *.hdf5 --spec my_figures.json --processes 8
+"""
+
+import json
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+from load_hdf5 import load_columns
+from histograms import Histogram1D, Histogram2D
+from plot_contour import find_contours_2D, plot_1d_binned_slices
+from resolution import wrap_degrees
+from instrumentation import stage
+from figure_cache import from_args
+
+
+TRANSFORMS = {
+	None: lambda values: values,
+	'deg': np.rad2deg,
+	'log10': np.log10,
+}
+
+RECOS = [('EHEOpheliaParticleSRT_ImpLF', 'Ophelia'), ('LineFit', 'LineFit')]
+
+
+def default_figures():
+	"""
+	Every azimuth/zenith x Ophelia/LineFit contour and energy-slice plot, and the absolute differences
+	"""
+	figures = []
+	for angle, top in [('azimuth', 360), ('zenith', 180)]:
+		for table, name in RECOS:
+			figures.append({'kind': 'contour', 'output': '{}_{}_contour.png'.format(angle, name.lower()),
+				'x': ['NuPrimary', angle], 'y': [table, angle], 'transform': 'deg',
+				'bins': [0, top, top // 2 + 1], 'xlabel': 'True ' + angle.title(), 'ylabel': 'Reco ' + angle.title(),
+				'title': name})
+			figures.append({'kind': 'slices', 'output': '{}_{}_energy_slices.png'.format(angle, name.lower()),
+				'truth': ['NuPrimary', angle], 'reco1': [table, angle], 'reco1_name': name, 'transform': 'deg',
+				'x': ['NuPrimary', 'energy'], 'x_transform': 'log10',
+				'x_name': 'True_Neutrino_Energy', 'x_units': 'log10(GeV)', 'y_units': 'Degrees'})
+	values = []
+	labels = []
+	for angle in ['azimuth', 'zenith']:
+		for table, name in RECOS:
+			values.append({'column': ['NuPrimary', angle], 'minus': [table, angle], 'abs': True,
+				'wrap': angle == 'azimuth'})
+			labels.append('{} {}'.format(name, angle.title()))
+	# (not fig_abs_truerecon.png, that one belongs to reu.py diff-absdiff, and the two
+	# would keep overwriting each other's figure and figure_cache.py sidecar)
+	figures.append({'kind': 'hist', 'output': 'abs_truerecon.png', 'values': values, 'labels': labels,
+		'transform': 'deg', 'bins': [0, 180, 181], 'xlabel': 'Absolute(True-Recon) [deg]', 'log': True})
+	return figures
+
+
+DEFAULT_FIGURES = default_figures()
+
+
+def value_columns(value):
+	if isinstance(value, dict):
+		return [tuple(value['column'])] + ([tuple(value['minus'])] if 'minus' in value else [])
+	return [tuple(value)]
+
+
+def figure_columns(figure):
+	"""
+	All (table, field) columns one figure needs
+	"""
+	values = []
+	if figure['kind'] == 'hist':
+		values = figure['values']
+	elif figure['kind'] == 'contour':
+		values = [figure['x'], figure['y']]
+	elif figure['kind'] == 'slices':
+		values = [figure['truth'], figure['reco1'], figure['x']] + ([figure['reco2']] if 'reco2' in figure else [])
+	else:
+		raise ValueError('Unknown figure kind {}'.format(figure['kind']))
+	columns = []
+	for value in values:
+		columns += value_columns(value)
+	return columns
+
+
+def get_values(data, value, transform=None):
+	"""
+	The numbers for one value of a figure (a column, or the difference of two)
+	"""
+	transform = TRANSFORMS[transform]
+	if not isinstance(value, dict):
+		return transform(data[tuple(value)])
+	values = transform(data[tuple(value['column'])])
+	if 'minus' in value:
+		values = values - transform(data[tuple(value['minus'])])
+	if value.get('wrap', False):
+		values = wrap_degrees(values)
+	if value.get('abs', False):
+		values = np.abs(values)
+	return values
+
+
+def draw_hist(figure, data):
+	import matplotlib.pyplot as plt
+	fig = plt.figure(figsize=(5,5))
+	ax = fig.add_subplot(111)
+	bins = np.linspace(*figure['bins'])
+	labels = figure.get('labels', [None] * len(figure['values']))
+	for value, label in zip(figure['values'], labels):
+		Histogram1D(bins).fill(get_values(data, value, figure.get('transform'))).draw(ax, alpha=0.5, label=label)
+	if figure.get('log', False):
+		ax.set_yscale('log')
+	ax.set_ylabel(figure.get('ylabel', 'Number of Events'))
+	ax.set_xlabel(figure.get('xlabel', ''))
+	if labels[0] is not None:
+		ax.legend()
+	plt.tight_layout()
+	with stage('savefig'):
+		fig.savefig(figure['output'], dpi=figure.get('dpi', 300))
+	plt.close(fig)
+
+
+def draw_contour(figure, data):
+	import matplotlib.pyplot as plt
+	import matplotlib.colors as colors
+	x_values = get_values(data, figure['x'], figure.get('transform'))
+	y_values = get_values(data, figure['y'], figure.get('transform'))
+	bins = np.linspace(*figure['bins'])
+
+	fig = plt.figure(figsize=(6,5))
+	ax = fig.add_subplot(111)
+	hist = Histogram2D(bins, bins)
+	hist.fill(x_values, y_values)
+	counts, xedges, yedges, im = hist.draw(ax, cmin=1, norm=colors.LogNorm())
+	x, y_med, y_lo, y_hi = find_contours_2D(x_values=x_values, y_values=y_values, xbins=xedges)
+	ax.plot(x, y_med, 'r-', label='Median')
+	ax.plot(x, y_lo, 'r-.', label='68% contour')
+	ax.plot(x, y_hi, 'r-.')
+	cbar = plt.colorbar(im, ax=ax)
+	cbar.set_label('Number of Events')
+	ax.set_ylabel(figure.get('ylabel', ''))
+	ax.set_xlabel(figure.get('xlabel', ''))
+	ax.legend()
+	if 'title' in figure:
+		ax.set_title(figure['title'])
+	plt.tight_layout()
+	with stage('savefig'):
+		fig.savefig(figure['output'], dpi=figure.get('dpi', 300))
+	plt.close(fig)
+
+
+def draw_slices(figure, data):
+	import matplotlib.pyplot as plt
+	truth = get_values(data, figure['truth'], figure.get('transform'))
+	xarray = get_values(data, figure['x'], figure.get('x_transform'))
+	reco2 = None
+	if 'reco2' in figure:
+		reco2 = get_values(data, figure['reco2'], figure.get('transform'))
+	plot_1d_binned_slices(truth=truth,
+		reco1=get_values(data, figure['reco1'], figure.get('transform')),
+		reco2=reco2,
+		truth2=truth,
+		xarray1=xarray,
+		plot_resolution=True,
+		bins=figure.get('bins', 10),
+		xmin=np.min(xarray),
+		xmax=np.max(xarray),
+		x_name=figure.get('x_name', ''),
+		x_units=figure.get('x_units', ''),
+		y_units=figure.get('y_units'),
+		reco1_name=figure.get('reco1_name', 'Reco 1'),
+		reco2_name=figure.get('reco2_name', 'Reco 2'),
+		save=False)
+	with stage('savefig'):
+		plt.savefig(figure['output'], dpi=figure.get('dpi', 100))
+	plt.close('all')
+
+
+DRAW = {
+	'hist': draw_hist,
+	'contour': draw_contour,
+	'slices': draw_slices,
+}
+
+# the loaded columns and the figures, set before the pool is started,
+# so the forked workers can just read them
+shared = {}
+
+
+def render(index):
+	"""
+	Draw figure number index (this runs in the workers)
+	Returns:
+		output file name, and how many seconds it took
+	"""
+	figure = shared['figures'][index]
+	start = time.time()
+	with stage('draw ' + figure['kind']):
+		DRAW[figure['kind']](figure, shared['data'])
+	return figure['output'], time.time() - start
+
+
+def render_all(data, figures, processes=1):
+	"""
+	Draw all figures, processes at a time
+	Returns:
+		list of (output file name, seconds) in the order of figures
+	"""
+	shared['data'] = data
+	shared['figures'] = figures
+	# import matplotlib once here, instead of once in every worker
+	import matplotlib.pyplot
+	if processes == 1:
+		return [render(index) for index in range(len(figures))]
+	with multiprocessing.get_context('fork').Pool(processes) as pool:
+		return pool.map(render, range(len(figures)), chunksize=1)
+
+
+def load_spec(path):
+	with open(path) as f:
+		return json.load(f)
+
+
+def run(args):
+	"""
+	Load the columns of every figure once, and draw them all (args are the parsed arguments from reu.py)
+	"""
+	figures = load_spec(args.spec) if args.spec is not None else DEFAULT_FIGURES
+	if args.output_dir is not None:
+		os.makedirs(args.output_dir, exist_ok=True)
+		figures = [dict(figure, output=os.path.join(args.output_dir, figure['output'])) for figure in figures]
+
+	# only draw the figures that changed since the last time (the figure itself,
+	# the files, the selection, the code, ...), and only load what those need
+	cache = from_args(args)
+	figures = [figure for figure in figures if not cache.fresh(figure['output'], figure_columns(figure), figure)]
+	if not figures:
+		return
+
+	columns = []
+	for figure in figures:
+		columns += figure_columns(figure)
+	columns = list(dict.fromkeys(columns))
+
+	start = time.time()
+	data = load_columns(args.input_files, columns, jobs=args.jobs, cache_dir=args.cache_dir,
+		selection=args.selection, join=args.join, dtype_policy=args.dtype_policy)
+	print('Loaded {} columns in {:.2f} s'.format(len(columns), time.time() - start))
+
+	start = time.time()
+	times = render_all(data, figures, processes=args.processes)
+	for output, seconds in times:
+		print('  {:7.2f} s  {}'.format(seconds, output))
+		# (the workers are gone by now, so the sidecars are written here)
+		cache.record(output)
+	print('Drew {} figures in {:.2f} s'.format(len(figures), time.time() - start))
+
+
+if __name__ == '__main__':
+	# the arguments are the same as for python reu.py batch
+	import sys
+	import reu
+	reu.main(['batch'] + sys.argv[1:])
@@ -0,0 +1,126 @@
+import numpy as np
+from histograms import Histogram1D, Histogram2D
+from quantile_sketch import QuantileSketch
+from streaming import Stream, to_degrees, to_log10, add_resolution
+from instrumentation import stage
+from figure_cache import from_args
+
+# the same plots as plot_contours_poster.py (and the opening angles from plot_diff_absdiff.py),
+# but made while streaming through the files a block at a time, so any number of
+# files (even several datasets at once) can go in without running out of memory
+
+RECOS = [('EHEOpheliaParticleSRT_ImpLF', 'Ophelia'), ('LineFit', 'LineFit')]
+
+
+def run(args):
+	"""
+	Stream through the files and make the plots, args are the parsed arguments from reu.py
+	"""
+	import matplotlib.pyplot as plt
+	import matplotlib.colors as colors
+	from plot_contour import find_contours_2D, plot_1d_binned_slices, slices_savename
+
+	columns = [('NuPrimary', 'zenith'), ('NuPrimary', 'azimuth'), ('NuPrimary', 'energy')]
+	for table, name in RECOS:
+		columns += [(table, 'zenith'), (table, 'azimuth')]
+	stream = Stream(columns)
+
+	# what happens to every block: the resolutions first (they need radians), then degrees and log10(energy)
+	for table, name in RECOS:
+		stream.add_step(add_resolution(name, 'NuPrimary', table))
+	stream.add_step(to_degrees(*[column for column in columns if column[1] != 'energy']))
+	stream.add_step(to_log10(('NuPrimary', 'energy')))
+
+	# and what we keep from every block: histograms and quantile sketches, which don't grow with the events
+	bins = np.linspace(0,180,91)
+	energy_bins = np.linspace(args.energy_range[0], args.energy_range[1], 10)
+	hists = {}
+	sketches = {}
+	resolution_sketches = {}
+	opening_hists = {}
+	for table, name in RECOS:
+		hists[name] = stream.add_fill(Histogram2D(bins, bins), ('NuPrimary', 'zenith'), (table, 'zenith'))
+		sketches[name] = stream.add_fill(QuantileSketch(bins, 0, 180, n_cells=1800),
+			('NuPrimary', 'zenith'), (table, 'zenith'))
+		resolution_sketches[name] = stream.add_fill(QuantileSketch(energy_bins, -180, 180, n_cells=3600),
+			('NuPrimary', 'energy'), name + '_delta_zenith')
+		opening_hists[name] = stream.add_fill(Histogram1D(np.linspace(0,180,181)), name + '_opening_angle')
+
+	# all of the plots come out of the same pass through the files, so the stream is
+	# only skipped if every one of them is up to date (nothing changed since the last time)
+	figures = from_args(args)
+	params = {'plot': 'stream', 'bins': bins, 'energy_bins': energy_bins}
+	contour_files = ['stream_zenith_{}.png'.format(name.lower()) for table, name in RECOS]
+	# (with stream_ in front, so it isn't the same file as the one the poster makes)
+	slices_file = 'stream_' + slices_savename('True_Energy', plot_resolution=True, reco2_name='LineFit') + '.png'
+	fresh = [figures.fresh(output, columns, params) for output in
+		contour_files + [slices_file, 'stream_opening_angle.png']]
+	if all(fresh):
+		return
+
+	stream.run(args.input_files, chunk_rows=args.chunk_rows, selection=args.selection, jobs=args.jobs,
+		dtype_policy=args.dtype_policy)
+	print('Streamed {:.0f} events'.format(opening_hists[RECOS[0][1]].counts.sum()))
+
+	# 2D histogram with the median and 68% contours, one per reconstruction
+	for table, name in RECOS:
+		fig = plt.figure(figsize=(6,5))
+		ax = fig.add_subplot(111)
+		counts, xedges, yedges, im = hists[name].draw(ax,
+			cmin=1,
+			norm=colors.LogNorm()
+			)
+		x, y_med, y_lo, y_hi = find_contours_2D(None, None, None, sketch=sketches[name])
+		ax.plot(x, y_med, 'r-', label='Median')
+		ax.plot(x, y_lo, 'r-.', label='68% contour')
+		ax.plot(x, y_hi, 'r-.')
+		cbar = plt.colorbar(im, ax=ax)
+		cbar.set_label('Number of Events')
+		ax.set_ylabel('Reco Zenith')
+		ax.set_xlabel('True Zenith')
+		ax.legend()
+		plt.title('{} Recon'.format(name))
+		plt.tight_layout()
+		with stage('savefig'):
+			fig.savefig('stream_zenith_{}.png'.format(name.lower()), dpi=300)
+		figures.record('stream_zenith_{}.png'.format(name.lower()))
+		plt.close(fig)
+
+	# zenith resolution in slices of true energy, straight from the sketches
+	plot_1d_binned_slices(truth=None,
+		reco1=resolution_sketches['Ophelia'],
+		reco2=resolution_sketches['LineFit'],
+		plot_resolution=True,
+		x_name='True_Energy',
+		x_units='log10(GeV)',
+		y_units='Degrees',
+		reco1_name='Ophelia',
+		reco2_name='LineFit',
+		save=False
+		)
+	with stage('savefig'):
+		plt.savefig(slices_file)
+	figures.record(slices_file)
+	plt.close('all')
+
+	# how far off the direction is, all in one number
+	fig = plt.figure(figsize=(5,5))
+	ax = fig.add_subplot(111)
+	for table, name in RECOS:
+		opening_hists[name].draw(ax, alpha=0.5, label=name)
+	ax.set_yscale('log')
+	ax.set_ylabel('Number of Events')
+	ax.set_xlabel('Opening angle between Recon and True [deg]')
+	ax.legend()
+	plt.tight_layout()
+	with stage('savefig'):
+		fig.savefig('stream_opening_angle.png', dpi=300)
+	figures.record('stream_opening_angle.png')
+	plt.close(fig)
+
+
+if __name__ == '__main__':
+	# the arguments are the same as for python reu.py stream
+	import sys
+	import reu
+	reu.main(['stream'] + sys.argv[1:])
@@ -0,0 +1,173 @@
+"""
+Streaming, mergeable quantile sketch for the median / 68% contour bands
+
+find_contours_2D and plot_1d_binned_slices need every event in memory to
+compute exact percentiles. A QuantileSketch instead keeps, for every x bin,
+a fine histogram of the y values on a fixed grid from ymin to ymax. Events
+can be added one chunk at a time (for example while going through the hdf5
+files with load_hdf5.iter_chunks), sketches filled by different workers can
+be added together with merge, and the memory used only depends on the number
+of x bins and grid cells, not on the number of events.
+
+Error bound:
+	The sketch only knows which grid cell every event is in, so its
+	resolution is one grid cell, (ymax - ymin) / n_cells. That is NOT a bound
+	on how far a sketch percentile is from numpy.percentile: numpy.percentile
+	interpolates between the two events next to the wanted rank, and in a bin
+	with few events those two can be many cells apart. error_bounds(percentiles)
+	gives a bound that does hold, bin by bin: it finds the cells the two events
+	next to the rank are in, and returns how far the sketch value can be from
+	anything between the start of the first and the end of the second cell.
+	(This holds for unweighted events inside [ymin, ymax]. Events outside of
+	it are counted in the first or last cell, and with weights there is no
+	single "exact" percentile to compare with.)
+
+Example:
+	sketch = QuantileSketch(xbins=np.linspace(0,180,91), ymin=0, ymax=180, n_cells=1800)
+	for file, chunk in iter_chunks(files, [('NuPrimary','zenith'), ('LineFit','zenith')]):
+		sketch.update(np.rad2deg(chunk['NuPrimary','zenith']), np.rad2deg(chunk['LineFit','zenith']))
+	lower, median, upper = sketch.quantiles([16, 50, 84])
+"""
+
+import numpy
+
+from histograms import bin_index
+from instrumentation import staged
+
+
+class QuantileSketch(object):
+	"""
+	Per-x-bin histogram of y on a fixed grid, used to estimate percentiles
+	Receives:
+		xbins = x bin edges (same meaning as in find_contours_2D, bin i is [xbins[i], xbins[i+1]))
+		ymin, ymax = range of the y grid
+		n_cells = number of grid cells between ymin and ymax (more cells = smaller error)
+	"""
+
+	def __init__(self, xbins, ymin, ymax, n_cells=1000):
+		self.xbins = numpy.asarray(xbins, dtype=float)
+		self.ymin = float(ymin)
+		self.ymax = float(ymax)
+		self.n_cells = int(n_cells)
+		assert self.ymax > self.ymin, "ymax has to be bigger than ymin"
+		self.counts = numpy.zeros((len(self.xbins) - 1, self.n_cells))
+
+	@property
+	def cell_width(self):
+		return (self.ymax - self.ymin) / self.n_cells
+
+	@property
+	def resolution(self):
+		"""
+		Width of one grid cell, the smallest difference the sketch can see
+		(only a resolution, not a guarantee, see error_bounds for that)
+		"""
+		return self.cell_width
+
+	@staged('sketch')
+	def update(self, x_values, y_values, weights=None):
+		"""
+		Add a chunk of events to the sketch
+		"""
+		x_values = numpy.asarray(x_values)
+		y_values = numpy.asarray(y_values)
+		n_bins = len(self.xbins) - 1
+		xi = bin_index(x_values, self.xbins)
+		inside = (xi >= 0) & (xi < n_bins)
+		yi = numpy.floor((y_values - self.ymin) / self.cell_width)
+		yi = numpy.clip(yi, 0, self.n_cells - 1).astype(numpy.int64)
+		flat = xi[inside] * self.n_cells + yi[inside]
+		if weights is not None:
+			weights = numpy.asarray(weights)[inside]
+		self.counts += numpy.bincount(flat, weights=weights,
+			minlength=self.counts.size).reshape(self.counts.shape)
+		return self
+
+	# same name as Histogram1D/Histogram2D.fill, so a sketch can be filled like a histogram
+	fill = update
+
+	def compatible(self, other):
+		return (numpy.array_equal(self.xbins, other.xbins) and self.ymin == other.ymin
+			and self.ymax == other.ymax and self.n_cells == other.n_cells)
+
+	def merge(self, other):
+		"""
+		Add the events of another sketch (with the same bins and grid) into this one
+		"""
+		assert self.compatible(other), "can only merge sketches with the same bins and grid"
+		self.counts += other.counts
+		return self
+
+	def quantiles(self, percentiles):
+		"""
+		Estimate percentiles of y in every x bin
+		Receives:
+			percentiles = list of percentiles (0 - 100)
+		Returns:
+			array with shape (len(percentiles), number of x bins), NaN for empty bins
+		"""
+		percentiles = numpy.asarray(percentiles, dtype=float).reshape(-1, 1)
+		n_bins = len(self.counts)
+		cumulative = numpy.cumsum(self.counts, axis=1)
+		totals = cumulative[:, -1]
+		good = totals > 0
+		# running fraction of the events in each x bin goes from 0 to 1 along a row,
+		# so (row number + fraction) increases along the whole flattened array
+		# and one searchsorted finds the cell of every percentile in every bin
+		running = cumulative / numpy.where(good, totals, 1.)[:, None]
+		key = (numpy.arange(n_bins)[:, None] + running).ravel()
+		fraction_wanted = percentiles / 100.
+		target = numpy.arange(n_bins) + fraction_wanted
+		flat = numpy.searchsorted(key, target.ravel(), side='left').reshape(target.shape)
+		cell = numpy.clip(flat - numpy.arange(n_bins) * self.n_cells, 0, self.n_cells - 1)
+		rows = numpy.broadcast_to(numpy.arange(n_bins), cell.shape)
+		before = numpy.where(cell > 0, running[rows, cell - 1], 0.)
+		in_cell = running[rows, cell] - before
+		# assume the events are spread evenly inside the cell
+		with numpy.errstate(divide='ignore', invalid='ignore'):
+			fraction = numpy.where(in_cell > 0, (fraction_wanted - before) / in_cell, 0.)
+		values = self.ymin + (cell + numpy.clip(fraction, 0., 1.)) * self.cell_width
+		values[:, ~good] = numpy.nan
+		return values
+
+	def error_bounds(self, percentiles):
+		"""
+		Largest possible difference between quantiles(percentiles) and numpy.percentile of the events in each bin
+		(for unweighted events inside [ymin, ymax], see the top of this file)
+		Receives:
+			percentiles = list of percentiles (0 - 100)
+		Returns:
+			array with shape (len(percentiles), number of x bins), NaN for empty bins
+		"""
+		percentiles = numpy.asarray(percentiles, dtype=float).reshape(-1, 1)
+		n_bins = len(self.counts)
+		cumulative = numpy.cumsum(self.counts, axis=1)
+		totals = cumulative[:, -1]
+		# numpy.percentile sits between the events of (0-based) rank floor(r) and ceil(r)
+		rank = (totals - 1) * percentiles / 100.
+		# same trick as in quantiles: shift every row up so the flattened counts keep increasing,
+		# then one searchsorted finds the cell that holds the event of a given rank in every bin
+		offset = numpy.arange(n_bins) * (totals.max() + 1.)
+		key = (cumulative + offset[:, None]).ravel()
+
+		def cell_of(event_rank):
+			flat = numpy.searchsorted(key, (event_rank + offset).ravel(), side='right').reshape(event_rank.shape)
+			return numpy.clip(flat - numpy.arange(n_bins) * self.n_cells, 0, self.n_cells - 1)
+
+		lowest = self.ymin + cell_of(numpy.floor(rank)) * self.cell_width
+		highest = self.ymin + (cell_of(numpy.ceil(rank)) + 1) * self.cell_width
+		values = self.quantiles(percentiles.ravel())
+		bounds = numpy.maximum(numpy.abs(values - lowest), numpy.abs(highest - values))
+		bounds[:, totals <= 0] = numpy.nan
+		return bounds
+
+	def median_band(self, percentile_in_peak=68.27):
+		"""
+		Median and central percentile band in every x bin, like binned_stats.binned_median_band
+		Returns:
+			medians, lower, upper = one value per bin, NaN for empty bins
+		"""
+		left_tail_percentile  = (100.-percentile_in_peak)/2
+		right_tail_percentile = 100.-left_tail_percentile
+		medians, lower, upper = self.quantiles([50., left_tail_percentile, right_tail_percentile])
+		return medians, lower, upper
@@ -0,0 +1,101 @@
+"""
+How far off a reconstructed direction is from the true one
+
+Subtracting two azimuths directly gives nonsense near 0/360 degrees: true 359
+and reco 1 are 2 degrees apart, not 358. And azimuth and zenith errors on
+their own don't say how far apart the two directions are on the sky (near
+the poles a big azimuth error is a tiny angle). So here we compute, from the
+zenith and azimuth (in radians, as the hdf5 files have them):
+	delta_azimuth = reco - true azimuth, wrapped into [-180, 180) degrees
+	delta_zenith = reco - true zenith, in degrees
+	opening_angle = the angle between the two directions, in degrees (0 - 180)
+
+The opening angle uses the haversine formula,
+	2 arcsin( sqrt( sin^2(dzen/2) + sin(zen1) sin(zen2) sin^2(dazi/2) ) )
+which (unlike arccos of a dot product) stays accurate for the small angles
+we care most about.
+
+Everything is done a chunk of events at a time into arrays that are made once,
+so no full-length temporary arrays are made, and the outputs can be float32
+to use half the memory.
+"""
+
+import numpy
+
+from instrumentation import staged
+
+# number of events to work on at once
+CHUNK_ROWS = 65536
+
+
+def wrap_degrees(angles, out=None):
+	"""
+	Wrap angles in degrees into [-180, 180)
+	"""
+	out = numpy.add(angles, 180., out=out)
+	numpy.mod(out, 360., out=out)
+	out -= 180.
+	return out
+
+
+@staged('angular_resolution')
+def angular_resolution(true_zenith, true_azimuth, reco_zenith, reco_azimuth, dtype=numpy.float64,
+	chunk_rows=CHUNK_ROWS, out=None):
+	"""
+	Azimuth and zenith differences and opening angle between reconstructed and true directions
+	Receives:
+		true_zenith, true_azimuth, reco_zenith, reco_azimuth = arrays in radians
+		dtype = dtype of the outputs (e.g. numpy.float32 to save memory, the math is done in float64)
+		chunk_rows = number of events to work on at once
+		out = optional (delta_azimuth, delta_zenith, opening_angle) arrays to write into
+	Returns:
+		delta_azimuth, delta_zenith, opening_angle = arrays in degrees
+	"""
+	n = len(true_zenith)
+	if out is None:
+		out = tuple(numpy.empty(n, dtype=dtype) for _ in range(3))
+	delta_azimuth, delta_zenith, opening_angle = out
+
+	# scratch space, made once and reused for every chunk
+	chunk = min(chunk_rows, n)
+	dazi = numpy.empty(chunk)
+	dzen = numpy.empty(chunk)
+	a = numpy.empty(chunk)
+	b = numpy.empty(chunk)
+	c = numpy.empty(chunk)
+
+	for start in range(0, n, chunk_rows):
+		stop = min(start + chunk_rows, n)
+		m = stop - start
+		t_zen = true_zenith[start:stop]
+		r_zen = reco_zenith[start:stop]
+		d_a, d_z, s1, s2, s3 = dazi[:m], dzen[:m], a[:m], b[:m], c[:m]
+
+		# the differences, in radians for now
+		numpy.subtract(reco_azimuth[start:stop], true_azimuth[start:stop], out=d_a)
+		numpy.subtract(r_zen, t_zen, out=d_z)
+
+		# opening angle: sin^2(dzen/2) + sin(zen1) sin(zen2) sin^2(dazi/2)
+		numpy.multiply(d_z, 0.5, out=s1)
+		numpy.sin(s1, out=s1)
+		numpy.square(s1, out=s1)
+		numpy.multiply(d_a, 0.5, out=s2)
+		numpy.sin(s2, out=s2)
+		numpy.square(s2, out=s2)
+		s2 *= numpy.sin(t_zen, out=s3)
+		s2 *= numpy.sin(r_zen, out=s3)
+		s1 += s2
+		numpy.sqrt(s1, out=s1)
+		numpy.minimum(s1, 1., out=s1)
+		numpy.arcsin(s1, out=s1)
+		s1 *= 2.
+		numpy.rad2deg(s1, out=s1)
+		opening_angle[start:stop] = s1
+
+		numpy.rad2deg(d_z, out=d_z)
+		delta_zenith[start:stop] = d_z
+		numpy.rad2deg(d_a, out=d_a)
+		wrap_degrees(d_a, out=d_a)
+		delta_azimuth[start:stop] = d_a
+
+	return delta_azimuth, delta_zenith, opening_angle
@@ -0,0 +1,147 @@
+"""
+One command for all of the plotting scripts
+
+Instead of remembering which script takes which arguments, run e.g.
+	python reu.py variables -f file1.hdf5 file2.hdf5
+	python reu.py difference -f *.hdf5
+	python reu.py diff-absdiff -f *.hdf5 -j 4
+	python reu.py contour -f *.hdf5 --bootstrap 200
+	python reu.py poster -f *.hdf5 --cache-dir cache/
+	python reu.py batch -f *.hdf5 --spec my_figures.json --processes 8
+	python reu.py stream -f dataset1/*.hdf5 dataset2/*.hdf5 -j 8
+(the old way, python plot_contour.py -f ..., still works and ends up here too)
+
+Add --profile to any of them to see where the time and memory went (see instrumentation.py).
+Figures whose inputs haven't changed since the last run are skipped (see figure_cache.py),
+add --force to make them again anyway.
+
+Every subcommand shares the same loading arguments (-f, -j, --cache-dir,
+--selection, --join, --dtype-policy). numpy, h5py and matplotlib are only imported once a
+subcommand actually runs, so "python reu.py --help" is quick, and matplotlib
+always uses the Agg backend, which only writes files and never opens a window.
+"""
+
+import argparse
+import importlib
+import os
+
+# subcommand -> (module that does the work, short description)
+SUBCOMMANDS = {
+	'variables': ('plot_variables', 'distribution of the true and reconstructed azimuth'),
+	'difference': ('plot_difference', 'distribution of reco - true azimuth'),
+	'diff-absdiff': ('plot_diff_absdiff', '(absolute) true - reco azimuth and zenith of Ophelia and LineFit'),
+	'contour': ('plot_contour', 'true vs LineFit azimuth, with median and 68 percent contours'),
+	'poster': ('plot_contours_poster', 'true vs reco zenith for the poster, with charge and interaction cuts'),
+	'batch': ('plot_jobs', 'a whole list of figures from one load of the data (see plot_jobs.py)'),
+	'stream': ('plot_stream', 'poster-style zenith plots for any number of files, read a block at a time'),
+}
+
+POSTER_SELECTION = "Homogenized_QTot.value > 1e4 and I3MCWeightDict.InteractionType >= 1"
+
+
+def add_loader_arguments(parser, cache_and_join=True):
+	"""
+	The arguments every subcommand uses to load its data (see load_hdf5.load_columns)
+	(streaming reads the files block by block, so it has no --cache-dir or --join)
+	"""
+	# this time we are going to use nargs='+' to say "allow more than one argument"
+	parser.add_argument("-f", type=str, nargs='+',
+		dest="input_files", required=True,
+		help="paths to input files (absolute or relative)")
+	parser.add_argument("-j", "--jobs", type=int, default=1,
+		dest="jobs",
+		help="number of processes used to read the input files (default 1)")
+	parser.add_argument("--selection", type=str, default=None,
+		dest="selection",
+		help='only load events that pass this, e.g. "Homogenized_QTot.value > 1e4 and I3MCWeightDict.InteractionType >= 1"')
+	parser.add_argument("--dtype-policy", type=str, default="full", choices=["full", "compact"],
+		dest="dtype_policy",
+		help="full = keep the dtypes of the files, compact = float32 instead of float64 "
+			"and int8 for InteractionType, about half the memory (default full)")
+	if not cache_and_join:
+		return
+	parser.add_argument("--cache-dir", type=str, default=None,
+		dest="cache_dir",
+		help="folder to cache loaded columns in, so re-running on the same files is fast")
+	parser.add_argument("--join", action="store_true",
+		dest="join",
+		help="line up the tables by event header (Run, Event, ...) instead of assuming row i is the same event everywhere")
+
+
+def add_bootstrap_arguments(parser):
+	parser.add_argument("--bootstrap", type=int, default=0,
+		dest="bootstrap",
+		help="number of bootstrap resamples for an uncertainty on the medians (default 0, off)")
+	parser.add_argument("--seed", type=int, default=None,
+		dest="seed",
+		help="seed for the bootstrap random numbers")
+
+
+def add_batch_arguments(parser):
+	parser.add_argument("--spec", type=str, default=None,
+		dest="spec",
+		help="JSON file with the list of figures to make (default: plot_jobs.DEFAULT_FIGURES)")
+	parser.add_argument("--processes", type=int, default=1,
+		dest="processes",
+		help="number of figures to draw at the same time (default 1)")
+	parser.add_argument("--output-dir", type=str, default=None,
+		dest="output_dir",
+		help="folder to put the figures in (default: the current folder)")
+
+
+def add_stream_arguments(parser):
+	parser.add_argument("--chunk-rows", type=int, default=1000000,
+		dest="chunk_rows",
+		help="number of events each process reads at once, this sets how much memory is used (default 1000000)")
+	parser.add_argument("--energy-range", type=float, nargs=2, default=[5., 9.],
+		dest="energy_range", metavar=("MIN", "MAX"),
+		help="log10(GeV) range of the energy slices (default 5 9)")
+
+
+def add_profile_argument(parser):
+	parser.add_argument("--profile", type=str, nargs="?", default=None, const="reu_profile.json",
+		dest="profile", metavar="REPORT",
+		help="time every stage (reading, histograms, percentiles, savefig, ...) and write a JSON report "
+			"(default reu_profile.json), same as setting REU_PROFILE=REPORT")
+
+
+def add_force_argument(parser):
+	parser.add_argument("--force", action="store_true", dest="force",
+		help="make every figure again, even the ones that are up to date (see figure_cache.py)")
+
+
+def make_parser():
+	parser = argparse.ArgumentParser(description="Make the REU plots from hdf5 files made by create_hdf5.py")
+	subparsers = parser.add_subparsers(dest="command", metavar="command")
+	subparsers.required = True
+	for name, (module, description) in SUBCOMMANDS.items():
+		subparser = subparsers.add_parser(name, help=description, description=description)
+		add_loader_arguments(subparser, cache_and_join=(name != 'stream'))
+		if name in ['contour', 'poster']:
+			add_bootstrap_arguments(subparser)
+		if name == 'batch':
+			add_batch_arguments(subparser)
+		if name == 'stream':
+			add_stream_arguments(subparser)
+		add_profile_argument(subparser)
+		add_force_argument(subparser)
+	# the poster always had the charge and interaction type cuts, so they are its default selection
+	subparsers.choices['poster'].set_defaults(selection=POSTER_SELECTION)
+	return parser
+
+
+def main(argv=None):
+	args = make_parser().parse_args(argv)
+	# pick the backend before anything imports matplotlib.pyplot
+	os.environ['MPLBACKEND'] = 'Agg'
+	import instrumentation
+	if args.profile is not None:
+		instrumentation.enable(args.profile)
+	with instrumentation.stage(args.command):
+		with instrumentation.stage('import'):
+			module = importlib.import_module(SUBCOMMANDS[args.command][0])
+		module.run(args)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,159 @@
+"""
+Make whole-dataset plots without ever holding the whole dataset in memory
+
+load_columns reads every event of every file into memory before anything is
+plotted, so the memory needed grows with the number of -f files. A Stream
+instead goes through the files one block of rows at a time (with
+load_hdf5.iter_chunks), works out what it needs from that block (degrees,
+log10 of the energy, resolutions, ...), and adds it to "accumulators" that
+have a fixed size no matter how many events go into them: Histogram1D,
+Histogram2D (histograms.py) and QuantileSketch (quantile_sketch.py). Then the
+block is thrown away and the next one is read. So the memory used only
+depends on chunk_rows and the accumulators, not on the number of files.
+
+Accumulators can be added together (merge), so with jobs > 1 the files are
+spread over a pool of processes, and their accumulators are merged at the end.
+
+Example:
+	stream = Stream([('NuPrimary', 'zenith'), ('LineFit', 'zenith')])
+	stream.add_step(to_degrees(('NuPrimary', 'zenith'), ('LineFit', 'zenith')))
+	hist = stream.add_fill(Histogram2D(bins, bins), ('NuPrimary', 'zenith'), ('LineFit', 'zenith'))
+	stream.run(files, jobs=4)
+	hist.draw(ax)
+"""
+
+import multiprocessing
+
+import numpy as np
+
+from instrumentation import stage
+from load_hdf5 import iter_chunks, CHUNK_ROWS
+from resolution import angular_resolution
+
+
+def to_degrees(*columns):
+	"""
+	Step that converts the given columns from radians to degrees
+	"""
+	def step(chunk):
+		return {column: np.rad2deg(chunk[column]) for column in columns}
+	return step
+
+
+def to_log10(*columns):
+	"""
+	Step that replaces the given columns by their log10
+	"""
+	def step(chunk):
+		return {column: np.log10(chunk[column]) for column in columns}
+	return step
+
+
+def add_resolution(name, true_table, reco_table, dtype=np.float32):
+	"""
+	Step that adds name + '_delta_azimuth', '_delta_zenith' and '_opening_angle' (see resolution.py)
+	(it needs the zenith and azimuth of both tables, in radians, so put it before to_degrees)
+	"""
+	def step(chunk):
+		delta_azimuth, delta_zenith, opening_angle = angular_resolution(
+			chunk[true_table, 'zenith'], chunk[true_table, 'azimuth'],
+			chunk[reco_table, 'zenith'], chunk[reco_table, 'azimuth'], dtype=dtype)
+		return {name + '_delta_azimuth': delta_azimuth, name + '_delta_zenith': delta_zenith,
+			name + '_opening_angle': opening_angle}
+	return step
+
+
+class Stream(object):
+	"""
+	Read columns block by block, run steps on every block, and fill accumulators
+	Receives:
+		columns = list of (table, field) pairs to read
+	"""
+
+	def __init__(self, columns):
+		self.columns = list(columns)
+		self.steps = []
+		self.fills = []
+
+	def add_step(self, step):
+		"""
+		Add a function step(chunk) that returns a dict of new (or replaced) values for the chunk
+		"""
+		self.steps.append(step)
+		return step
+
+	def add_fill(self, accumulator, *names, weights=None):
+		"""
+		Fill accumulator with the values called names (and weights) from every chunk
+		Receives:
+			accumulator = anything with fill(*values, weights=...), merge(other) and a counts array
+				(Histogram1D, Histogram2D, QuantileSketch)
+			names = keys of the chunk to fill with, columns like ('LineFit', 'zenith') or names made by a step
+			weights = optional key of the chunk to use as weights
+		Returns:
+			accumulator (so it can be used after run)
+		"""
+		self.fills.append((accumulator, names, weights))
+		return accumulator
+
+	def process(self, chunk):
+		"""
+		Run the steps on one chunk and fill the accumulators with it
+		"""
+		chunk = dict(chunk)
+		with stage('steps'):
+			for step in self.steps:
+				chunk.update(step(chunk))
+		for accumulator, names, weights in self.fills:
+			accumulator.fill(*[chunk[name] for name in names],
+				weights=None if weights is None else chunk[weights])
+
+	def accumulators(self):
+		return [accumulator for accumulator, _, _ in self.fills]
+
+	def run(self, files, chunk_rows=CHUNK_ROWS, selection=None, jobs=1, dtype_policy='full'):
+		"""
+		Go through all of the files
+		Receives:
+			files = list of paths to hdf5 files
+			chunk_rows = largest number of rows to have in memory at once (per process)
+			selection = optional selection string (see load_hdf5.parse_selection)
+			jobs = number of processes, the files are spread over them
+			dtype_policy = 'full' or 'compact' (see load_hdf5.load_columns), the dtypes of the chunks
+		Returns:
+			self, with the accumulators filled
+		"""
+		files = list(files)
+		if jobs == 1 or len(files) < 2:
+			for file, chunk in iter_chunks(files, self.columns, chunk_rows=chunk_rows, selection=selection,
+				dtype_policy=dtype_policy):
+				self.process(chunk)
+			return self
+		# the workers are forked, so they get a copy of this stream (steps and all) without pickling it
+		shared['stream'] = self
+		shared['chunk_rows'] = chunk_rows
+		shared['selection'] = selection
+		shared['dtype_policy'] = dtype_policy
+		with multiprocessing.get_context('fork').Pool(min(jobs, len(files))) as pool:
+			for accumulators in pool.imap_unordered(run_file, files):
+				with stage('merge'):
+					for accumulator, other in zip(self.accumulators(), accumulators):
+						accumulator.merge(other)
+		return self
+
+
+# set before the pool is started, so the forked workers can see it
+shared = {}
+
+
+def run_file(file):
+	"""
+	Fill fresh copies of the accumulators with one file (this runs in the workers)
+	"""
+	stream = shared['stream']
+	for accumulator in stream.accumulators():
+		accumulator.counts = np.zeros_like(accumulator.counts)
+	for _, chunk in iter_chunks([file], stream.columns, chunk_rows=shared['chunk_rows'],
+		selection=shared['selection'], dtype_policy=shared['dtype_policy']):
+		stream.process(chunk)
+	return stream.accumulators()
@@ -0,0 +1,229 @@
+"""
+Make fake hdf5 files that look like the ones create_hdf5.py writes
+
+The real files need cvmfs (to run create_hdf5.py) and the simulation on
+/mnt/research, so without those there is nothing to try the plotting scripts
+(or benchmark.py) on. This writes files with the same tables and fields that
+I3HDFWriter gives us:
+	I3EventHeader, NuPrimary, LineFit, EHEOpheliaParticleSRT_ImpLF,
+	Homogenized_QTot, I3MCWeightDict
+every row starting with Run, Event, SubEvent, SubEventStream and exists,
+and the angles in radians, like in the real files.
+
+The numbers are made up, but in a way that makes the plots look sensible:
+	- the neutrinos come from every direction equally, log10(energy / GeV) is flat between 5 and 9
+	- LineFit and Ophelia are the true direction smeared by a few degrees
+	  (less at higher energy, Ophelia better than LineFit), and a few percent of
+	  the events are badly reconstructed and point anywhere
+	- the charge (Homogenized_QTot) grows with the energy, so the 1e4 cut of the poster keeps some events
+	- InteractionType is 1 (CC), 2 (NC) or 3 (GR)
+
+Every file is made a block of rows at a time, so even huge files don't need much memory.
+
+Run like:
+	python synthetic_data.py -o /tmp/reu_data --files 4 --events 1e6
+and then e.g.
+	python reu.py poster -f /tmp/reu_data/*.hdf5
+"""
+
+import argparse
+import os
+
+import h5py
+import numpy as np
+
+from atomic_files import replace_when_done
+
+# the columns I3HDFWriter puts in front of every table
+HEADER_FIELDS = [('Run', '<u4'), ('Event', '<u4'), ('SubEvent', '<u4'), ('SubEventStream', '<u4'), ('exists', 'u1')]
+
+# what an I3Particle turns into
+PARTICLE_FIELDS = HEADER_FIELDS + [('x', '<f8'), ('y', '<f8'), ('z', '<f8'), ('time', '<f8'),
+	('zenith', '<f8'), ('azimuth', '<f8'), ('energy', '<f8'), ('length', '<f8'), ('speed', '<f8'),
+	('type', '<i4'), ('location', '<i4'), ('shape', '<i4'), ('fit_status', '<i4'),
+	('major_id', '<u8'), ('minor_id', '<i4')]
+
+TABLES = {
+	'I3EventHeader': HEADER_FIELDS + [('time_start_utc_daq', '<u8'), ('time_start_mjd_day', '<i4'),
+		('time_start_mjd_sec', '<i4'), ('time_start_mjd_ns', '<f8'), ('time_end_utc_daq', '<u8'),
+		('time_end_mjd_day', '<i4'), ('time_end_mjd_sec', '<i4'), ('time_end_mjd_ns', '<f8')],
+	'NuPrimary': PARTICLE_FIELDS,
+	'LineFit': PARTICLE_FIELDS,
+	'EHEOpheliaParticleSRT_ImpLF': PARTICLE_FIELDS,
+	'Homogenized_QTot': HEADER_FIELDS + [('value', '<f8')],
+	'I3MCWeightDict': HEADER_FIELDS + [('InteractionType', '<f8'), ('OneWeight', '<f8'),
+		('PrimaryNeutrinoEnergy', '<f8'), ('NEvents', '<f8'), ('TotalWeight', '<f8')],
+}
+
+# reconstruction -> (angular error at 1e5 GeV in degrees, fraction of badly reconstructed events)
+RECOS = {
+	'LineFit': (10., 0.05),
+	'EHEOpheliaParticleSRT_ImpLF': (3., 0.02),
+}
+
+LOG10_ENERGY_RANGE = (5., 9.)
+
+# number of rows made at once
+BLOCK_ROWS = 1000000
+
+
+def directions(zenith, azimuth):
+	"""
+	Unit vectors (n, 3) for directions in radians
+	"""
+	sin_zenith = np.sin(zenith)
+	return np.stack([sin_zenith * np.cos(azimuth), sin_zenith * np.sin(azimuth), np.cos(zenith)], axis=1)
+
+
+def smear(rng, zenith, azimuth, sigma_deg):
+	"""
+	Move every direction by a random angle of about sigma_deg (sigma_deg can be an array)
+	(a small random 3D step and back onto the sphere, so it works at the poles too)
+	"""
+	vectors = directions(zenith, azimuth)
+	vectors += rng.normal(size=vectors.shape) * np.deg2rad(sigma_deg)[:, None]
+	vectors /= np.linalg.norm(vectors, axis=1)[:, None]
+	return np.arccos(np.clip(vectors[:, 2], -1., 1.)), np.mod(np.arctan2(vectors[:, 1], vectors[:, 0]), 2*np.pi)
+
+
+def make_block(rng, run, first_event, n):
+	"""
+	Rows first_event ... first_event+n-1 of every table
+	Returns:
+		dict that maps each table name to a structured array
+	"""
+	blocks = {table: np.zeros(n, dtype=fields) for table, fields in TABLES.items()}
+	for block in blocks.values():
+		block['Run'] = run
+		block['Event'] = np.arange(first_event, first_event + n)
+		block['exists'] = 1
+
+	# the neutrino: from every direction, flat in log10(energy)
+	zenith = np.arccos(rng.uniform(-1., 1., n))
+	azimuth = rng.uniform(0., 2*np.pi, n)
+	log10_energy = rng.uniform(*LOG10_ENERGY_RANGE, n)
+	energy = 10**log10_energy
+	primary = blocks['NuPrimary']
+	primary['zenith'] = zenith
+	primary['azimuth'] = azimuth
+	primary['energy'] = energy
+	primary['type'] = rng.choice([12, -12, 14, -14, 16, -16], n)
+	primary['minor_id'] = 1
+	primary['x'], primary['y'], primary['z'] = rng.uniform(-500., 500., (3, n))
+
+	# the reconstructions: smeared, less at high energy, and a few that went wrong
+	for table, (sigma_deg, bad_fraction) in RECOS.items():
+		sigma = sigma_deg * 10**(-0.1 * (log10_energy - LOG10_ENERGY_RANGE[0]))
+		reco = blocks[table]
+		reco['zenith'], reco['azimuth'] = smear(rng, zenith, azimuth, sigma)
+		bad = rng.random(n) < bad_fraction
+		reco['zenith'][bad] = np.arccos(rng.uniform(-1., 1., bad.sum()))
+		reco['azimuth'][bad] = rng.uniform(0., 2*np.pi, bad.sum())
+		reco['x'] = primary['x'] + rng.normal(0., 20., n)
+		reco['y'] = primary['y'] + rng.normal(0., 20., n)
+		reco['z'] = primary['z'] + rng.normal(0., 20., n)
+		reco['speed'] = 0.299792458
+		reco['energy'] = np.nan
+		reco['length'] = np.nan
+		reco['shape'] = 20  # InfiniteTrack
+
+	# about 1 photoelectron per 30 GeV, give or take a factor of 2
+	blocks['Homogenized_QTot']['value'] = 10**(log10_energy - 1.5 + rng.normal(0., 0.3, n))
+
+	weights = blocks['I3MCWeightDict']
+	weights['InteractionType'] = rng.choice([1., 2., 3.], n, p=[0.7, 0.29, 0.01])
+	weights['PrimaryNeutrinoEnergy'] = energy
+	weights['OneWeight'] = energy * rng.uniform(0.5, 1.5, n)
+	weights['NEvents'] = 1e5
+	weights['TotalWeight'] = rng.uniform(0., 1., n)
+
+	header = blocks['I3EventHeader']
+	header['time_start_mjd_day'] = 58849
+	header['time_start_mjd_sec'] = np.arange(first_event, first_event + n) % 86400
+	header['time_end_mjd_day'] = 58849
+	header['time_end_mjd_sec'] = header['time_start_mjd_sec']
+	header['time_end_mjd_ns'] = 10000.
+	return blocks
+
+
+def write_file(path, n_events, run=0, seed=0, compression=None, block_rows=BLOCK_ROWS):
+	"""
+	Write one fake file
+	Receives:
+		path = output hdf5 file
+		n_events = number of events (rows in every table)
+		run = run number of the events (also picks the random numbers, together with seed)
+		seed = seed for the random numbers, the same seed and run always give the same file
+		compression = optional gzip level (I3HDFWriter compresses too, but it makes reading slower)
+	"""
+	rng = np.random.default_rng([seed, run])
+	with replace_when_done(path) as tmp:
+		with h5py.File(tmp, 'w') as file_out:
+			datasets = {table: file_out.create_dataset(table, shape=(n_events,), dtype=fields, chunks=True,
+				compression='gzip' if compression else None, compression_opts=compression or None)
+				for table, fields in TABLES.items()}
+			for start in range(0, n_events, block_rows):
+				n = min(block_rows, n_events - start)
+				for table, block in make_block(rng, run, start, n).items():
+					datasets[table][start:start + n] = block
+	return path
+
+
+def file_events(path):
+	"""
+	Number of events in a fake file, or None if it doesn't exist (or isn't complete)
+	"""
+	if not os.path.exists(path):
+		return None
+	try:
+		with h5py.File(path, 'r') as file_in:
+			lengths = set(file_in[table].shape[0] for table in TABLES if table in file_in)
+			if len(lengths) != 1 or not all(table in file_in for table in TABLES):
+				return None
+			return lengths.pop()
+	except OSError:
+		return None
+
+
+def make_dataset(output_dir, n_files, events_per_file, seed=0, compression=None, first_run=1, overwrite=False):
+	"""
+	Write n_files fake files into output_dir (files that are already there with the right size are kept)
+	Returns:
+		list of the file paths
+	"""
+	os.makedirs(output_dir, exist_ok=True)
+	paths = []
+	for i in range(n_files):
+		run = first_run + i
+		path = os.path.join(output_dir, 'synthetic_{:06d}.hdf5'.format(run))
+		if overwrite or file_events(path) != events_per_file:
+			write_file(path, events_per_file, run=run, seed=seed, compression=compression)
+		paths.append(path)
+	return paths
+
+
+def count(text):
+	"""
+	argparse type for event counts, so 1e6 works as well as 1000000
+	"""
+	return int(float(text))
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Write fake hdf5 files in the format create_hdf5.py makes")
+	parser.add_argument("-o", "--output-dir", type=str, required=True,
+		help="folder to write the files to")
+	parser.add_argument("--files", type=int, default=1,
+		help="number of files (default 1)")
+	parser.add_argument("--events", type=count, default=100000,
+		help="number of events per file, e.g. 1e6 (default 1e5)")
+	parser.add_argument("--seed", type=int, default=0,
+		help="seed for the random numbers (default 0)")
+	parser.add_argument("--compression", type=int, default=None,
+		help="gzip compression level (default: no compression)")
+	parser.add_argument("--overwrite", action="store_true",
+		help="write the files again even if they are already there")
+	args = parser.parse_args()
+	paths = make_dataset(args.output_dir, args.files, args.events, seed=args.seed,
+		compression=args.compression, overwrite=args.overwrite)
+	print('{} files with {} events each in {}'.format(len(paths), args.events, args.output_dir))
@@ -0,0 +1,228 @@
+"""
+A shared queue of files to convert, that any number of jobs can work on
+
+run_cluster.pbs gives every array task a fixed set of files. If those files
+are much bigger (or smaller) than the others, some tasks run out of wall time
+while others sit idle. Here the files are put in a queue instead, and every
+task keeps taking the next file from it, one per core, until it is empty.
+
+The queue is just a folder (on a filesystem all nodes can see):
+	queue_dir/todo/     one small .task file per input, holding the input path
+	queue_dir/claimed/  tasks somebody is working on (named <host>.<pid>_<worker>.<name>.task)
+	queue_dir/done/     tasks that are finished
+	queue_dir/failed/   tasks that failed every retry
+A task is claimed by renaming it from todo/ into claimed/. A rename either
+fully happens or not at all, so if two jobs try to claim the same task, only
+one of them wins, and the other one just moves on to the next task.
+
+Outputs are written to a stage folder first (e.g. $TMPDIR on the node), and
+copied over to the output folder a batch at a time.
+
+Run like:
+	python work_queue.py fill -q /scratch/queue /data/21220/*.i3.zst
+	python work_queue.py work -q /scratch/queue -o /data/21220/hdf5 --stage $TMPDIR -j 8
+(see run_cluster_queue.pbs). If a job got killed, its claimed tasks can be put back with
+	python work_queue.py requeue -q /scratch/queue
+(only while no jobs are working on the queue).
+"""
+
+import argparse
+import os
+import shutil
+import socket
+import sys
+import threading
+import time
+import traceback
+
+import convert_local
+import manifest
+from atomic_files import replace_when_done
+
+FOLDERS = ['todo', 'claimed', 'done', 'failed']
+
+
+def fill_queue(queue_dir, input_files):
+	"""
+	Put one task per input file into the queue
+	Inputs that don't exist are refused (before anything is added), since
+	every worker that claimed their task would only fail on it.
+	"""
+	missing = [input_file for input_file in input_files if not os.path.isfile(input_file)]
+	if missing:
+		raise FileNotFoundError('input files not found: ' + ', '.join(missing))
+	for folder in FOLDERS:
+		os.makedirs(os.path.join(queue_dir, folder), exist_ok=True)
+	for input_file in input_files:
+		name = manifest.output_name(input_file) + '.task'
+		tmp = os.path.join(queue_dir, '.' + name + '.tmp')
+		with open(tmp, 'w') as f:
+			f.write(os.path.abspath(input_file) + '\n')
+		os.replace(tmp, os.path.join(queue_dir, 'todo', name))
+
+
+def claim_task(queue_dir, owner):
+	"""
+	Take the next task out of todo/
+	Returns:
+		path of the claimed task file, or None if the queue is empty
+	"""
+	todo = os.path.join(queue_dir, 'todo')
+	while True:
+		names = sorted(os.listdir(todo))
+		if not names:
+			return None
+		for name in names:
+			claimed = os.path.join(queue_dir, 'claimed', '{}.{}'.format(owner, name))
+			try:
+				os.rename(os.path.join(todo, name), claimed)
+			except FileNotFoundError:
+				# somebody else was faster, try the next one
+				continue
+			return claimed
+
+
+def finish_task(queue_dir, claimed, folder):
+	"""
+	Move a claimed task to done/ or failed/
+	"""
+	name = os.path.basename(claimed).split('.', 2)[2]
+	os.replace(claimed, os.path.join(queue_dir, folder, name))
+
+
+def requeue(queue_dir):
+	"""
+	Put all claimed tasks back into todo/ (for tasks of jobs that died)
+	"""
+	for name in os.listdir(os.path.join(queue_dir, 'claimed')):
+		os.replace(os.path.join(queue_dir, 'claimed', name),
+			os.path.join(queue_dir, 'todo', name.split('.', 2)[2]))
+
+
+def stage_out(batch, output_dir, manifest_path=None):
+	"""
+	Copy a batch of finished outputs from the stage folder to output_dir
+	Receives:
+		batch = list of (result dict of convert_local.convert_one, claimed task path)
+	"""
+	for result, _ in batch:
+		destination = os.path.join(output_dir, os.path.basename(result['output']))
+		with replace_when_done(destination, hidden=True) as tmp:
+			shutil.copyfile(result['output'], tmp)
+		os.remove(result['output'])
+	if manifest_path is not None:
+		manifest.record_outputs(manifest_path, [result['input'] for result, _ in batch], output_dir)
+
+
+def work(queue_dir, output_dir, stage_dir, jobs=1, retries=1, batch_size=10, log_dir=None,
+	create_hdf5=None, manifest_path=None, extra_args=()):
+	"""
+	Keep converting files from the queue, jobs at a time, until it is empty
+	Returns:
+		list of the result dicts of convert_local.convert_one, and the wall time in seconds
+	"""
+	if log_dir is None:
+		log_dir = os.path.join(output_dir, 'logs')
+	if create_hdf5 is None:
+		create_hdf5 = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'create_hdf5.py')
+	os.makedirs(output_dir, exist_ok=True)
+	os.makedirs(log_dir, exist_ok=True)
+	os.makedirs(stage_dir, exist_ok=True)
+
+	owner = '{}.{}'.format(socket.gethostname().split('.')[0], os.getpid())
+	lock = threading.Lock()
+	results = []
+	ready = []
+
+	def flush():
+		# copy whatever is ready (called with the lock held)
+		if ready:
+			stage_out(ready, output_dir, manifest_path)
+			for _, claimed in ready:
+				finish_task(queue_dir, claimed, 'done')
+			del ready[:]
+
+	def worker(number):
+		while True:
+			claimed = claim_task(queue_dir, '{}_{}'.format(owner, number))
+			if claimed is None:
+				return
+			with open(claimed) as f:
+				input_file = f.read().strip()
+			try:
+				result = convert_local.convert_one(input_file, stage_dir, log_dir, create_hdf5, retries, extra_args)
+			except Exception:
+				# e.g. the input went missing after it was queued: count it as failed instead
+				# of losing the worker and leaving the task in claimed/
+				traceback.print_exc()
+				result = {'input': input_file, 'output': None, 'ok': False, 'attempts': 0,
+					'seconds': 0., 'events': 0, 'bytes': 0}
+			print('{} {} ({:.1f} s, {} attempt(s))'.format('done  ' if result['ok'] else 'FAILED',
+				input_file, result['seconds'], result['attempts']), flush=True)
+			with lock:
+				results.append(result)
+				if not result['ok']:
+					finish_task(queue_dir, claimed, 'failed')
+					continue
+				ready.append((result, claimed))
+				if len(ready) >= batch_size:
+					flush()
+
+	start = time.time()
+	threads = [threading.Thread(target=worker, args=(number,)) for number in range(jobs)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	with lock:
+		flush()
+	return results, time.time() - start
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser()
+	parser.add_argument("command", choices=['fill', 'work', 'requeue'],
+		help="fill = add inputs to the queue, work = convert until the queue is empty, "
+			"requeue = put claimed tasks back")
+	parser.add_argument("inputs", nargs='*',
+		help="input i3 files (for fill)")
+	parser.add_argument("-q", "--queue", type=str, required=True,
+		help="queue folder, on a filesystem every job can see")
+	parser.add_argument("-o", "--output-dir", type=str,
+		help="folder the hdf5 files end up in (for work)")
+	parser.add_argument("--stage", type=str, default=os.environ.get('TMPDIR', '/tmp'),
+		help="folder to write the outputs to before copying them (default: $TMPDIR)")
+	parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+		help="number of conversions to run at the same time (default: number of cores)")
+	parser.add_argument("--retries", type=int, default=1,
+		help="how many more times to try a file that failed")
+	parser.add_argument("--batch", type=int, default=10,
+		help="copy the outputs to the output folder this many at a time")
+	parser.add_argument("--manifest", type=str, default=None,
+		help="manifest JSON file; fill skips inputs that are up to date, work records the finished ones")
+	parser.add_argument("--prune", action="store_true",
+		help="pass --prune on to create_hdf5.py")
+	args = parser.parse_intermixed_args()
+
+	if args.command == 'fill':
+		input_files = args.inputs
+		if args.manifest is not None:
+			if args.output_dir is None:
+				parser.error("fill with --manifest also needs -o")
+			input_files = manifest.stale_inputs(manifest.load_manifest(args.manifest), input_files, args.output_dir)
+		try:
+			fill_queue(args.queue, input_files)
+		except FileNotFoundError as error:
+			parser.error(str(error))
+		print('Added {} tasks to {}'.format(len(input_files), args.queue))
+	elif args.command == 'requeue':
+		requeue(args.queue)
+	else:
+		if args.output_dir is None:
+			parser.error("work needs -o")
+		extra_args = ['--prune'] if args.prune else []
+		results, wall_time = work(args.queue, args.output_dir, args.stage, jobs=args.jobs,
+			retries=args.retries, batch_size=args.batch, manifest_path=args.manifest, extra_args=extra_args)
+		convert_local.print_summary(results, wall_time)
+		if not all(result['ok'] for result in results):
+			sys.exit(1)